@@ -0,0 +1,215 @@
+"""
+Local admission store for gate validation.
+
+Admissions are checked and recorded atomically in a SQLite (WAL) database, so two
+gates on the same machine can never admit the same ticket. AdmissionWriter writes
+them back to the Airtable Tickets table in batches of 10 from a background thread.
+A batch that Airtable rejects is retried row by row, so one bad row cannot block the
+others; rows rejected ADMISSION_MAX_ATTEMPTS times are parked (kept locally, no more
+retries). Network errors, 429 and 5xx only back off: they never count as attempts.
+"""
+
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
+
+from airtable_client import upsert_records, AIRTABLE_BATCH_SIZE
+from app_logger import log_action
+from local_state import connect
+
+ADMISSIONS_DB = "gate.db"
+ADMISSION_MAX_ATTEMPTS = int(os.getenv("ADMISSION_MAX_ATTEMPTS", "10"))
+# Respostas do Airtable que recusam o próprio registo (contam para ADMISSION_MAX_ATTEMPTS)
+ROW_REJECTION_STATUS = {400, 422}
+
+
+def _is_rejection(exc: Exception) -> bool:
+    """True if Airtable refused the row itself; network errors, 429, 5xx and auth errors are transient."""
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status in ROW_REJECTION_STATUS
+
+
+class AdmissionStore:
+    """SQLite-backed record of admitted tickets and their Airtable write-back state."""
+
+    def __init__(self, filename: str = ADMISSIONS_DB):
+        self._conn = connect(filename)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS admissions (
+                ticket_id TEXT PRIMARY KEY,
+                gate TEXT,
+                validated_by TEXT,
+                admitted_at TEXT NOT NULL,
+                synced INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_admissions_synced ON admissions (synced)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_admissions_admitted_at ON admissions (admitted_at)")
+
+    def try_admit(self, ticket_id: str, gate: str = None, validated_by: str = None):
+        """
+        Atomically admit a ticket.
+        Returns: (admitted: bool, admission: dict) — admission is the existing row for duplicates.
+        """
+        admitted_at = datetime.now(tz=timezone.utc).isoformat()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO admissions (ticket_id, gate, validated_by, admitted_at) VALUES (?, ?, ?, ?)",
+                (ticket_id, gate, validated_by, admitted_at)
+            )
+            admitted = cursor.rowcount == 1
+        return admitted, self.get(ticket_id)
+
+    def get(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute("SELECT * FROM admissions WHERE ticket_id = ?", (ticket_id,)).fetchone()
+        return dict(row) if row else None
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            "SELECT * FROM admissions ORDER BY admitted_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def pending(self, limit: int = AIRTABLE_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """Unsynced rows below ADMISSION_MAX_ATTEMPTS, fewest attempts first."""
+        rows = self._conn.execute(
+            "SELECT * FROM admissions WHERE synced = 0 AND attempts < ? ORDER BY attempts, admitted_at LIMIT ?",
+            (ADMISSION_MAX_ATTEMPTS, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def pending_count(self) -> int:
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM admissions WHERE synced = 0 AND attempts < ?", (ADMISSION_MAX_ATTEMPTS,)
+        ).fetchone()[0]
+
+    def parked_count(self) -> int:
+        """Rows that gave up after ADMISSION_MAX_ATTEMPTS failed writes (see last_error)."""
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM admissions WHERE synced = 0 AND attempts >= ?", (ADMISSION_MAX_ATTEMPTS,)
+        ).fetchone()[0]
+
+    def mark_synced(self, ticket_ids: List[str]):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE admissions SET synced = 1, last_error = NULL WHERE ticket_id = ?",
+                [(ticket_id,) for ticket_id in ticket_ids]
+            )
+
+    def mark_error(self, ticket_ids: List[str], error: str):
+        """Transient failure: keep the error for diagnosis without using up an attempt."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE admissions SET last_error = ? WHERE ticket_id = ?",
+                [(error, ticket_id) for ticket_id in ticket_ids]
+            )
+
+    def mark_failed(self, ticket_ids: List[str], error: str):
+        """Airtable rejected these rows: counts toward ADMISSION_MAX_ATTEMPTS."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE admissions SET attempts = attempts + 1, last_error = ? WHERE ticket_id = ?",
+                [(error, ticket_id) for ticket_id in ticket_ids]
+            )
+
+
+class AdmissionWriter:
+    """Background thread that writes pending admissions back to Airtable Tickets, 10 per request."""
+
+    def __init__(self, store: AdmissionStore, interval: float = 2.0, max_backoff: float = 60.0):
+        self.store = store
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="admission-writer", daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Wake the writer right away (new admission queued)."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    @staticmethod
+    def _record(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "ticket_id": row["ticket_id"],
+            "validated_at": row["admitted_at"],
+            "validated_by": row["validated_by"] or row["gate"] or "system",
+            "status": "validated"
+        }
+
+    def _flush_rows(self, batch: List[Dict[str, Any]]) -> List[str]:
+        """Batch rejected: write each row on its own. Raises only if none could be written."""
+        written, last_error = [], None
+        for row in batch:
+            try:
+                upsert_records("Tickets", [self._record(row)], merge_on="ticket_id")
+            except Exception as exc:
+                last_error = exc
+                if not _is_rejection(exc):
+                    # Rede/Airtable em baixo: parar aqui e tentar mais tarde, sem gastar tentativas
+                    self.store.mark_error([row["ticket_id"]], str(exc))
+                    break
+                self.store.mark_failed([row["ticket_id"]], str(exc))
+                if row["attempts"] + 1 >= ADMISSION_MAX_ATTEMPTS:
+                    print(f"[WARNING] AdmissionWriter: {row['ticket_id']} desistiu após "
+                          f"{ADMISSION_MAX_ATTEMPTS} tentativas: {str(exc)}")
+                continue
+            written.append(row["ticket_id"])
+        if written:
+            self.store.mark_synced(written)
+        elif last_error is not None:
+            raise last_error
+        return written
+
+    def flush_once(self) -> int:
+        """Write one batch of pending admissions. Returns the number written."""
+        batch = self.store.pending(limit=AIRTABLE_BATCH_SIZE)
+        if not batch:
+            return 0
+        ticket_ids = [row["ticket_id"] for row in batch]
+        try:
+            upsert_records("Tickets", [self._record(row) for row in batch], merge_on="ticket_id")
+        except Exception as exc:
+            if not _is_rejection(exc):
+                self.store.mark_error(ticket_ids, str(exc))
+                raise
+            ticket_ids = self._flush_rows(batch)
+        else:
+            self.store.mark_synced(ticket_ids)
+        log_action("picking", "admit_batch", "success",
+                   message=f"{len(ticket_ids)} entradas registadas no Airtable",
+                   object_type="ticket", object_id=",".join(ticket_ids)[:255])
+        return len(ticket_ids)
+
+    def _run(self):
+        backoff = self.interval
+        while not self._stop.is_set():
+            try:
+                written = self.flush_once()
+                backoff = self.interval
+                if written:
+                    continue
+            except Exception as exc:
+                print(f"[WARNING] AdmissionWriter: falha ao escrever no Airtable: {str(exc)}")
+                backoff = min(backoff * 2, self.max_backoff)
+            self._wake.wait(backoff)
+            self._wake.clear()
@@ -1,4 +1,7 @@
 import os
+import time
+import threading
+from collections import Counter
 import requests
 from dotenv import load_dotenv
 
@@ -43,6 +46,53 @@ def _headers(api_key):
     }
 
 
+# Airtable: 5 pedidos/s por base (429 + 30s de penalização acima disso)
+AIRTABLE_RATE_LIMIT = float(os.getenv("AIRTABLE_RATE_LIMIT", "5"))
+AIRTABLE_MAX_RETRIES = 3
+
+
+class _RateLimiter:
+    """
+    Rate budget shared by every thread in the process: requests get evenly spaced
+    slots (1/rate s apart) in arrival order, so concurrent callers interleave fairly.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            self.counts[threading.current_thread().name] += 1
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+_rate_limiter = _RateLimiter(AIRTABLE_RATE_LIMIT)
+
+
+def airtable_request_counts():
+    """Airtable requests made so far, per thread name."""
+    return dict(_rate_limiter.counts)
+
+
+def _request(method, url, **kwargs):
+    """requests.request under the shared rate budget; waits and retries on 429."""
+    for attempt in range(AIRTABLE_MAX_RETRIES + 1):
+        _rate_limiter.acquire()
+        resp = requests.request(method, url, **kwargs)
+        if resp.status_code != 429 or attempt == AIRTABLE_MAX_RETRIES:
+            return resp
+        time.sleep(float(resp.headers.get("Retry-After") or 30))
+    return resp
+
+
 def _table_url(base_id, table, record_id=None):
     if record_id:
         return f"https://api.airtable.com/v0/{base_id}/{table}/{record_id}"
@@ -66,7 +116,7 @@ def _find_record_id(table, field_name, value):
     escaped = _escape_formula_value(value)
     formula = f"{{{field_name}}}='{escaped}'" if not isinstance(value, bool) else f"{{{field_name}}}={escaped}"
     params = {"filterByFormula": formula, "maxRecords": 1}
-    resp = requests.get(_table_url(base_id, table), headers=_headers(api_key), params=params, timeout=30)
+    resp = _request("GET", _table_url(base_id, table), headers=_headers(api_key), params=params, timeout=30)
     resp.raise_for_status()
     records = resp.json().get("records", [])
     return records[0]["id"] if records else None
@@ -74,7 +124,7 @@ def _find_record_id(table, field_name, value):
 
 def update_record(table, record_id, fields):
     api_key, base_id = get_airtable_config()
-    resp = requests.patch(_table_url(base_id, table, record_id), headers=_headers(api_key), json={"fields": fields}, timeout=30)
+    resp = _request("PATCH", _table_url(base_id, table, record_id), headers=_headers(api_key), json={"fields": fields}, timeout=30)
     resp.raise_for_status()
     return resp.json()
 
@@ -85,7 +135,7 @@ def upsert_record(table, fields, merge_on=None):
     payload = {"records": [{"fields": fields}]}
     if merge_on:
         payload["performUpsert"] = {"fieldsToMergeOn": [merge_on]}
-    resp = requests.post(url, headers=_headers(api_key), json=payload, timeout=30)
+    resp = _request("POST", url, headers=_headers(api_key), json=payload, timeout=30)
     if resp.status_code != 422 or not merge_on:
         resp.raise_for_status()
         return resp.json()
@@ -97,14 +147,81 @@ def upsert_record(table, fields, merge_on=None):
     return create_record(table, fields)
 
 
+AIRTABLE_BATCH_SIZE = 10
+
+
+def upsert_records(table, records_fields, merge_on=None):
+    """
+    Create or update several records, AIRTABLE_BATCH_SIZE (10) per request.
+    
+    Args:
+        table: Table name
+        records_fields: List of field dicts
+        merge_on: Optional field to merge on (upsert)
+        
+    Returns:
+        List of Airtable records written
+    """
+    api_key, base_id = get_airtable_config()
+    url = _table_url(base_id, table)
+    written = []
+    for start in range(0, len(records_fields), AIRTABLE_BATCH_SIZE):
+        chunk = records_fields[start:start + AIRTABLE_BATCH_SIZE]
+        payload = {"records": [{"fields": fields} for fields in chunk]}
+        if merge_on:
+            payload["performUpsert"] = {"fieldsToMergeOn": [merge_on]}
+        resp = _request("POST", url, headers=_headers(api_key), json=payload, timeout=30)
+        if resp.status_code != 422 or not merge_on:
+            resp.raise_for_status()
+            written.extend(resp.json().get("records", []))
+            continue
+
+        # Fallback: manual upsert record by record
+        for fields in chunk:
+            result = upsert_record(table, fields, merge_on=merge_on)
+            written.extend(result.get("records", [result]))
+    return written
+
+
 def create_record(table, fields):
     return upsert_record(table, fields, merge_on=None)
 
 
+def list_records(table, fields=None, formula=None, page_size=100):
+    """
+    Iterate over all records of a table, following Airtable pagination.
+    
+    Args:
+        table: Table name
+        fields: Optional list of field names to return (projection)
+        formula: Optional filterByFormula expression
+        page_size: Records per request (max 100)
+        
+    Yields:
+        Airtable record dicts ({"id", "createdTime", "fields"})
+    """
+    api_key, base_id = get_airtable_config()
+    params = {"pageSize": page_size}
+    if fields:
+        params["fields[]"] = list(fields)
+    if formula:
+        params["filterByFormula"] = formula
+    while True:
+        resp = _request("GET", _table_url(base_id, table), headers=_headers(api_key), params=params, timeout=30)
+        resp.raise_for_status()
+        data = resp.json()
+        for record in data.get("records", []):
+            yield record
+        offset = data.get("offset")
+        if not offset:
+            break
+        params["offset"] = offset
+
+
 def list_tables():
     api_key, base_id = get_airtable_config()
     url = f"https://api.airtable.com/v0/meta/bases/{base_id}/tables"
-    resp = requests.get(url, headers=_headers(api_key), timeout=30)
+    resp = _request("GET", url, headers=_headers(api_key), timeout=30)
     resp.raise_for_status()
     return resp.json()
 
@@ -112,7 +229,7 @@ def list_tables():
 def create_table(table_payload):
     api_key, base_id = get_airtable_config()
     url = f"https://api.airtable.com/v0/meta/bases/{base_id}/tables"
-    resp = requests.post(url, headers=_headers(api_key), json=table_payload, timeout=30)
+    resp = _request("POST", url, headers=_headers(api_key), json=table_payload, timeout=30)
     resp.raise_for_status()
     return resp.json()
 
@@ -120,7 +237,7 @@ def create_table(table_payload):
 def list_fields(table_id):
     api_key, base_id = get_airtable_config()
     url = f"https://api.airtable.com/v0/meta/bases/{base_id}/tables/{table_id}/fields"
-    resp = requests.get(url, headers=_headers(api_key), timeout=30)
+    resp = _request("GET", url, headers=_headers(api_key), timeout=30)
     resp.raise_for_status()
     return resp.json()
 
@@ -128,31 +245,31 @@ def list_fields(table_id):
 def create_field(table_id, field_payload):
     api_key, base_id = get_airtable_config()
     url = f"https://api.airtable.com/v0/meta/bases/{base_id}/tables/{table_id}/fields"
-    resp = requests.post(url, headers=_headers(api_key), json=field_payload, timeout=30)
+    resp = _request("POST", url, headers=_headers(api_key), json=field_payload, timeout=30)
     resp.raise_for_status()
     return resp.json()
 
 
-def upload_attachment_to_record(table: str, record_id: str, pdf_bytes: bytes, filename: str = "ticket.pdf"):
+def ticket_pdf_object_key(ticket_id: str) -> str:
+    """Cloudinary object key (public_id) for a ticket PDF, derived from the ticket id."""
+    return f"purosuco/tickets/ticket_{ticket_id}"
+
+
+def upload_pdf_to_storage(pdf_bytes: bytes, object_key: str) -> str:
     """
-    Upload PDF to Cloudinary and store URL in Airtable record.
+    Upload PDF to Cloudinary under a deterministic object key.
     
     Args:
-        table: Table name (e.g., "Tickets")
-        record_id: Record ID in Airtable
         pdf_bytes: PDF file as bytes
-        filename: Name for the attachment (for reference)
+        object_key: Cloudinary public_id (e.g. from ticket_pdf_object_key)
         
     Returns:
-        dict with status and PDF URL
+        Public (secure) URL of the uploaded PDF
     """
     import cloudinary
     import cloudinary.uploader
-    import os
     import tempfile
     
-    api_key, base_id = get_airtable_config()
-    
     # Configure Cloudinary
     cloudinary.config(
         cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
@@ -171,7 +288,7 @@ def upload_attachment_to_record(table: str, record_id: str, pdf_bytes: bytes, fi
         result = cloudinary.uploader.upload(
             tmp_path,
             resource_type="raw",
-            public_id=f"purosuco/tickets/{filename.replace('.pdf', '')}",
+            public_id=object_key,
             overwrite=True,
             timeout=60
         )
@@ -180,26 +297,38 @@ def upload_attachment_to_record(table: str, record_id: str, pdf_bytes: bytes, fi
     finally:
         os.unlink(tmp_path)
     
-    # Store URL in Airtable
-    update_url = f"https://api.airtable.com/v0/{base_id}/{table}/{record_id}"
+    return pdf_url
+
+
+def upload_attachment_to_record(table: str, record_id: str, pdf_bytes: bytes, filename: str = "ticket.pdf"):
+    """
+    Upload PDF to Cloudinary and store URL in Airtable record.
     
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    Prefer uploading first with upload_pdf_to_storage and writing pdf_url together
+    with the other record fields; this helper costs an extra PATCH request.
     
+    Args:
+        table: Table name (e.g., "Tickets")
+        record_id: Record ID in Airtable
+        pdf_bytes: PDF file as bytes
+        filename: Name for the attachment (for reference)
+        
+    Returns:
+        dict with status and PDF URL
+    """
+    pdf_url = upload_pdf_to_storage(pdf_bytes, f"purosuco/tickets/{filename.replace('.pdf', '')}")
+    
+    # Store URL in Airtable
     data = {
-        "fields": {
-            "pdf_url": pdf_url,  # Airtable URL type accepts plain string
-            "pdf_size_bytes": len(pdf_bytes)
-        }
+        "pdf_url": pdf_url,  # Airtable URL type accepts plain string
+        "pdf_size_bytes": len(pdf_bytes)
     }
-    
-    resp = requests.patch(update_url, headers=headers, json=data, timeout=30)
-    if resp.status_code != 200:
-        print(f"[DEBUG] Response status: {resp.status_code}")
-        print(f"[DEBUG] Response body: {resp.text}")
-    resp.raise_for_status()
+    try:
+        update_record(table, record_id, data)
+    except requests.HTTPError as exc:
+        print(f"[DEBUG] Response status: {exc.response.status_code}")
+        print(f"[DEBUG] Response body: {exc.response.text}")
+        raise
     
     print(f"[SUCCESS] PDF URL saved to Airtable record {record_id}")
     
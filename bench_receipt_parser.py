@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark do parser de recibos (receipt_parser.parse_receipt) contra o parsing antigo
+(cinco regex sobre o HTML completo + findall aninhados do dashboard).
+
+Uso:
+    python bench_receipt_parser.py [fixture.html] [--repeat N]
+"""
+
+import re
+import sys
+import time
+import argparse
+
+from receipt_parser import parse_receipt
+
+DEFAULT_FIXTURE = "fixtures/stripe_receipt.html"
+
+
+# Parsing antigo, reproduzido apenas para comparação
+_OLD_PATTERNS = [
+    re.compile(r"Receipt\s*#([\d-]+)"),
+    re.compile(r"Receipt from\s+([^<\n]+)"),
+    re.compile(r"AMOUNT PAID[^€]*€([\d,\.]+)"),
+    re.compile(r"DATE PAID[^A-Z]*([A-Z][a-z]+\s+\d+,\s+\d{4}.*?[AP]M)"),
+]
+_OLD_PRODUCT = re.compile(r"([^×<>\n]+?)\s*×\s*(\d+)[^€]*€([\d,\.]+)")
+_OLD_MESSAGE = re.compile(r"A Bia vai adorar ler a tua mensagem\s+(.+?)(?=If you have|$)", re.DOTALL | re.IGNORECASE)
+
+
+def legacy_parse(html: str):
+    fields = [p.search(html) for p in _OLD_PATTERNS]
+    items = [m.groups() for m in _OLD_PRODUCT.finditer(html)]
+    message = _OLD_MESSAGE.search(html)
+    if message:
+        re.sub(r"\s+", " ", re.sub(r"<[^>]+>", "", message.group(1)))
+    "USD" in html or "$" in html[:500]
+    dashboard = []
+    for block in re.findall(r"Table-description[^<]*</td>.*?Table-amount[^<]*</td>", html, flags=re.S):
+        desc = re.search(r"Table-description[^>]*>([^<]+)", block)
+        amount = re.search(r"Table-amount[^>]*>([^<]+)", block)
+        if desc and re.search(r"[×x]\s*(\d+)", desc.group(1)):
+            re.sub(r"\s*[×x]\s*\d+", "", desc.group(1))
+        if amount:
+            re.sub(r"[^\d,.-]", "", amount.group(1))
+        dashboard.append(block)
+    return fields, items, dashboard
+
+
+def bench(func, html: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(html)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixture", nargs="?", default=DEFAULT_FIXTURE)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(args.fixture, encoding="utf-8") as fh:
+        html = fh.read()
+
+    parsed = parse_receipt(html)
+    print(f"[INFO] Fixture: {args.fixture} ({len(html)} bytes)")
+    print(f"[INFO] receipt_number={parsed['receipt_number']} seller={parsed['seller_name']} "
+          f"amount={parsed['amount_paid']} {parsed['currency']} items={len(parsed['product_items'])}")
+
+    old_us = bench(legacy_parse, html, args.repeat)
+    new_us = bench(parse_receipt, html, args.repeat)
+    print(f"legacy (regex x7 + findall): {old_us:8.1f} µs/receipt")
+    print(f"parse_receipt (single pass): {new_us:8.1f} µs/receipt")
+    print(f"speedup: {old_us / new_us:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,7 @@ from qrcode_manager import get_ticket_by_charge_id
 from airtable_client import get_airtable_config
 from stripe_airtable_sync import _generate_and_store_ticket_from_charge
 import stripe
+import stripe_cache
 
 # Fix encoding for Windows console
 if sys.platform == "win32":
@@ -53,6 +54,7 @@ for ticket in tickets:
         tickets_without_pdf.append({
             "ticket_id": ticket_id,
             "charge_id": charge_id,
+            "issue_version": fields.get("issue_version"),
             "airtable_id": ticket.get("id")
         })
 
@@ -73,11 +75,11 @@ else:
         try:
             # Get charge from Stripe
             print(f"📍 Processando: {ticket_id[:8]}...")
-            charge = stripe.Charge.retrieve(charge_id, expand=["customer"])
+            charge = stripe_cache.retrieve("Charge", charge_id, expand=["customer"])
             
             # Regenerate and upload PDF
             from stripe_airtable_sync import _generate_and_store_ticket_from_charge
-            if _generate_and_store_ticket_from_charge(charge):
+            if _generate_and_store_ticket_from_charge(charge, previous_ticket=ticket):
                 print(f"   ✅ PDF regenerado e enviado")
             else:
                 print(f"   ⚠️ Falha ao gerar PDF")
@@ -0,0 +1,243 @@
+"""
+Persistent background job queue (SQLite, .purosuco_state/jobs.db).
+
+Slow follow-up work (receipt scraping, ticket PDF rendering + upload) is enqueued
+instead of running inside the request that triggered it, and executed by worker
+threads, one pool per job kind. Jobs survive restarts; a job that raises or returns
+False is retried with exponential backoff up to JOB_MAX_ATTEMPTS, then marked failed.
+
+    register_handler("receipt", scrape_receipt_job, workers=4)
+    enqueue("receipt", charge_id, {"charge_id": ..., "receipt_url": ...})
+    start_workers()
+
+A job is identified by (kind, key): enqueuing the same key again while it is pending
+only refreshes its payload, so webhook redeliveries do not duplicate work; while it is
+running, the job is flagged to run once more with the new payload when it finishes.
+
+A claimed job is leased to its worker (owner, lease_until = now + JOB_LEASE_SECONDS).
+Jobs left running by a crashed process are picked up again once their lease expires.
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, Optional
+
+from local_state import connect
+
+JOBS_DB = "jobs.db"
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+
+# Identifica os jobs reclamados por este processo
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_conn = None
+_conn_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+_handlers: Dict[str, Dict[str, Any]] = {}
+_wakeup: Dict[str, threading.Event] = {}
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = connect(JOBS_DB)
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    kind TEXT NOT NULL,
+                    job_key TEXT NOT NULL,
+                    payload_json TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_run_at REAL NOT NULL,
+                    last_error TEXT,
+                    rerun INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    lease_until REAL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (kind, job_key)
+                )
+                """
+            )
+            # jobs.db criados antes das colunas rerun/owner/lease_until
+            columns = {row["name"] for row in _conn.execute("PRAGMA table_info(jobs)")}
+            for column, ddl in (("rerun", "INTEGER NOT NULL DEFAULT 0"), ("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    _conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {ddl}")
+            _conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (kind, status, next_run_at)")
+        return _conn
+
+
+def _now_iso() -> str:
+    return datetime.now(tz=timezone.utc).isoformat()
+
+
+def register_handler(kind: str, func: Callable, workers: int = 1):
+    """Register callable(payload) -> bool for a job kind (False or an exception = retry)."""
+    _handlers[kind] = {"func": func, "workers": max(1, workers)}
+    _wakeup.setdefault(kind, threading.Event())
+
+
+def enqueue(kind: str, key: str, payload: Dict[str, Any], rerun_done: bool = True) -> bool:
+    """
+    Queue a job. Returns False if an identical (kind, key) job makes this one unnecessary.
+
+    Args:
+        kind: job kind (registered handler)
+        key: job identity, e.g. the charge_id
+        payload: JSON-serialisable job data
+        rerun_done: run again if this key already completed (False for one-off work like tickets)
+    """
+    now_iso = _now_iso()
+    payload_json = json.dumps(payload, ensure_ascii=False, default=str)
+    done_clause = "jobs.status IN ('done', 'failed')" if rerun_done else "jobs.status = 'failed'"
+    with _write_lock:
+        cursor = _db().execute(
+            "INSERT INTO jobs (kind, job_key, payload_json, status, attempts, next_run_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'pending', 0, ?, ?, ?) "
+            "ON CONFLICT(kind, job_key) DO UPDATE SET payload_json = excluded.payload_json, "
+            "updated_at = excluded.updated_at, "
+            f"status = CASE WHEN {done_clause} THEN 'pending' ELSE jobs.status END, "
+            f"attempts = CASE WHEN {done_clause} THEN 0 ELSE jobs.attempts END, "
+            f"next_run_at = CASE WHEN {done_clause} THEN excluded.next_run_at ELSE jobs.next_run_at END, "
+            # A correr com o payload antigo: volta a correr quando terminar
+            "rerun = CASE WHEN jobs.status = 'running' AND ? THEN 1 ELSE jobs.rerun END "
+            "WHERE jobs.status != 'done' OR ?",
+            (kind, str(key), payload_json, time.time(), now_iso, now_iso,
+             1 if rerun_done else 0, 1 if rerun_done else 0)
+        )
+        queued = cursor.rowcount > 0
+    if queued and kind in _wakeup:
+        _wakeup[kind].set()
+    return queued
+
+
+_CLAIMABLE = "((status = 'pending' AND next_run_at <= ?) OR (status = 'running' AND lease_until < ?))"
+
+
+def _claim(kind: str) -> Optional[Dict[str, Any]]:
+    """Lease the oldest due job of this kind (pending, or running with an expired lease) and return it."""
+    now = time.time()
+    with _write_lock:
+        row = _db().execute(
+            f"SELECT job_key, status, lease_until FROM jobs WHERE kind = ? AND {_CLAIMABLE} "
+            "ORDER BY next_run_at LIMIT 1",
+            (kind, now, now)
+        ).fetchone()
+        if not row:
+            return None
+        # Só se o job continuar como foi lido (outro processo pode tê-lo reclamado entretanto)
+        claimed = _db().execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, rerun = 0, owner = ?, "
+            "lease_until = ?, updated_at = ? "
+            "WHERE kind = ? AND job_key = ? AND status = ? AND lease_until IS ?",
+            (WORKER_ID, now + JOB_LEASE_SECONDS, _now_iso(), kind, row["job_key"], row["status"], row["lease_until"])
+        ).rowcount
+        if not claimed:
+            return None
+        # Payload lido depois de reclamar: alterações posteriores marcam rerun
+        job = _db().execute(
+            "SELECT payload_json, attempts FROM jobs WHERE kind = ? AND job_key = ?", (kind, row["job_key"])
+        ).fetchone()
+    return {"key": row["job_key"], "payload": json.loads(job["payload_json"]), "attempts": job["attempts"]}
+
+
+def _finish(kind: str, job: Dict[str, Any], error: str = None):
+    if error is None:
+        status, next_run_at = "done", time.time()
+    elif job["attempts"] >= JOB_MAX_ATTEMPTS:
+        status, next_run_at = "failed", time.time()
+    else:
+        status = "pending"
+        next_run_at = time.time() + JOB_RETRY_BASE_SECONDS * (2 ** (job["attempts"] - 1))
+    with _write_lock:
+        finished = _db().execute(
+            # rerun: o payload mudou enquanto corria, volta à fila já com as tentativas a zero
+            "UPDATE jobs SET status = CASE WHEN rerun THEN 'pending' ELSE ? END, "
+            "next_run_at = CASE WHEN rerun THEN ? ELSE ? END, "
+            "attempts = CASE WHEN rerun THEN 0 ELSE attempts END, "
+            "rerun = 0, owner = NULL, lease_until = NULL, last_error = ?, updated_at = ? "
+            "WHERE kind = ? AND job_key = ? AND status = 'running' AND owner = ?",
+            (status, time.time(), next_run_at, error, _now_iso(), kind, job["key"], WORKER_ID)
+        ).rowcount
+    if not finished:
+        # Lease expirado: outro worker já reclamou o job
+        print(f"[WARNING] Job {kind}:{job['key']} terminou depois do lease expirar")
+        return
+    if status == "failed":
+        print(f"[ERROR] Job {kind}:{job['key']} falhou {job['attempts']}x: {error}")
+
+
+def run_job(kind: str) -> bool:
+    """Run one due job of this kind in the calling thread. Returns False if none was due."""
+    job = _claim(kind)
+    if not job:
+        return False
+    try:
+        ok = _handlers[kind]["func"](job["payload"])
+        error = None if ok is not False else "handler returned False"
+    except Exception as exc:
+        error = str(exc)
+    _finish(kind, job, error)
+    return True
+
+
+def run_pending(kind: str = None) -> int:
+    """Run every due job (one kind or all registered) in the calling thread. Returns the jobs run."""
+    count = 0
+    for job_kind in ([kind] if kind else list(_handlers)):
+        while run_job(job_kind):
+            count += 1
+    return count
+
+
+def _worker_loop(kind: str):
+    wakeup = _wakeup[kind]
+    while True:
+        wakeup.clear()
+        try:
+            if run_job(kind):
+                continue
+        except Exception as exc:
+            print(f"[ERROR] Worker {kind}: {str(exc)}")
+        wakeup.wait(JOB_POLL_SECONDS)
+
+
+def start_workers():
+    """Start the worker threads of every registered kind (once per process)."""
+    with _workers_lock:
+        if _workers:
+            return
+        with _write_lock:
+            # Jobs deste worker que ficaram a correr (reinício com o mesmo id) ou com o lease
+            # expirado voltam à fila; os que outros processos estão a correr não são tocados
+            _db().execute(
+                "UPDATE jobs SET status = 'pending', owner = NULL, lease_until = NULL "
+                "WHERE status = 'running' AND (owner = ? OR lease_until IS NULL OR lease_until < ?)",
+                (WORKER_ID, time.time())
+            )
+        for kind, handler in _handlers.items():
+            for n in range(handler["workers"]):
+                thread = threading.Thread(target=_worker_loop, args=(kind,), name=f"jobs-{kind}-{n}", daemon=True)
+                thread.start()
+                _workers.append(thread)
+
+
+def job_counts() -> Dict[str, Dict[str, int]]:
+    """{kind: {status: count}} for monitoring."""
+    counts = {}
+    for row in _db().execute("SELECT kind, status, COUNT(*) AS n FROM jobs GROUP BY kind, status"):
+        counts.setdefault(row["kind"], {})[row["status"]] = row["n"]
+    return counts
@@ -0,0 +1,28 @@
+"""
+Local state directory shared by the PuroSuco processes on one machine
+(dashboard, webhook server, sync scripts): SQLite stores and disk caches.
+"""
+
+import os
+import sqlite3
+
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".purosuco_state")
+
+
+def state_path(filename: str) -> str:
+    """Absolute path of a file inside the state dir (PUROSUCO_STATE_DIR), creating the dir."""
+    state_dir = os.getenv("PUROSUCO_STATE_DIR") or DEFAULT_STATE_DIR
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, filename)
+
+
+def connect(filename: str) -> sqlite3.Connection:
+    """
+    Open a SQLite database in the state dir in WAL mode (concurrent readers, one writer).
+    Autocommit mode: use explicit BEGIN IMMEDIATE for multi-statement transactions.
+    """
+    conn = sqlite3.connect(state_path(filename), timeout=30, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,138 @@
+"""
+Size-bounded LRU disk cache for ticket PDFs.
+
+Files are stored in the local state dir and indexed in SQLite with their ETag /
+Last-Modified headers. Fresh entries are served straight from disk; older ones are
+revalidated with a conditional GET (304 → served from disk), and served stale if
+the network is down.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from typing import Optional
+
+import requests
+
+from local_state import connect, state_path
+
+PDF_CACHE_DB = "pdf_cache.db"
+DEFAULT_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+DEFAULT_MAX_AGE = int(os.getenv("PDF_CACHE_MAX_AGE", "300"))
+
+
+class PdfDiskCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_age: int = DEFAULT_MAX_AGE):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.directory = state_path("pdf_cache")
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._conn = connect(PDF_CACHE_DB)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pdf_cache (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                validated_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def _read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._file(key), "rb") as fh:
+                return fh.read()
+        except OSError:
+            return None
+
+    def _touch(self, key: str, validated: bool = False):
+        now = time.time()
+        if validated:
+            self._conn.execute("UPDATE pdf_cache SET accessed_at = ?, validated_at = ? WHERE key = ?", (now, now, key))
+        else:
+            self._conn.execute("UPDATE pdf_cache SET accessed_at = ? WHERE key = ?", (now, key))
+
+    def _store(self, key: str, url: str, content: bytes, etag: str = None, last_modified: str = None):
+        tmp_path = self._file(key) + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(content)
+        os.replace(tmp_path, self._file(key))
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO pdf_cache (key, url, size, etag, last_modified, validated_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, url, len(content), etag, last_modified, now, now)
+        )
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used files until the cache fits in max_bytes."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pdf_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for row in self._conn.execute("SELECT key, size FROM pdf_cache ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(self._file(row["key"]))
+            except OSError:
+                pass
+            self._conn.execute("DELETE FROM pdf_cache WHERE key = ?", (row["key"],))
+            total -= row["size"]
+
+    def get(self, url: str, timeout: int = 30) -> Optional[bytes]:
+        """Return the PDF at url, from disk when possible. Raises on network errors without a cached copy."""
+        key = self._key(url)
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM pdf_cache WHERE key = ?", (key,)).fetchone()
+            cached = self._read(key) if row else None
+            if cached is not None and time.time() - row["validated_at"] < self.max_age:
+                self._touch(key)
+                return cached
+
+        headers = {}
+        if cached is not None:
+            if row["etag"]:
+                headers["If-None-Match"] = row["etag"]
+            if row["last_modified"]:
+                headers["If-Modified-Since"] = row["last_modified"]
+        try:
+            resp = self._session.get(url, headers=headers, timeout=timeout)
+        except requests.RequestException:
+            if cached is not None:
+                # Sem rede: servir a cópia local mesmo que expirada
+                return cached
+            raise
+
+        with self._lock:
+            if resp.status_code == 304 and cached is not None:
+                self._touch(key, validated=True)
+                return cached
+            resp.raise_for_status()
+            self._store(key, url, resp.content, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+        return resp.content
+
+
+_pdf_cache = None
+_pdf_cache_lock = threading.Lock()
+
+
+def get_pdf_cache() -> PdfDiskCache:
+    global _pdf_cache
+    with _pdf_cache_lock:
+        if _pdf_cache is None:
+            _pdf_cache = PdfDiskCache()
+        return _pdf_cache
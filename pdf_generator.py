@@ -9,12 +9,20 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
 import base64
 from app_logger import log_pdf_generation
+from ticket_signing import sign_ticket_payload, DEFAULT_ISSUE_VERSION
 
 BACKGROUND_PATH = "pdf_background/background_V1_PuroSuco.png"
 
 
-def generate_qrcode_data(ticket_id: str, customer_email: str = None) -> str:
-    """Generate QR code data string."""
+def generate_qrcode_data(ticket_id: str, customer_email: str = None,
+                         issue_version: int = DEFAULT_ISSUE_VERSION) -> str:
+    """
+    Generate QR code data string.
+    Signed (TICKET:id:version:hmac) when QR_SIGNING_SECRET is set, legacy TICKET:id:email otherwise.
+    """
+    signed = sign_ticket_payload(ticket_id, issue_version)
+    if signed:
+        return signed
     return f"TICKET:{ticket_id}:{customer_email or 'N/A'}"
 
 
@@ -27,14 +35,16 @@ def generate_ticket_pdf(
     price: float,
     currency: str,
     items: list = None,
+    issue_version: int = DEFAULT_ISSUE_VERSION,
 ) -> tuple:
     """
     Generate a ticket PDF with QR code overlaid on background image.
+    issue_version goes into the signed QR payload (bumped when a ticket is regenerated).
     Returns: (pdf_bytes, pdf_base64_data)
     """
     try:
         # Generate QR code
-        qrcode_data = generate_qrcode_data(ticket_id, customer_email)
+        qrcode_data = generate_qrcode_data(ticket_id, customer_email, issue_version)
         qr = qrcode.QRCode(
             version=1,
             error_correction=qrcode.constants.ERROR_CORRECT_H,
@@ -0,0 +1,127 @@
+"""
+Adaptive QR detection for the Picking scanner.
+
+Instead of running cv2.QRCodeDetector.detectAndDecode on every full-resolution frame,
+frames are downscaled to QR_SCAN_WIDTH and only every QR_SCAN_EVERY_N-th frame is
+searched for a code candidate. Once a candidate appears, its region is tracked and
+decoded at full resolution on every frame for a while. All OpenCV work runs in a
+worker thread, so the WebRTC transform() returns right away.
+"""
+
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+DEFAULT_SCAN_WIDTH = int(os.getenv("QR_SCAN_WIDTH", "480"))
+DEFAULT_EVERY_N = int(os.getenv("QR_SCAN_EVERY_N", "3"))
+
+
+class AdaptiveQRDetector:
+    def __init__(self, on_result, scan_width: int = None, every_n: int = None,
+                 track_frames: int = 15, roi_margin: float = 0.25):
+        """
+        Args:
+            on_result: callable(data: str) invoked from the worker thread for each decoded code
+            scan_width: width (px) frames are downscaled to while searching for a candidate
+            every_n: search only every Nth frame until a candidate appears
+            track_frames: frames to keep decoding the candidate region before searching again
+            roi_margin: margin added around the candidate, relative to its size
+        """
+        self.on_result = on_result
+        self.scan_width = scan_width or DEFAULT_SCAN_WIDTH
+        self.every_n = max(1, every_n or DEFAULT_EVERY_N)
+        self.track_frames = track_frames
+        self.roi_margin = roi_margin
+        self.detector = cv2.QRCodeDetector()
+        self._frames = queue.Queue(maxsize=1)
+        self._lock = threading.Lock()
+        self._frame_count = 0
+        self._roi = None
+        self._track_left = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="qr-detector", daemon=True)
+        self._thread.start()
+
+    @property
+    def tracking(self) -> bool:
+        with self._lock:
+            return self._track_left > 0
+
+    def submit(self, img):
+        """Hand a BGR frame to the worker. Never blocks; frames are dropped while it is busy."""
+        self._frame_count += 1
+        if not self.tracking and self._frame_count % self.every_n:
+            return
+        try:
+            self._frames.put_nowait(img)
+        except queue.Full:
+            pass
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                img = self._frames.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._process(img)
+            except Exception as exc:
+                # Frame inválido ou erro no callback: registar e seguir para o próximo frame
+                print(f"[WARNING] QR detector: {type(exc).__name__}: {str(exc)}")
+
+    def _bbox(self, points, width: int, height: int):
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0)
+        mx = (x1 - x0) * self.roi_margin
+        my = (y1 - y0) * self.roi_margin
+        return (
+            max(0, int(x0 - mx)),
+            max(0, int(y0 - my)),
+            min(width, int(x1 + mx) + 1),
+            min(height, int(y1 + my) + 1)
+        )
+
+    def _find_candidate(self, img):
+        """Search a downscaled copy of the frame; returns the full-resolution ROI or None."""
+        height, width = img.shape[:2]
+        scale = min(1.0, self.scan_width / float(width))
+        small = img
+        if scale < 1.0:
+            small = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        found, points = self.detector.detect(small)
+        if not found or points is None:
+            return None
+        return self._bbox(np.asarray(points).reshape(-1, 2) / scale, width, height)
+
+    def _process(self, img):
+        with self._lock:
+            roi = self._roi if self._track_left > 0 else None
+        if roi is None:
+            roi = self._find_candidate(img)
+            if roi is None:
+                return
+            with self._lock:
+                self._roi = roi
+                self._track_left = self.track_frames
+
+        x0, y0, x1, y1 = roi
+        data, points, _ = self.detector.detectAndDecode(img[y0:y1, x0:x1])
+        if data:
+            with self._lock:
+                self._roi = None
+                self._track_left = 0
+            self.on_result(data)
+            return
+
+        with self._lock:
+            self._track_left -= 1
+            if points is not None:
+                # Seguir o código dentro do frame (coordenadas relativas ao ROI)
+                height, width = img.shape[:2]
+                self._roi = self._bbox(np.asarray(points).reshape(-1, 2) + (x0, y0), width, height)
@@ -1,35 +1,327 @@
-from datetime import datetime, timezone
-from airtable_client import upsert_record, list_tables, get_airtable_config
-from app_logger import log_ticket_validation
-import base64
-import requests
+import time
+import threading
+from datetime import datetime, timezone, timedelta
+from airtable_client import upsert_record, list_records, _escape_formula_value
+from app_logger import log_ticket_validation, log_action, LOG_LEVEL_WARNING
+from ticket_signing import parse_ticket_payload, signing_enabled, unsigned_allowed
+from admission_store import AdmissionStore, AdmissionWriter
+import ticket_stats
+from pdf_cache import get_pdf_cache
+from ticket_filter import BloomFilter, NegativeCache
+import os
+
+
+# Tickets marked as validated by this process; lets signed QR codes be checked offline
+_validated_locally = {}
+
+# Misses recentes (ticket_id desconhecido / payload inválido): recusados sem rede nem Logs
+NEGATIVE_CACHE_TTL = int(os.getenv("QR_NEGATIVE_CACHE_TTL", "60"))
+_unknown_tickets = NegativeCache(ttl=NEGATIVE_CACHE_TTL)
+_invalid_payloads = NegativeCache(ttl=NEGATIVE_CACHE_TTL)
+
+# Only the fields needed at the gate are loaded into the index
+TICKET_INDEX_FIELDS = [
+    "ticket_id",
+    "charge_id",
+    "status",
+    "customer_name",
+    "customer_email",
+    "ticket_type",
+    "validated_at",
+    "validated_by",
+    "pdf_url",
+    "issue_version"
+]
+
+
+def _ticket_from_record(record: dict) -> dict:
+    """Convert an Airtable Tickets record into the ticket dict returned by this module."""
+    fields = record.get("fields", {})
+    return {
+        "success": True,
+        "ticket_id": fields.get("ticket_id"),
+        "status": fields.get("status", "pending"),
+        "customer_name": fields.get("customer_name"),
+        "customer_email": fields.get("customer_email"),
+        "ticket_type": fields.get("ticket_type"),
+        "validated_at": fields.get("validated_at"),
+        "validated_by": fields.get("validated_by"),
+        "pdf_url": fields.get("pdf_url"),
+        "airtable_id": record.get("id"),
+        "charge_id": fields.get("charge_id"),
+        "issue_version": fields.get("issue_version")
+    }
+
+
+class TicketIndex:
+    """
+    In-memory index of the Tickets table keyed by ticket_id and charge_id.
+    
+    load() bulk-loads the table once (projected fields only); refresh() fetches only
+    records modified since the last load/refresh. start_background_refresh() keeps
+    the index up to date from a daemon thread. A Bloom filter of every issued
+    ticket_id is kept alongside, see might_exist().
+    """
+
+    # Margem para relógios desalinhados entre esta máquina e o Airtable
+    REFRESH_SKEW = timedelta(seconds=5)
+
+    def __init__(self, refresh_interval: int = 30):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._by_ticket_id = {}
+        self._by_charge_id = {}
+        self._replaced = set()
+        self._watermark = None
+        self._issued = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def is_warm(self) -> bool:
+        return self._watermark is not None
+
+    @property
+    def is_fresh(self) -> bool:
+        """Loaded and refreshed recently enough to decide admissions offline."""
+        with self._lock:
+            if self._watermark is None:
+                return False
+            max_age = timedelta(seconds=3 * self.refresh_interval) + self.REFRESH_SKEW
+            return datetime.now(tz=timezone.utc) - self._watermark <= max_age
+
+    def __len__(self):
+        return len(self._by_ticket_id)
+
+    def _rebuild_issued_filter(self):
+        ids = list(self._by_ticket_id.keys())
+        issued = BloomFilter(capacity=max(2 * len(ids), 1000))
+        for ticket_id in ids:
+            issued.add(ticket_id)
+        self._issued = issued
+
+    def might_exist(self, ticket_id: str):
+        """
+        Bloom filter check of issued ticket ids.
+        Returns False if the ticket was certainly not issued (as of the last refresh),
+        True if it may exist, None if the filter is unavailable or stale.
+        """
+        with self._lock:
+            if self._issued is None or not self.is_fresh:
+                return None
+            return ticket_id in self._issued
+
+    def put(self, ticket: dict):
+        """Insert or replace a ticket dict (as returned by _ticket_from_record)."""
+        ticket_id = ticket.get("ticket_id")
+        if not ticket_id:
+            return
+        with self._lock:
+            previous = self._by_ticket_id.get(ticket_id)
+            if previous and previous.get("charge_id") and previous.get("charge_id") != ticket.get("charge_id"):
+                self._by_charge_id.pop(previous["charge_id"], None)
+            self._by_ticket_id[ticket_id] = ticket
+            if self._issued is not None:
+                self._issued.add(ticket_id)
+                if self._issued.saturated:
+                    self._rebuild_issued_filter()
+            if ticket.get("charge_id"):
+                # Regenerar um bilhete cria um novo ticket_id para o mesmo charge
+                old = self._by_charge_id.get(ticket["charge_id"])
+                if old and old.get("ticket_id") != ticket_id:
+                    self._by_ticket_id.pop(old.get("ticket_id"), None)
+                    self._replaced.add(old.get("ticket_id"))
+                self._by_charge_id[ticket["charge_id"]] = ticket
+
+    def get(self, ticket_id: str):
+        with self._lock:
+            ticket = self._by_ticket_id.get(ticket_id)
+            return dict(ticket) if ticket else None
+
+    def was_replaced(self, ticket_id: str) -> bool:
+        """True if this ticket_id was superseded by a regenerated ticket for the same charge."""
+        with self._lock:
+            return ticket_id in self._replaced
+
+    def get_by_charge_id(self, charge_id: str):
+        with self._lock:
+            ticket = self._by_charge_id.get(charge_id)
+            return dict(ticket) if ticket else None
+
+    def update(self, ticket_id: str, **fields):
+        """Update fields of an indexed ticket in place (no-op if unknown)."""
+        with self._lock:
+            ticket = self._by_ticket_id.get(ticket_id)
+            if ticket:
+                ticket.update(fields)
+
+    def ticket_ids(self) -> list:
+        with self._lock:
+            return list(self._by_ticket_id.keys())
+
+    def load(self) -> int:
+        """Bulk-load the whole Tickets table. Returns the number of tickets indexed."""
+        started_at = datetime.now(tz=timezone.utc)
+        by_ticket_id = {}
+        by_charge_id = {}
+        for record in list_records("Tickets", fields=TICKET_INDEX_FIELDS):
+            ticket = _ticket_from_record(record)
+            if not ticket.get("ticket_id"):
+                continue
+            by_ticket_id[ticket["ticket_id"]] = ticket
+            if ticket.get("charge_id"):
+                by_charge_id[ticket["charge_id"]] = ticket
+        with self._lock:
+            self._by_ticket_id = by_ticket_id
+            self._by_charge_id = by_charge_id
+            self._rebuild_issued_filter()
+            self._watermark = started_at - self.REFRESH_SKEW
+        print(f"[INFO] TicketIndex: {len(by_ticket_id)} tickets carregados")
+        return len(by_ticket_id)
+
+    def refresh(self) -> int:
+        """Fetch tickets modified since the last load/refresh. Returns the number updated."""
+        if not self.is_warm:
+            return self.load()
+        started_at = datetime.now(tz=timezone.utc)
+        since = self._watermark.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        formula = f"IS_AFTER(LAST_MODIFIED_TIME(), '{since}')"
+        updated = 0
+        for record in list_records("Tickets", fields=TICKET_INDEX_FIELDS, formula=formula):
+            ticket = _ticket_from_record(record)
+            local_validated_at = _validated_locally.get(ticket.get("ticket_id"))
+            if local_validated_at and (ticket.get("status") or "").lower() != "validated":
+                # Escrita local ainda não refletida no Airtable: não regredir o estado
+                ticket.update(status="validated", validated_at=local_validated_at)
+            self.put(ticket)
+            updated += 1
+        with self._lock:
+            self._watermark = started_at - self.REFRESH_SKEW
+        return updated
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as exc:
+                print(f"[WARNING] TicketIndex refresh falhou: {str(exc)}")
+            self._stop.wait(self.refresh_interval)
+
+    def start_background_refresh(self, refresh_interval: int = None):
+        """Start (once) a daemon thread that loads and then incrementally refreshes the index."""
+        if refresh_interval:
+            self.refresh_interval = refresh_interval
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ticket-index-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+ticket_index = TicketIndex()
+
+
+def _offline_ticket(ticket_id: str, issue_version: int) -> dict:
+    """
+    Decide a verified (signed) QR payload from the in-memory index, without Airtable.
+    The signature only proves the ticket was issued: admission needs the index to be
+    fresh and to hold this ticket, at its current issue version.
+
+    Returns:
+        {"ticket_data": dict} or {"pending": True, "error": str} or {"revoked": True, "error": str}
+    """
+    if ticket_index.was_replaced(ticket_id):
+        return {"revoked": True, "error": "QR code substituído por um bilhete mais recente"}
+    if not ticket_index.is_fresh:
+        return {"pending": True, "error": "Índice de bilhetes indisponível; tentar novamente"}
+    indexed = ticket_index.get(ticket_id)
+    if not indexed:
+        # Bilhete ainda não refletido no índice, ou substituído por um regenerado
+        return {"pending": True, "error": "Bilhete não encontrado no índice; tentar novamente"}
+    current_version = indexed.get("issue_version")
+    if current_version and (issue_version or 0) < int(current_version):
+        return {"revoked": True, "error": "QR code substituído por um bilhete mais recente"}
+    return {"ticket_data": indexed}
 
 
 def validate_qrcode(qrcode_data: str, validated_by: str = None) -> dict:
     """
     Validate a QR code by searching for matching ticket.
+    Signed payloads are verified locally (HMAC) without querying Airtable;
+    legacy payloads fall back to an Airtable lookup.
     Returns: {"success": bool, "ticket_id": str, "ticket_data": dict, "error": str}
     """
     try:
-        # Parse QR code data format: "TICKET:ticket_id:customer_email"
-        if not qrcode_data or not qrcode_data.startswith("TICKET:"):
+        # QR code recusado há pouco: responder da memória, sem novo registo em Logs
+        cached_error = _invalid_payloads.get(qrcode_data or "")
+        if cached_error:
+            return {"success": False, "error": cached_error}
+
+        # Parse QR code data format: "TICKET:ticket_id:version:signature" or "TICKET:ticket_id:customer_email"
+        parsed = parse_ticket_payload(qrcode_data)
+        if not parsed["valid_format"]:
             log_ticket_validation("unknown", qrcode_data or "", validated_by, "warning", "Formato inválido")
-            return {"success": False, "error": "QR code format inválido"}
+            _invalid_payloads.add(qrcode_data or "", parsed["error"])
+            return {"success": False, "error": parsed["error"]}
 
-        parts = qrcode_data.split(":")
-        if len(parts) < 2:
-            log_ticket_validation("unknown", qrcode_data, validated_by, "warning", "Formato incompleto")
-            return {"success": False, "error": "QR code format inválido"}
+        ticket_id = parsed["ticket_id"]
+        if parsed["signed"] and parsed["error"]:
+            log_ticket_validation(ticket_id, qrcode_data, validated_by, "warning", parsed["error"])
+            _invalid_payloads.add(qrcode_data, parsed["error"])
+            return {"success": False, "error": parsed["error"], "ticket_id": ticket_id}
+
+        if parsed["verified"]:
+            # Autenticidade garantida pela assinatura; o estado vem do índice (sem consulta ao Airtable)
+            offline = _offline_ticket(ticket_id, parsed["issue_version"])
+            if "ticket_data" not in offline:
+                if offline.get("revoked"):
+                    log_ticket_validation(ticket_id, qrcode_data, validated_by, "warning", offline["error"])
+                return {"success": False, "pending": bool(offline.get("pending")),
+                        "error": offline["error"], "ticket_id": ticket_id}
+            indexed = offline["ticket_data"]
+            if (indexed.get("status") or "").lower() == "validated":
+                return {
+                    "success": False,
+                    "error": "Bilhete já validado",
+                    "already_validated": True,
+                    "ticket_id": ticket_id,
+                    "ticket_data": indexed
+                }
+            if ticket_id in _validated_locally:
+                return {
+                    "success": False,
+                    "error": "Bilhete já validado",
+                    "already_validated": True,
+                    "ticket_id": ticket_id,
+                    "ticket_data": {"ticket_id": ticket_id, "status": "validated", "validated_at": _validated_locally[ticket_id]}
+                }
+            return {
+                "success": True,
+                "ticket_id": ticket_id,
+                "qrcode_data": qrcode_data,
+                "validated_at": datetime.now(tz=timezone.utc).isoformat(),
+                "validated_by": validated_by,
+                "offline": True,
+                "ticket_data": indexed
+            }
+
+        if not parsed["signed"] and signing_enabled() and not unsigned_allowed():
+            log_ticket_validation(ticket_id, qrcode_data, validated_by, "warning", "QR code não assinado")
+            return {"success": False, "error": "QR code não assinado", "ticket_id": ticket_id}
 
-        ticket_id = parts[1]
         ticket_data = get_ticket_data(ticket_id)
 
         if not ticket_data.get("success"):
-            log_ticket_validation(ticket_id, qrcode_data, validated_by, "error", ticket_data.get("error"))
+            if not ticket_data.get("cached_miss"):
+                log_ticket_validation(ticket_id, qrcode_data, validated_by, "error", ticket_data.get("error"))
             return {"success": False, "error": ticket_data.get("error", "Bilhete não encontrado")}
 
         status = (ticket_data.get("status") or "").lower()
-        if status == "validated":
+        if status == "validated" or ticket_id in _validated_locally:
             log_ticket_validation(ticket_id, qrcode_data, validated_by, "warning", "Bilhete já validado")
             return {
                 "success": False,
@@ -59,13 +351,20 @@ def mark_ticket_as_validated(ticket_id: str, validated_by: str = None) -> bool:
     Mark a ticket as validated in Airtable.
     """
     try:
+        validated_at = datetime.now(tz=timezone.utc).isoformat()
+        _validated_locally[ticket_id] = validated_at
         fields = {
             "ticket_id": ticket_id,
-            "validated_at": datetime.now(tz=timezone.utc).isoformat(),
+            "validated_at": validated_at,
             "validated_by": validated_by or "system",
             "status": "validated"
         }
         upsert_record("Tickets", fields, merge_on="ticket_id")
+        ticket_index.update(ticket_id, status="validated", validated_at=validated_at, validated_by=fields["validated_by"])
+        try:
+            ticket_stats.record_ticket_validated(ticket_id, gate=fields["validated_by"], validated_at=validated_at)
+        except Exception as stats_err:
+            print(f"[WARNING] Estatísticas não atualizadas: {str(stats_err)}")
         log_ticket_validation(ticket_id, "", validated_by, "success")
         return True
     except Exception as exc:
@@ -73,41 +372,271 @@ def mark_ticket_as_validated(ticket_id: str, validated_by: str = None) -> bool:
         return False
 
 
-def get_ticket_data(ticket_id: str) -> dict:
+_admission_store = None
+_admission_writer = None
+_admission_lock = threading.Lock()
+
+
+def get_admission_store() -> AdmissionStore:
+    """Local admission store (created on first use) with its Airtable write-back thread running."""
+    global _admission_store, _admission_writer
+    with _admission_lock:
+        if _admission_store is None:
+            _admission_store = AdmissionStore()
+            _admission_writer = AdmissionWriter(_admission_store)
+        _admission_writer.start()
+        return _admission_store
+
+
+def _admit_resolved(ticket_id: str, ticket_data: dict, qrcode_data: str, gate: str = None, validated_by: str = None) -> dict:
+    """Admit an already authenticated/resolved ticket against the local admission store."""
+    store = get_admission_store()
+    if (ticket_data.get("status") or "").lower() == "validated" and not store.get(ticket_id):
+        # Validado antes (ex: fluxo antigo) e já refletido no Airtable
+        return {
+            "success": False,
+            "admitted": False,
+            "error": "Bilhete já validado",
+            "already_validated": True,
+            "ticket_id": ticket_id,
+            "ticket_data": ticket_data
+        }
+
+    admitted, admission = store.try_admit(ticket_id, gate=gate, validated_by=validated_by)
+    if not admitted:
+        return {
+            "success": False,
+            "admitted": False,
+            "error": "Bilhete já validado",
+            "already_validated": True,
+            "ticket_id": ticket_id,
+            "ticket_data": ticket_data,
+            "admission": admission
+        }
+
+    _validated_locally[ticket_id] = admission["admitted_at"]
+    ticket_index.update(ticket_id, status="validated", validated_at=admission["admitted_at"],
+                        validated_by=validated_by or gate)
+    _admission_writer.notify()
+    try:
+        ticket_stats.record_ticket_validated(ticket_id, gate=gate or validated_by, validated_at=admission["admitted_at"])
+    except Exception as stats_err:
+        print(f"[WARNING] Estatísticas não atualizadas: {str(stats_err)}")
+    return {
+        "success": True,
+        "admitted": True,
+        "ticket_id": ticket_id,
+        "qrcode_data": qrcode_data,
+        "validated_at": admission["admitted_at"],
+        "validated_by": validated_by,
+        "gate": gate,
+        "ticket_data": ticket_data
+    }
+
+
+def admit(qrcode_data: str, gate: str = None, validated_by: str = None) -> dict:
     """
-    Retrieve ticket data from Airtable Tickets table.
-    Searches by ticket_id field.
+    Validate and admit a ticket in one atomic step.
+    The check-and-flip happens in the local admission store, so a ticket is admitted
+    at most once across gates; the Airtable write is queued and sent in batches of 10.
+    Returns: {"success": bool, "admitted": bool, "ticket_id": str, "ticket_data": dict, "error": str}
     """
     try:
-        api_key, base_id = get_airtable_config()
-        # Search for ticket by ID using filterByFormula
-        formula = f"{{ticket_id}}='{ticket_id}'"
-        url = f"https://api.airtable.com/v0/{base_id}/Tickets"
-        params = {
-            "filterByFormula": formula,
-            "maxRecords": 1
-        }
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        resp = requests.get(url, headers=headers, params=params, timeout=30)
-        resp.raise_for_status()
-        records = resp.json().get("records", [])
-        
-        if records:
-            record = records[0]
-            return {
+        parsed = parse_ticket_payload(qrcode_data)
+        if not parsed["valid_format"]:
+            return {"success": False, "admitted": False, "error": parsed["error"]}
+
+        ticket_id = parsed["ticket_id"]
+        if parsed["signed"] and parsed["error"]:
+            return {"success": False, "admitted": False, "error": parsed["error"], "ticket_id": ticket_id}
+
+        if parsed["verified"]:
+            # Assinatura válida: estado do índice em memória, sem rede
+            offline = _offline_ticket(ticket_id, parsed["issue_version"])
+            if "ticket_data" not in offline:
+                return {"success": False, "admitted": False, "pending": bool(offline.get("pending")),
+                        "error": offline["error"], "ticket_id": ticket_id}
+            ticket_data = offline["ticket_data"]
+        elif not parsed["signed"] and signing_enabled() and not unsigned_allowed():
+            return {"success": False, "admitted": False, "error": "QR code não assinado", "ticket_id": ticket_id}
+        else:
+            ticket_data = get_ticket_data(ticket_id)
+            if not ticket_data.get("success"):
+                return {"success": False, "admitted": False, "ticket_id": ticket_id,
+                        "error": ticket_data.get("error", "Bilhete não encontrado")}
+
+        return _admit_resolved(ticket_id, ticket_data, qrcode_data, gate=gate, validated_by=validated_by)
+
+    except Exception as exc:
+        log_ticket_validation("unknown", qrcode_data or "", validated_by, "error", str(exc))
+        return {"success": False, "admitted": False, "error": str(exc)}
+
+
+# Tamanho dos blocos OR() para manter o URL do filterByFormula curto
+LOOKUP_CHUNK_SIZE = 50
+
+
+def _find_ticket_records(field_name: str, values: list) -> dict:
+    """Chunked Airtable lookup of Tickets by field using OR(). Returns {value: ticket dict}."""
+    found = {}
+    values = [v for v in dict.fromkeys(values) if v]
+    for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+        chunk = values[start:start + LOOKUP_CHUNK_SIZE]
+        formula = "OR(" + ",".join(f"{{{field_name}}}='{_escape_formula_value(v)}'" for v in chunk) + ")"
+        for record in list_records("Tickets", fields=TICKET_INDEX_FIELDS, formula=formula):
+            ticket = _ticket_from_record(record)
+            key = record.get("fields", {}).get(field_name)
+            if key:
+                found[key] = ticket
+    return found
+
+
+def validate_many(payloads: list, admit_gate: str = None, validated_by: str = None) -> list:
+    """
+    Validate a batch of QR payloads (buffered scanner scans, turnstile uploads) in one pass.
+    Tickets are resolved from ticket_index, and the misses with one chunked OR() lookup.
+    With admit_gate, valid tickets are also admitted (local store + batched write-back).
+    Returns one outcome dict per payload, in order; repeated tickets inside the batch
+    get {"duplicate_in_batch": True}.
+    """
+    outcomes = [None] * len(payloads)
+    parsed_items = []
+    for idx, qrcode_data in enumerate(payloads):
+        parsed = parse_ticket_payload(qrcode_data)
+        if not parsed["valid_format"]:
+            outcomes[idx] = {"success": False, "error": parsed["error"], "qrcode_data": qrcode_data}
+        elif parsed["signed"] and parsed["error"]:
+            outcomes[idx] = {"success": False, "error": parsed["error"], "ticket_id": parsed["ticket_id"], "qrcode_data": qrcode_data}
+        elif not parsed["signed"] and signing_enabled() and not unsigned_allowed():
+            outcomes[idx] = {"success": False, "error": "QR code não assinado", "ticket_id": parsed["ticket_id"], "qrcode_data": qrcode_data}
+        else:
+            parsed_items.append((idx, qrcode_data, parsed))
+
+    # Resolver bilhetes: índice em memória primeiro, depois um único lookup em blocos
+    tickets = {}
+    offline_refusals = {}
+    missing = []
+    for _, _, parsed in parsed_items:
+        ticket_id = parsed["ticket_id"]
+        if parsed["verified"]:
+            # A assinatura não chega: mesmas verificações que admit() (frescura, substituição, versão)
+            offline = _offline_ticket(ticket_id, parsed["issue_version"])
+            if "ticket_data" in offline:
+                tickets[ticket_id] = offline["ticket_data"]
+            else:
+                offline_refusals[ticket_id] = offline
+            continue
+        indexed = ticket_index.get(ticket_id)
+        if indexed:
+            tickets[ticket_id] = indexed
+        else:
+            missing.append(ticket_id)
+    missing = [t for t in missing if not _unknown_tickets.get(t) and ticket_index.might_exist(t) is not False]
+    if missing:
+        try:
+            for ticket_id, ticket in _find_ticket_records("ticket_id", missing).items():
+                tickets[ticket_id] = ticket
+                if ticket_index.is_warm:
+                    ticket_index.put(ticket)
+            for ticket_id in missing:
+                if ticket_id not in tickets:
+                    _unknown_tickets.add(ticket_id)
+        except Exception as exc:
+            log_action("picking", "validate_many", "error", error_details=f"Lookup falhou: {str(exc)}",
+                       level=LOG_LEVEL_WARNING)
+            for idx, qrcode_data, parsed in parsed_items:
+                if not parsed["verified"] and parsed["ticket_id"] not in tickets:
+                    outcomes[idx] = {"success": False, "error": str(exc), "ticket_id": parsed["ticket_id"], "qrcode_data": qrcode_data}
+
+    seen = {}
+    for idx, qrcode_data, parsed in parsed_items:
+        if outcomes[idx] is not None:
+            continue
+        ticket_id = parsed["ticket_id"]
+        if ticket_id in seen:
+            outcomes[idx] = {
+                "success": False,
+                "error": "Bilhete repetido no lote",
+                "already_validated": True,
+                "duplicate_in_batch": True,
+                "first_index": seen[ticket_id],
+                "ticket_id": ticket_id,
+                "qrcode_data": qrcode_data
+            }
+            continue
+        seen[ticket_id] = idx
+
+        if ticket_id in offline_refusals:
+            refusal = offline_refusals[ticket_id]
+            outcomes[idx] = {"success": False, "pending": bool(refusal.get("pending")), "error": refusal["error"],
+                             "ticket_id": ticket_id, "qrcode_data": qrcode_data}
+            continue
+
+        ticket_data = tickets.get(ticket_id)
+        if ticket_data is None:
+            outcomes[idx] = {"success": False, "error": f"Ticket {ticket_id} não encontrado",
+                             "ticket_id": ticket_id, "qrcode_data": qrcode_data}
+            continue
+
+        if admit_gate:
+            outcomes[idx] = _admit_resolved(ticket_id, ticket_data, qrcode_data, gate=admit_gate, validated_by=validated_by)
+            continue
+
+        status = (ticket_data.get("status") or "").lower()
+        if status == "validated" or ticket_id in _validated_locally:
+            outcomes[idx] = {
+                "success": False,
+                "error": "Bilhete já validado",
+                "already_validated": True,
+                "ticket_id": ticket_id,
+                "qrcode_data": qrcode_data,
+                "ticket_data": ticket_data
+            }
+        else:
+            outcomes[idx] = {
                 "success": True,
-                "ticket_id": record["fields"].get("ticket_id"),
-                "status": record["fields"].get("status", "pending"),
-                "customer_name": record["fields"].get("customer_name"),
-                "customer_email": record["fields"].get("customer_email"),
-                "validated_at": record["fields"].get("validated_at"),
-                "validated_by": record["fields"].get("validated_by"),
-                "airtable_id": record["id"]
+                "ticket_id": ticket_id,
+                "qrcode_data": qrcode_data,
+                "ticket_data": ticket_data
             }
+
+    valid = sum(1 for o in outcomes if o.get("success"))
+    log_action("picking", "validate_many", "success",
+               message=f"Lote de {len(payloads)} QR codes: {valid} válidos, {len(payloads) - valid} recusados",
+               user_id=validated_by)
+    return outcomes
+
+
+def _find_ticket_record(field_name: str, value: str):
+    """Single Airtable lookup of a Tickets record by field (projected fields only)."""
+    formula = f"{{{field_name}}}='{_escape_formula_value(value)}'"
+    # page_size=1 e só o primeiro registo: um único pedido
+    return next(iter(list_records("Tickets", fields=TICKET_INDEX_FIELDS, formula=formula, page_size=1)), None)
+
+
+def get_ticket_data(ticket_id: str) -> dict:
+    """
+    Retrieve ticket data from Airtable Tickets table.
+    Served from ticket_index when warm; otherwise searches by ticket_id field.
+    """
+    try:
+        indexed = ticket_index.get(ticket_id)
+        if indexed:
+            return indexed
+
+        # Pré-filtros em memória: miss recente ou ticket_id nunca emitido (Bloom)
+        if _unknown_tickets.get(ticket_id) or ticket_index.might_exist(ticket_id) is False:
+            _unknown_tickets.add(ticket_id)
+            return {"success": False, "error": f"Ticket {ticket_id} não encontrado", "cached_miss": True}
+
+        record = _find_ticket_record("ticket_id", ticket_id)
+        if record:
+            ticket = _ticket_from_record(record)
+            if ticket_index.is_warm:
+                ticket_index.put(ticket)
+            return dict(ticket)
         else:
+            _unknown_tickets.add(ticket_id)
             return {"success": False, "error": f"Ticket {ticket_id} não encontrado"}
     except Exception as exc:
         log_ticket_validation(ticket_id, "", None, "error", str(exc))
@@ -117,125 +646,119 @@ def get_ticket_data(ticket_id: str) -> dict:
 def get_ticket_by_charge_id(charge_id: str) -> dict:
     """
     Retrieve ticket data from Airtable Tickets table by charge_id.
+    Served from ticket_index when warm.
     """
     try:
         if not charge_id:
             return {"success": False, "error": "charge_id vazio"}
-        api_key, base_id = get_airtable_config()
-        formula = f"{{charge_id}}='{charge_id}'"
-        url = f"https://api.airtable.com/v0/{base_id}/Tickets"
-        params = {
-            "filterByFormula": formula,
-            "maxRecords": 1
-        }
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        resp = requests.get(url, headers=headers, params=params, timeout=30)
-        resp.raise_for_status()
-        records = resp.json().get("records", [])
 
-        if records:
-            record = records[0]
-            return {
-                "success": True,
-                "ticket_id": record["fields"].get("ticket_id"),
-                "status": record["fields"].get("status", "pending"),
-                "customer_name": record["fields"].get("customer_name"),
-                "customer_email": record["fields"].get("customer_email"),
-                "validated_at": record["fields"].get("validated_at"),
-                "validated_by": record["fields"].get("validated_by"),
-                "airtable_id": record["id"],
-                "charge_id": charge_id
-            }
+        indexed = ticket_index.get_by_charge_id(charge_id)
+        if indexed:
+            return indexed
+
+        record = _find_ticket_record("charge_id", charge_id)
+        if record:
+            ticket = _ticket_from_record(record)
+            ticket["charge_id"] = charge_id
+            if ticket_index.is_warm:
+                ticket_index.put(ticket)
+            return dict(ticket)
         else:
             return {"success": False, "error": f"Ticket não encontrado para charge {charge_id}"}
     except Exception as exc:
         return {"success": False, "error": str(exc)}
 
 
+def get_tickets_by_charge_ids(charge_ids: list) -> dict:
+    """
+    {charge_id: ticket} for many charges at once: served from ticket_index, and the
+    misses with chunked OR() lookups (one Airtable request per 50 charges).
+    """
+    found = {}
+    missing = []
+    for charge_id in dict.fromkeys(c for c in charge_ids if c):
+        indexed = ticket_index.get_by_charge_id(charge_id)
+        if indexed:
+            found[charge_id] = indexed
+        else:
+            missing.append(charge_id)
+    if missing:
+        found.update(_find_ticket_records("charge_id", missing))
+    return found
+
+
 def download_ticket_pdf(ticket_id: str) -> tuple:
     """
-    Download ticket PDF from Airtable (base64 decoded).
+    Download ticket PDF via its pdf_url.
+    The URL comes from ticket_index (no request) or a single Airtable lookup;
+    the file is served from the local PDF disk cache when possible.
     Returns: (pdf_bytes, filename) or (None, None) if not found
     """
     try:
         ticket_data = get_ticket_data(ticket_id)
         if not ticket_data.get("success"):
             return None, None
-        
-        api_key, base_id = get_airtable_config()
-        record_id = ticket_data.get("airtable_id")
-        
-        # Fetch full record to get PDF attachment
-        url = f"https://api.airtable.com/v0/{base_id}/Tickets/{record_id}"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        resp = requests.get(url, headers=headers, timeout=30)
-        resp.raise_for_status()
-        record = resp.json()
-        
-        # Check for PDF attachment
-        pdf_field = record["fields"].get("pdf_attachment", [])
-        if not pdf_field or not isinstance(pdf_field, list) or len(pdf_field) == 0:
+
+        pdf_url = ticket_data.get("pdf_url")
+        if not pdf_url:
             return None, None
-        
-        pdf_url = pdf_field[0].get("url")
-        filename = pdf_field[0].get("filename", f"ticket_{ticket_id}.pdf")
-        
-        if pdf_url:
-            resp = requests.get(pdf_url, timeout=30)
-            resp.raise_for_status()
-            return resp.content, filename
-        
-        return None, None
+
+        return get_pdf_cache().get(pdf_url), f"ticket_{ticket_id}.pdf"
     except Exception as exc:
         log_ticket_validation(ticket_id, "", None, "error", f"Download PDF: {str(exc)}")
         return None, None
 
 
+STATS_RECONCILE_SECONDS = 300
+# Intervalo mínimo entre tentativas (também quando o Airtable falha e nunca houve reconciliação)
+STATS_RETRY_SECONDS = 60
+_reconcile_lock = threading.Lock()
+_last_reconcile_attempt = None
+
+
+def _reconcile_ticket_statistics():
+    global _last_reconcile_attempt
+    if not _reconcile_lock.acquire(blocking=False):
+        return
+    _last_reconcile_attempt = time.monotonic()
+    try:
+        ticket_stats.reconcile()
+    except Exception as exc:
+        print(f"[WARNING] Reconciliação das estatísticas falhou: {str(exc)}")
+    finally:
+        _reconcile_lock.release()
+
+
 def get_ticket_statistics() -> dict:
     """
-    Get ticket statistics: total, validated, pending.
-    Queries Airtable for aggregated data.
+    Get ticket statistics: total, validated, pending (not yet validated),
+    plus counts per ticket_type, per gate and per 5-minute bucket.
+    Served from locally maintained counters; reconciled with Airtable in the
+    background every STATS_RECONCILE_SECONDS (synchronously on first use in the
+    process). Failed attempts are retried at most every STATS_RETRY_SECONDS.
     """
     try:
-        api_key, base_id = get_airtable_config()
-        url = f"https://api.airtable.com/v0/{base_id}/Tickets"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Get all tickets with pagination
-        all_records = []
-        offset = None
-        params = {"pageSize": 100}
-        
-        while True:
-            if offset:
-                params["offset"] = offset
-            resp = requests.get(url, headers=headers, params=params, timeout=30)
-            resp.raise_for_status()
-            data = resp.json()
-            all_records.extend(data.get("records", []))
-            offset = data.get("offset")
-            if not offset:
-                break
-        
-        # Count by status
-        validated = sum(1 for r in all_records if r["fields"].get("status") == "validated")
-        pending = sum(1 for r in all_records if r["fields"].get("status") == "pending")
-        
+        last = ticket_stats.reconciled_at()
+        stale = last is None or (datetime.now(tz=timezone.utc) - last).total_seconds() > STATS_RECONCILE_SECONDS
+        attempted = _last_reconcile_attempt
+        if last is None and attempted is None:
+            _reconcile_ticket_statistics()
+        elif stale and (attempted is None or time.monotonic() - attempted > STATS_RETRY_SECONDS):
+            threading.Thread(target=_reconcile_ticket_statistics, name="ticket-stats-reconcile", daemon=True).start()
+
+        counters = ticket_stats.get_counters()
+        total = counters["total"]
+        validated = counters["validated"]
         return {
             "success": True,
-            "total_tickets": len(all_records),
+            "total_tickets": total,
             "validated": validated,
-            "pending": pending,
-            "percentage_validated": round((validated / len(all_records) * 100) if all_records else 0, 2)
+            "pending": counters["pending"],
+            "percentage_validated": round((validated / total * 100) if total else 0, 2),
+            "by_ticket_type": counters["by_ticket_type"],
+            "by_gate": counters["by_gate"],
+            "by_bucket": counters["by_bucket"],
+            "reconciled_at": last.isoformat() if last else None
         }
     except Exception as exc:
         log_ticket_validation("stats", "", None, "error", str(exc))
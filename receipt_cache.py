@@ -0,0 +1,95 @@
+"""
+Persistent receipt cache shared by the sync module and the Streamlit dashboard.
+
+Stripe receipts never change after payment, so each receipt page is fetched at most
+once: the raw HTML is stored zlib-compressed in SQLite, keyed by the receipt URL
+token, together with the parsed result.
+"""
+
+import json
+import zlib
+import threading
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+from urllib.parse import urlsplit
+
+import requests
+
+from local_state import connect
+
+RECEIPT_CACHE_DB = "receipt_cache.db"
+
+_conn = None
+_conn_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = connect(RECEIPT_CACHE_DB)
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS receipts (
+                    token TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    html_z BLOB,
+                    parsed_json TEXT,
+                    fetched_at TEXT NOT NULL
+                )
+                """
+            )
+        return _conn
+
+
+def receipt_token(receipt_url: str) -> str:
+    """Receipt token: last path segment of the receipt URL (query string ignored)."""
+    path = urlsplit(receipt_url).path.rstrip("/")
+    return path.split("/")[-1] or receipt_url
+
+
+def get_cached_html(receipt_url: str) -> Optional[str]:
+    row = _db().execute("SELECT html_z FROM receipts WHERE token = ?", (receipt_token(receipt_url),)).fetchone()
+    if not row or row["html_z"] is None:
+        return None
+    return zlib.decompress(row["html_z"]).decode("utf-8")
+
+
+def get_receipt_html(receipt_url: str, session: requests.Session = None, timeout: int = 10) -> Optional[str]:
+    """
+    Receipt HTML from the cache, fetching (and storing) it on the first request only.
+    Returns None if the receipt could not be fetched (HTTP != 200); raises on network errors.
+    """
+    html = get_cached_html(receipt_url)
+    if html is not None:
+        return html
+    resp = (session or requests).get(receipt_url, timeout=timeout)
+    if resp.status_code != 200:
+        return None
+    html = resp.text
+    with _write_lock:
+        _db().execute(
+            "INSERT INTO receipts (token, url, html_z, fetched_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(token) DO UPDATE SET html_z = excluded.html_z, url = excluded.url",
+            (receipt_token(receipt_url), receipt_url, zlib.compress(html.encode("utf-8"), 6),
+             datetime.now(tz=timezone.utc).isoformat())
+        )
+    return html
+
+
+def get_parsed_receipt(receipt_url: str) -> Optional[Dict[str, Any]]:
+    row = _db().execute("SELECT parsed_json FROM receipts WHERE token = ?", (receipt_token(receipt_url),)).fetchone()
+    if not row or not row["parsed_json"]:
+        return None
+    return json.loads(row["parsed_json"])
+
+
+def store_parsed_receipt(receipt_url: str, parsed: Dict[str, Any]):
+    with _write_lock:
+        _db().execute(
+            "INSERT INTO receipts (token, url, parsed_json, fetched_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(token) DO UPDATE SET parsed_json = excluded.parsed_json",
+            (receipt_token(receipt_url), receipt_url, json.dumps(parsed, ensure_ascii=False),
+             datetime.now(tz=timezone.utc).isoformat())
+        )
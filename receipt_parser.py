@@ -0,0 +1,217 @@
+"""
+Single-pass parser for Stripe receipt HTML.
+
+Shared by the receipt scraper (Airtable Receipts table) and the Streamlit dashboard.
+The HTML is walked once with a precompiled tokenizer (tags / text nodes); receipt
+number, seller, amount, currency, date, line items and the custom message are all
+picked up in that same pass. No DOM tree is built.
+"""
+
+import re
+from html import unescape
+from typing import Optional, Dict, Any
+
+# Tokenizer: <script>/<style> blocks and comments are skipped, tags update the
+# table-cell state, text nodes are matched against the patterns below.
+_TOKEN_PATTERN = re.compile(
+    r"<(?:script|style)\b.*?</(?:script|style)\s*>"
+    r"|<!--.*?-->"
+    r"|<(?P<close>/?)(?P<tag>[a-zA-Z][\w-]*)(?P<attrs>[^>]*)>"
+    r"|(?P<text>[^<]+)",
+    re.DOTALL | re.IGNORECASE
+)
+_CLASS_PATTERN = re.compile(r"""class\s*=\s*["']([^"']*)["']""", re.IGNORECASE)
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Text-node patterns
+RECEIPT_NUMBER_PATTERN = re.compile(r"Receipt\s*#\s*([\d-]+)", re.IGNORECASE)
+SELLER_PATTERN = re.compile(r"Receipt from\s+(.+)", re.IGNORECASE)
+AMOUNT_PATTERN = re.compile(r"Amount paid\s*(.*)", re.IGNORECASE)
+DATE_LABEL_PATTERN = re.compile(r"Date paid\s*(.*)", re.IGNORECASE)
+DATE_PATTERN = re.compile(r"[A-Z][a-z]+\s+\d+,\s+\d{4}.*?[AP]M")
+PRODUCT_PATTERN = re.compile(r"^(.+?)(?:\s*×|\s+x)\s*(\d+)\s*(.*)$")
+MONEY_PATTERN = re.compile(r"([€$£])\s*(-?\d[\d.,]*)|(-?\d[\d.,]*)\s*([€$£])")
+CUSTOM_MESSAGE_PATTERN = re.compile(r"A Bia vai adorar ler a tua mensagem\s*(.*)", re.IGNORECASE)
+CUSTOM_MESSAGE_END = "if you have"
+SUMMARY_LINE_PATTERN = re.compile(r"\b(?:sub)?total\b|\btax\b|\bfees?\b|\bdiscount\b", re.IGNORECASE)
+
+CURRENCY_SYMBOLS = {"€": "EUR", "$": "USD", "£": "GBP"}
+
+
+def _to_float(value: str) -> Optional[float]:
+    """'15,00' / '15.00' / '1.234,56' / '1,234.56' -> float."""
+    if "," in value and "." in value:
+        if value.rfind(",") > value.rfind("."):
+            value = value.replace(".", "").replace(",", ".")
+        else:
+            value = value.replace(",", "")
+    else:
+        value = value.replace(",", ".")
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _money(text: str):
+    """(amount, currency) of the first money value in text, or (None, None)."""
+    match = MONEY_PATTERN.search(text)
+    if not match:
+        return None, None
+    symbol = match.group(1) or match.group(4)
+    return _to_float(match.group(2) or match.group(3)), CURRENCY_SYMBOLS.get(symbol)
+
+
+def _new_item(description: str) -> Dict[str, Any]:
+    quantity = 1
+    match = PRODUCT_PATTERN.match(description)
+    if match:
+        description = match.group(1).strip()
+        quantity = int(match.group(2))
+    return {"description": description, "quantity": quantity, "price": None}
+
+
+def parse_receipt(html: str) -> Dict[str, Any]:
+    """
+    Parse a Stripe receipt in one pass.
+
+    Returns:
+        {
+            "receipt_number": "1234-5678" | None,
+            "seller_name": "..." | None,
+            "amount_paid": 15.0 | None,
+            "currency": "EUR",
+            "date_paid": "February 1, 2026, 10:30 AM" | None,
+            "product_items": [{"description": "...", "quantity": 1, "price": 15.0}, ...],
+            "custom_message": "..." | None
+        }
+    """
+    result = {
+        "receipt_number": None,
+        "seller_name": None,
+        "amount_paid": None,
+        "currency": None,
+        "date_paid": None,
+        "product_items": [],
+        "custom_message": None
+    }
+    items = []
+    cell = None         # "description" / "amount" while inside a Table-* cell
+    pending = None      # item waiting for its amount
+    expect = None       # "amount" / "date": label seen, value in a following text node
+    message = None      # custom message parts while collecting
+    message_done = False
+
+    for match in _TOKEN_PATTERN.finditer(html):
+        tag = match.group("tag")
+        if tag:
+            if match.group("close"):
+                if tag.lower() == "td":
+                    cell = None
+            else:
+                cls = _CLASS_PATTERN.search(match.group("attrs"))
+                if cls and "Table-description" in cls.group(1):
+                    cell = "description"
+                elif cls and "Table-amount" in cls.group(1):
+                    cell = "amount"
+            continue
+
+        raw = match.group("text")
+        if raw is None:
+            continue
+        text = _WHITESPACE_PATTERN.sub(" ", unescape(raw)).strip()
+        if not text:
+            continue
+
+        if message is not None and not message_done:
+            end = text.lower().find(CUSTOM_MESSAGE_END)
+            if end >= 0:
+                text, message_done = text[:end], True
+            message.append(text)
+            continue
+
+        if expect == "amount":
+            amount, currency = _money(text)
+            if amount is not None:
+                result["amount_paid"], expect = amount, None
+                result["currency"] = currency or result["currency"]
+                continue
+        elif expect == "date":
+            found = DATE_PATTERN.search(text)
+            if found:
+                result["date_paid"], expect = found.group(0), None
+                continue
+
+        found = AMOUNT_PATTERN.match(text)
+        if found:
+            amount, currency = _money(found.group(1))
+            if amount is None:
+                expect = "amount"
+            else:
+                result["amount_paid"] = amount
+                result["currency"] = currency or result["currency"]
+            continue
+        found = DATE_LABEL_PATTERN.match(text)
+        if found:
+            date_match = DATE_PATTERN.search(found.group(1))
+            if date_match:
+                result["date_paid"] = date_match.group(0)
+            else:
+                expect = "date"
+            continue
+
+        if cell == "description" or (cell is None and PRODUCT_PATTERN.match(text)):
+            if pending:
+                items.append(pending)
+            pending = _new_item(text)
+            if cell is None:
+                # Linha "Produto × 2 €30.00" num único nó de texto
+                pending["price"], _ = _money(PRODUCT_PATTERN.match(text).group(3))
+                if pending["price"] is not None:
+                    items.append(pending)
+                    pending = None
+            continue
+        if pending and cell in ("amount", None):
+            amount, currency = _money(text)
+            if amount is not None:
+                pending["price"] = amount
+                items.append(pending)
+                pending = None
+                result["currency"] = result["currency"] or currency
+                continue
+
+        if result["receipt_number"] is None:
+            found = RECEIPT_NUMBER_PATTERN.search(text)
+            if found:
+                result["receipt_number"] = found.group(1)
+                continue
+        if result["seller_name"] is None:
+            found = SELLER_PATTERN.search(text)
+            if found:
+                result["seller_name"] = found.group(1).strip()
+                continue
+        if message is None:
+            found = CUSTOM_MESSAGE_PATTERN.search(text)
+            if found:
+                rest = found.group(1)
+                end = rest.lower().find(CUSTOM_MESSAGE_END)
+                if end >= 0:
+                    rest, message_done = rest[:end], True
+                message = [rest]
+                continue
+        if result["currency"] is None and "USD" in text:
+            result["currency"] = "USD"
+
+    if pending:
+        items.append(pending)
+
+    result["product_items"] = [
+        item for item in items
+        if item["description"] and not SUMMARY_LINE_PATTERN.search(item["description"])
+    ]
+    if message:
+        text = _WHITESPACE_PATTERN.sub(" ", " ".join(message)).strip()
+        if len(text) > 5:  # Só mensagens com conteúdo
+            result["custom_message"] = text
+    result["currency"] = result["currency"] or "EUR"
+    return result
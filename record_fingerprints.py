@@ -0,0 +1,115 @@
+"""
+Change detection for Airtable upserts.
+
+A stable hash of each record's field dict is stored per (table, merge key value)
+after every successful write. upsert_record_if_changed / upsert_records_if_changed
+skip records whose hash matches the last write, so re-syncs and repeated events
+(charge.updated, webhook retries) cost no Airtable requests when nothing changed.
+Fingerprints older than FINGERPRINT_MAX_AGE are ignored, so edits made directly
+in Airtable are eventually overwritten again.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Optional, Dict, List, Any
+
+from airtable_client import upsert_record, upsert_records
+from local_state import connect
+
+FINGERPRINT_DB = "fingerprints.db"
+FINGERPRINT_MAX_AGE = int(os.getenv("FINGERPRINT_MAX_AGE", str(7 * 24 * 3600)))
+
+_conn = None
+_conn_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = connect(FINGERPRINT_DB)
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS record_fingerprints (
+                    table_name TEXT NOT NULL,
+                    merge_value TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    written_at REAL NOT NULL,
+                    PRIMARY KEY (table_name, merge_value)
+                )
+                """
+            )
+        return _conn
+
+
+def fingerprint(fields: Dict[str, Any]) -> str:
+    """Stable hash of a field dict (key order and JSON formatting do not matter)."""
+    payload = json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_unchanged(table: str, merge_value: str, fields: Dict[str, Any]) -> bool:
+    """True if fields hash to the last successful write of this record (and it is recent enough)."""
+    if merge_value is None:
+        return False
+    row = _db().execute(
+        "SELECT fingerprint, written_at FROM record_fingerprints WHERE table_name = ? AND merge_value = ?",
+        (table, str(merge_value))
+    ).fetchone()
+    if not row or time.time() - row["written_at"] > FINGERPRINT_MAX_AGE:
+        return False
+    return row["fingerprint"] == fingerprint(fields)
+
+
+def remember(table: str, merge_value: str, fields: Dict[str, Any]):
+    """Record fields as the last successful write of this record."""
+    if merge_value is None:
+        return
+    with _write_lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO record_fingerprints (table_name, merge_value, fingerprint, written_at) "
+            "VALUES (?, ?, ?, ?)",
+            (table, str(merge_value), fingerprint(fields), time.time())
+        )
+
+
+def forget(table: str = None, merge_value: str = None):
+    """Drop fingerprints (one record, one table or all) so the next write goes through."""
+    with _write_lock:
+        if table and merge_value is not None:
+            _db().execute("DELETE FROM record_fingerprints WHERE table_name = ? AND merge_value = ?",
+                          (table, str(merge_value)))
+        elif table:
+            _db().execute("DELETE FROM record_fingerprints WHERE table_name = ?", (table,))
+        else:
+            _db().execute("DELETE FROM record_fingerprints")
+
+
+def upsert_record_if_changed(table: str, fields: Dict[str, Any], merge_on: str) -> Optional[dict]:
+    """
+    upsert_record unless the record is unchanged since its last successful write.
+
+    Returns:
+        The Airtable response, or None if the write was skipped
+    """
+    merge_value = fields.get(merge_on)
+    if is_unchanged(table, merge_value, fields):
+        return None
+    result = upsert_record(table, fields, merge_on=merge_on)
+    remember(table, merge_value, fields)
+    return result
+
+
+def upsert_records_if_changed(table: str, records_fields: List[Dict[str, Any]], merge_on: str) -> List[dict]:
+    """upsert_records for the changed records only; returns the records written."""
+    changed = [fields for fields in records_fields if not is_unchanged(table, fields.get(merge_on), fields)]
+    if not changed:
+        return []
+    written = upsert_records(table, changed, merge_on=merge_on)
+    for fields in changed:
+        remember(table, fields.get(merge_on), fields)
+    return written
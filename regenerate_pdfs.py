@@ -13,6 +13,7 @@ load_dotenv()
 
 from airtable_client import _headers, _table_url, get_airtable_config
 from stripe_airtable_sync import _generate_and_store_ticket_from_charge
+import stripe_cache
 import requests
 
 # Configure Stripe
@@ -73,11 +74,12 @@ for idx, ticket_record in enumerate(all_tickets, 1):
     print(f"[{idx}/{len(all_tickets)}] Processando {ticket_id}... | Charge: {charge_id[:20]}...")
     
     try:
-        # Fetch charge from Stripe
-        charge = stripe.Charge.retrieve(charge_id)
+        # Fetch charge from Stripe (cache partilhada; STRIPE_CACHE_PERSIST=1 reaproveita entre execuções)
+        charge = stripe_cache.retrieve("Charge", charge_id)
         
         # Regenerate ticket with PDF upload to Cloudinary
-        result = _generate_and_store_ticket_from_charge(charge)
+        # O ticket atual já foi lido (versão do regenerado sem novo lookup)
+        result = _generate_and_store_ticket_from_charge(charge, previous_ticket=fields)
         
         if result:
             success_count += 1
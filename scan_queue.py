@@ -0,0 +1,56 @@
+"""
+Thread-safe hand-off of QR scans from the scanner thread to the Streamlit script.
+
+Scans are queued in arrival order; a payload seen again within the cooldown window
+(counted from when it was queued, e.g. the same ticket still held in front of the
+camera) is dropped, so every distinct scan is validated exactly once. release() ends
+the cooldown early when the result was not final (pending), so a re-scan goes through.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+DEFAULT_COOLDOWN = float(os.getenv("QR_SCAN_COOLDOWN", "10"))
+
+
+class ScanQueue:
+    def __init__(self, cooldown: float = DEFAULT_COOLDOWN, maxlen: int = 1000):
+        self.cooldown = cooldown
+        self._queue = deque(maxlen=maxlen)
+        self._last_seen = {}
+        self._lock = threading.Lock()
+
+    def put(self, data: str) -> bool:
+        """Queue a scan. Returns False if the same payload was seen within the cooldown."""
+        if not data:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_seen.get(data)
+            # A janela conta desde a leitura aceite: vê-lo de novo não a prolonga
+            if last is not None and now - last < self.cooldown:
+                return False
+            self._last_seen[data] = now
+            self._queue.append((data, datetime.now(tz=timezone.utc).isoformat()))
+            if len(self._last_seen) > 10000:
+                self._last_seen = {k: v for k, v in self._last_seen.items() if now - v < self.cooldown}
+            return True
+
+    def release(self, data: str):
+        """End the cooldown of this payload (result not final: the next scan is queued)."""
+        with self._lock:
+            self._last_seen.pop(data, None)
+
+    def drain(self) -> list:
+        """Remove and return all queued scans, oldest first, as (data, scanned_at) tuples."""
+        with self._lock:
+            items = list(self._queue)
+            self._queue.clear()
+            return items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queue)
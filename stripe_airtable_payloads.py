@@ -1,6 +1,8 @@
 import json
 from datetime import datetime, timezone
 
+from stripe_expand import object_id
+
 
 def _ts_to_iso(ts):
     if not ts:
@@ -44,7 +46,7 @@ def build_customer_fields(customer_id=None, name=None, email=None, phone=None, a
 
 
 def build_customer_fields_from_charge(charge):
-    customer_id = charge.get("customer")
+    customer_id = object_id(charge.get("customer"))
     billing = charge.get("billing_details", {})
     return build_customer_fields(
         customer_id=customer_id,
@@ -56,7 +58,7 @@ def build_customer_fields_from_charge(charge):
 
 
 def build_customer_fields_from_session(session):
-    customer_id = session.get("customer")
+    customer_id = object_id(session.get("customer"))
     details = session.get("customer_details", {})
     return build_customer_fields(
         customer_id=customer_id,
@@ -67,6 +69,39 @@ def build_customer_fields_from_session(session):
     )
 
 
+def merge_customer_fields(records):
+    """
+    Junta os campos de Customers do mesmo cliente dentro de um lote, para que cada
+    cliente seja escrito uma só vez. Registos com o mesmo customer_id juntam-se, e um
+    registo só com email (customer_id = email) junta-se ao cliente com esse email.
+    Cada campo fica com o primeiro valor não vazio: passar do mais recente para o mais antigo.
+    """
+    merged = {}
+    by_email = {}
+    email_only = []
+    for fields in records:
+        customer_id = fields.get("customer_id")
+        if not customer_id:
+            continue
+        if customer_id == fields.get("email"):
+            email_only.append(fields)
+            continue
+        _fill_missing(merged.setdefault(customer_id, {}), fields)
+        if fields.get("email"):
+            by_email.setdefault(fields["email"].strip().lower(), customer_id)
+
+    for fields in email_only:
+        customer_id = by_email.get(fields["email"].strip().lower(), fields["customer_id"])
+        _fill_missing(merged.setdefault(customer_id, {}), fields)
+    return list(merged.values())
+
+
+def _fill_missing(target, fields):
+    for key, value in fields.items():
+        if target.get(key) in (None, ""):
+            target[key] = value
+
+
 def build_charge_fields(charge):
     return {
         "charge_id": charge.get("id"),
@@ -74,7 +109,7 @@ def build_charge_fields(charge):
         "status": charge.get("status"),
         "amount": (charge.get("amount") or 0) / 100,
         "currency": (charge.get("currency") or "").upper(),
-        "customer_id": charge.get("customer"),
+        "customer_id": object_id(charge.get("customer")),
         "customer_email": charge.get("billing_details", {}).get("email"),
         "billing_name": charge.get("billing_details", {}).get("name"),
         "billing_phone": charge.get("billing_details", {}).get("phone"),
@@ -97,7 +132,7 @@ def build_payment_intent_fields(pi, charge_id=None, receipt_url=None):
         "status": pi.get("status"),
         "amount": (pi.get("amount") or 0) / 100,
         "currency": (pi.get("currency") or "").upper(),
-        "customer_id": pi.get("customer"),
+        "customer_id": object_id(pi.get("customer")),
         "charge_id": charge_id,
         "receipt_url": receipt_url,
         "livemode": pi.get("livemode")
@@ -112,9 +147,9 @@ def build_checkout_session_fields(session, receipt_url=None):
         "mode": session.get("mode"),
         "amount_total": (session.get("amount_total") or 0) / 100,
         "currency": (session.get("currency") or "").upper(),
-        "customer_id": session.get("customer"),
+        "customer_id": object_id(session.get("customer")),
         "customer_email": session.get("customer_details", {}).get("email"),
-        "payment_intent_id": session.get("payment_intent"),
+        "payment_intent_id": object_id(session.get("payment_intent")),
         "client_reference_id": session.get("client_reference_id"),
         "receipt_url": receipt_url,
         "livemode": session.get("livemode")
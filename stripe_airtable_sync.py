@@ -1,13 +1,25 @@
+import os
 import uuid
 from datetime import datetime, timezone
-from airtable_client import upsert_record
+from airtable_client import upsert_record, upload_pdf_to_storage, ticket_pdf_object_key
 from app_logger import log_sync, log_pdf_generation
 from pdf_generator import generate_ticket_pdf, generate_qrcode_data
+from ticket_signing import DEFAULT_ISSUE_VERSION
 from stripe_receipt_scraper import scrape_and_store_receipt
+from ticket_stats import record_ticket_created
+from record_fingerprints import is_unchanged, remember, upsert_record_if_changed
+from job_queue import register_handler, enqueue, start_workers
+from stripe_expand import object_id
+import stripe_cache
 import stripe
 
 stripe_key = None
 
+RECEIPT_JOB = "receipt"
+TICKET_JOB = "ticket"
+JOB_RECEIPT_WORKERS = int(os.getenv("JOB_RECEIPT_WORKERS", "4"))
+JOB_TICKET_WORKERS = int(os.getenv("JOB_TICKET_WORKERS", "2"))
+
 
 def set_stripe_key(api_key: str):
     """Set Stripe API key for module."""
@@ -22,7 +34,66 @@ def _ts_to_iso(ts):
     return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
 
 
-def sync_charge_to_airtable(charge: dict, auto_generate_ticket=False) -> bool:
+def charge_sync_fields(charge: dict) -> dict:
+    """Charges table fields for a Stripe charge."""
+    return {
+        "charge_id": charge.get("id"),
+        "created_at": _ts_to_iso(charge.get("created")),
+        "status": charge.get("status"),
+        "amount": (charge.get("amount") or 0) / 100,
+        "currency": (charge.get("currency") or "").upper(),
+        "customer_id": object_id(charge.get("customer")),
+        "customer_email": (charge.get("billing_details") or {}).get("email"),
+        "billing_name": (charge.get("billing_details") or {}).get("name"),
+        "billing_phone": (charge.get("billing_details") or {}).get("phone"),
+        "description": charge.get("description"),
+        "invoice_id": charge.get("invoice"),
+        "payment_intent_id": charge.get("payment_intent"),
+        "receipt_url": charge.get("receipt_url"),
+        "livemode": charge.get("livemode")
+    }
+
+
+def customer_sync_fields(customer_id: str = None, name: str = None, email: str = None, phone: str = None) -> dict:
+    """Customers table fields (customer_id falls back to the email)."""
+    return {
+        "customer_id": customer_id or email,
+        "name": name,
+        "email": email,
+        "phone": phone,
+    }
+
+
+def checkout_session_sync_fields(session: dict) -> dict:
+    """Checkout_Sessions table fields for a Stripe checkout session."""
+    return {
+        "session_id": session.get("id"),
+        "created_at": _ts_to_iso(session.get("created")),
+        "status": session.get("status"),
+        "mode": session.get("mode"),
+        "amount_total": (session.get("amount_total") or 0) / 100,
+        "currency": (session.get("currency") or "").upper(),
+        "customer_id": object_id(session.get("customer")),
+        "customer_email": (session.get("customer_details") or {}).get("email"),
+        "payment_intent_id": object_id(session.get("payment_intent")),
+        "client_reference_id": session.get("client_reference_id"),
+        "livemode": session.get("livemode")
+    }
+
+
+def payout_sync_fields(payout: dict) -> dict:
+    """Payouts table fields for a Stripe payout."""
+    return {
+        "payout_id": payout.get("id"),
+        "created_at": _ts_to_iso(payout.get("created")),
+        "arrival_date": _ts_to_iso(payout.get("arrival_date")),
+        "status": payout.get("status"),
+        "amount": (payout.get("amount") or 0) / 100,
+        "currency": (payout.get("currency") or "").upper(),
+    }
+
+
+def sync_charge_to_airtable(charge: dict, auto_generate_ticket=False, background=False) -> bool:
     """
     Synchronize Stripe charge to Airtable Charges table.
     Optionally generate a ticket PDF.
@@ -30,6 +101,8 @@ def sync_charge_to_airtable(charge: dict, auto_generate_ticket=False) -> bool:
     Args:
         charge (dict): Stripe charge object
         auto_generate_ticket (bool): Gerar ticket PDF automaticamente
+        background (bool): Só escrever o charge; recibo e ticket vão para a fila de jobs
+            (job_queue, executados pelos workers de start_background_jobs)
         
     Returns:
         bool: True se sucesso, False se erro
@@ -47,39 +120,40 @@ def sync_charge_to_airtable(charge: dict, auto_generate_ticket=False) -> bool:
         return False
     
     try:
-        fields = {
-            "charge_id": charge_id,
-            "created_at": _ts_to_iso(charge.get("created")),
-            "status": charge.get("status"),
-            "amount": (charge.get("amount") or 0) / 100,
-            "currency": (charge.get("currency") or "").upper(),
-            "customer_id": charge.get("customer"),
-            "customer_email": (charge.get("billing_details") or {}).get("email"),
-            "billing_name": (charge.get("billing_details") or {}).get("name"),
-            "billing_phone": (charge.get("billing_details") or {}).get("phone"),
-            "description": charge.get("description"),
-            "invoice_id": charge.get("invoice"),
-            "payment_intent_id": charge.get("payment_intent"),
-            "receipt_url": charge.get("receipt_url"),
-            "livemode": charge.get("livemode")
-        }
-        upsert_record("Charges", fields, merge_on="charge_id")
-        log_sync("Charge", charge_id, "success", f"Charge {charge_id} sincronizado")
+        fields = charge_sync_fields(charge)
+        if is_unchanged("Charges", charge_id, fields):
+            # Nada mudou desde a última escrita (charge + recibo): zero pedidos à Airtable
+            print(f"[INFO] Charge {charge_id} sem alterações; escrita ignorada")
+        else:
+            upsert_record("Charges", fields, merge_on="charge_id")
+            log_sync("Charge", charge_id, "success", f"Charge {charge_id} sincronizado")
 
-        # Scrape and store receipt if available
-        receipt_url = charge.get("receipt_url")
-        if receipt_url:
-            try:
-                if scrape_and_store_receipt(receipt_url, charge_id):
-                    log_sync("Receipt", charge_id, "success", f"Receipt scraped for {charge_id}")
-                else:
-                    log_sync("Receipt", charge_id, "warning", f"Receipt scraping failed for {charge_id}")
-            except Exception as receipt_err:
-                log_sync("Receipt", charge_id, "warning", f"Receipt scraping exception: {str(receipt_err)}")
-                # Não retornar False pois o charge foi sincronizado com sucesso
+            # Scrape and store receipt if available
+            receipt_ok = True
+            receipt_url = charge.get("receipt_url")
+            if receipt_url and background:
+                enqueue(RECEIPT_JOB, charge_id, {"charge_id": charge_id, "receipt_url": receipt_url, "fields": fields})
+                receipt_ok = False  # o job memoriza o fingerprint quando o recibo ficar guardado
+            elif receipt_url:
+                try:
+                    receipt_ok = scrape_and_store_receipt(receipt_url, charge_id)
+                    if receipt_ok:
+                        log_sync("Receipt", charge_id, "success", f"Receipt scraped for {charge_id}")
+                    else:
+                        log_sync("Receipt", charge_id, "warning", f"Receipt scraping failed for {charge_id}")
+                except Exception as receipt_err:
+                    receipt_ok = False
+                    log_sync("Receipt", charge_id, "warning", f"Receipt scraping exception: {str(receipt_err)}")
+                    # Não retornar False pois o charge foi sincronizado com sucesso
+            if receipt_ok:
+                # Só memorizar quando o recibo também ficou guardado (senão volta a tentar)
+                remember("Charges", charge_id, fields)
 
         # Generate ticket if enabled
-        if auto_generate_ticket:
+        if auto_generate_ticket and background:
+            # Um ticket por charge: reentregas do webhook não geram outro
+            enqueue(TICKET_JOB, charge_id, dict(charge), rerun_done=False)
+        elif auto_generate_ticket:
             try:
                 _generate_and_store_ticket_from_charge(charge)
             except Exception as ticket_err:
@@ -113,14 +187,9 @@ def sync_customer_to_airtable(customer_id: str = None, name: str = None, email:
         return False
 
     try:
-        fields = {
-            "customer_id": customer_id or email,
-            "name": name,
-            "email": email,
-            "phone": phone,
-        }
-        upsert_record("Customers", fields, merge_on="customer_id")
-        log_sync("Customer", customer_id or email, "success", f"Cliente {name or email} sincronizado")
+        fields = customer_sync_fields(customer_id, name, email, phone)
+        if upsert_record_if_changed("Customers", fields, merge_on="customer_id") is not None:
+            log_sync("Customer", customer_id or email, "success", f"Cliente {name or email} sincronizado")
         return True
     except Exception as exc:
         error_msg = f"Erro ao sincronizar cliente: {str(exc)}"
@@ -135,21 +204,9 @@ def sync_checkout_session_to_airtable(session: dict) -> bool:
     """
     try:
         session_id = session.get("id")
-        fields = {
-            "session_id": session_id,
-            "created_at": _ts_to_iso(session.get("created")),
-            "status": session.get("status"),
-            "mode": session.get("mode"),
-            "amount_total": (session.get("amount_total") or 0) / 100,
-            "currency": (session.get("currency") or "").upper(),
-            "customer_id": session.get("customer"),
-            "customer_email": (session.get("customer_details") or {}).get("email"),
-            "payment_intent_id": session.get("payment_intent"),
-            "client_reference_id": session.get("client_reference_id"),
-            "livemode": session.get("livemode")
-        }
-        upsert_record("Checkout_Sessions", fields, merge_on="session_id")
-        log_sync("CheckoutSession", session_id, "success")
+        fields = checkout_session_sync_fields(session)
+        if upsert_record_if_changed("Checkout_Sessions", fields, merge_on="session_id") is not None:
+            log_sync("CheckoutSession", session_id, "success")
         return True
     except Exception as exc:
         log_sync("CheckoutSession", session.get("id"), "error", str(exc))
@@ -162,30 +219,52 @@ def sync_payout_to_airtable(payout: dict) -> bool:
     """
     try:
         payout_id = payout.get("id")
-        fields = {
-            "payout_id": payout_id,
-            "created_at": _ts_to_iso(payout.get("created")),
-            "arrival_date": _ts_to_iso(payout.get("arrival_date")),
-            "status": payout.get("status"),
-            "amount": (payout.get("amount") or 0) / 100,
-            "currency": (payout.get("currency") or "").upper(),
-        }
-        upsert_record("Payouts", fields, merge_on="payout_id")
-        log_sync("Payout", payout_id, "success")
+        fields = payout_sync_fields(payout)
+        if upsert_record_if_changed("Payouts", fields, merge_on="payout_id") is not None:
+            log_sync("Payout", payout_id, "success")
         return True
     except Exception as exc:
         log_sync("Payout", payout.get("id"), "error", str(exc))
         return False
 
 
-def _generate_and_store_ticket_from_charge(charge: dict) -> bool:
+def _next_issue_version(charge_id: str, previous_ticket: dict = None) -> int:
     """
-    Internal: Generate ticket PDF from charge and store in Airtable with native attachment.
+    Issue version for a (re)generated ticket: one above the charge's current ticket, so
+    QR codes of a replaced ticket stop being accepted offline.
+
+    Args:
+        previous_ticket: the charge's current ticket when the caller already loaded it
+            (a failed lookup or {} = no ticket). Otherwise it comes from ticket_index, and
+            only with a cold index from one Airtable lookup.
+    """
+    from qrcode_manager import get_ticket_by_charge_id, ticket_index
+
+    if not charge_id:
+        return DEFAULT_ISSUE_VERSION
+    if previous_ticket is None:
+        if ticket_index.is_warm:
+            previous_ticket = ticket_index.get_by_charge_id(charge_id) or {}
+        else:
+            previous_ticket = get_ticket_by_charge_id(charge_id)
+    if not previous_ticket.get("ticket_id"):
+        return DEFAULT_ISSUE_VERSION
+    return int(previous_ticket.get("issue_version") or DEFAULT_ISSUE_VERSION) + 1
+
+
+def _generate_and_store_ticket_from_charge(charge: dict, previous_ticket: dict = None) -> bool:
+    """
+    Internal: Generate ticket PDF from charge, upload it and store the ticket in Airtable.
+    
+    The PDF is rendered and uploaded first (object key derived from ticket_id), so the
+    Tickets row is written once, already with pdf_url, and never exists without a PDF.
+    previous_ticket: the charge's current ticket if already looked up (see _next_issue_version).
     """
     try:
         charge_id = charge.get("id")
         ticket_id = str(uuid.uuid4())
         qrcode_id = str(uuid.uuid4())
+        issue_version = _next_issue_version(charge_id, previous_ticket)
 
         customer_name = (charge.get("billing_details") or {}).get("name") or "Guest"
         customer_email = (charge.get("billing_details") or {}).get("email") or "N/A"
@@ -202,23 +281,22 @@ def _generate_and_store_ticket_from_charge(charge: dict) -> bool:
             quantity=1,
             price=amount,
             currency=currency,
-            items=[{"description": description, "quantity": 1, "amount": amount}]
+            items=[{"description": description, "quantity": 1, "amount": amount}],
+            issue_version=issue_version
         )
+        if not pdf_bytes:
+            error_msg = f"PDF vazio para ticket {ticket_id}"
+            print(f"[WARNING] {error_msg}")
+            log_pdf_generation(ticket_id, "error", error=error_msg)
+            return False
 
-        # Create QR code record
-        qrcode_data = generate_qrcode_data(ticket_id, customer_email)
-        qr_fields = {
-            "qrcode_id": qrcode_id,
-            "ticket_id": ticket_id,
-            "data": qrcode_data,
-            "created_at": datetime.now(tz=timezone.utc).isoformat(),
-            "status": "active"
-        }
-        upsert_record("QRCodes", qr_fields, merge_on="qrcode_id")
+        # Upload PDF before creating the record (no second PATCH for pdf_url)
+        pdf_url = upload_pdf_to_storage(pdf_bytes, ticket_pdf_object_key(ticket_id))
+        pdf_size_bytes = len(pdf_bytes)
 
-        # Create ticket record first (without attachment)
+        # Create ticket record with every field in one request
         # IMPORTANTE: Usar charge_id como chave para evitar duplicatas
-        pdf_size_bytes = len(pdf_bytes) if pdf_bytes else 0
+        now_iso = datetime.now(tz=timezone.utc).isoformat()
         ticket_fields = {
             "ticket_id": ticket_id,
             "qrcode_id": qrcode_id,
@@ -229,51 +307,31 @@ def _generate_and_store_ticket_from_charge(charge: dict) -> bool:
             "quantity": 1,
             "price": amount,
             "currency": currency,
+            "pdf_url": pdf_url,
             "pdf_size_bytes": pdf_size_bytes,
-            "created_at": datetime.now(tz=timezone.utc).isoformat(),
+            "issue_version": issue_version,
+            "created_at": now_iso,
             "status": "generated"
         }
-        ticket_record = upsert_record("Tickets", ticket_fields, merge_on="charge_id")
-        
-        # Extract record ID for attachment upload - IMPROVED
-        record_id = None
-        if ticket_record and isinstance(ticket_record, dict):
-            # Try multiple response formats
-            if "records" in ticket_record and len(ticket_record.get("records", [])) > 0:
-                record_id = ticket_record["records"][0].get("id")
-                print(f"[DEBUG] Found record ID from records array: {record_id}")
-            elif "id" in ticket_record:
-                record_id = ticket_record.get("id")
-                print(f"[DEBUG] Found record ID directly: {record_id}")
-        
-        print(f"[INFO] Ticket {ticket_id} created | Record ID: {record_id} | PDF size: {pdf_size_bytes} bytes")
-        
-        if record_id and pdf_bytes:
-            try:
-                # Upload PDF directly to Airtable attachment field
-                from airtable_client import upload_attachment_to_record
-                print(f"[INFO] Uploading PDF to {record_id}...")
-                attachment_response = upload_attachment_to_record(
-                    table="Tickets",
-                    record_id=record_id,
-                    pdf_bytes=pdf_bytes,
-                    filename=f"ticket_{ticket_id}.pdf"
-                )
-                num_attachments = len(attachment_response) if attachment_response else 0
-                print(f"[SUCCESS] PDF uploaded successfully - {num_attachments} attachment(s)")
-                log_pdf_generation(ticket_id, "success", file_size=pdf_size_bytes)
-            except Exception as attach_err:
-                import traceback
-                error_msg = f"Attachment upload failed: {str(attach_err)}"
-                print(f"[ERROR] {error_msg}")
-                print(f"[TRACEBACK] {traceback.format_exc()}")
-                # Log warning but don't fail - ticket record exists
-                log_pdf_generation(ticket_id, "warning", error=error_msg)
-        else:
-            error_msg = f"Cannot upload attachment - record_id: {record_id}, pdf_bytes: {len(pdf_bytes) if pdf_bytes else 0}"
-            print(f"[WARNING] {error_msg}")
-            log_pdf_generation(ticket_id, "warning", error=error_msg)
+        upsert_record("Tickets", ticket_fields, merge_on="charge_id")
+        print(f"[INFO] Ticket {ticket_id} created | PDF: {pdf_url} | PDF size: {pdf_size_bytes} bytes")
+        try:
+            record_ticket_created(ticket_id, charge_id=charge_id, ticket_type=description)
+        except Exception as stats_err:
+            print(f"[WARNING] Estatísticas não atualizadas: {str(stats_err)}")
+
+        # Create QR code record
+        qrcode_data = generate_qrcode_data(ticket_id, customer_email, issue_version)
+        qr_fields = {
+            "qrcode_id": qrcode_id,
+            "ticket_id": ticket_id,
+            "data": qrcode_data,
+            "created_at": now_iso,
+            "status": "active"
+        }
+        upsert_record("QRCodes", qr_fields, merge_on="qrcode_id")
 
+        log_pdf_generation(ticket_id, "success", file_size=pdf_size_bytes)
         return True
 
     except Exception as exc:
@@ -291,7 +349,7 @@ def generate_ticket_for_charge(charge_id: str, auto_retrieve=True) -> bool:
     """
     try:
         if auto_retrieve and stripe_key:
-            charge = stripe.Charge.retrieve(charge_id)
+            charge = stripe_cache.retrieve("Charge", charge_id)
         else:
             charge = {"id": charge_id}
 
@@ -299,3 +357,28 @@ def generate_ticket_for_charge(charge_id: str, auto_retrieve=True) -> bool:
     except Exception as exc:
         log_pdf_generation(charge_id, "error", error=str(exc))
         return False
+
+
+def _receipt_job(payload: dict) -> bool:
+    """Job: scrape and store the receipt of a charge already written to Charges."""
+    charge_id = payload["charge_id"]
+    if not scrape_and_store_receipt(payload["receipt_url"], charge_id):
+        log_sync("Receipt", charge_id, "warning", f"Receipt scraping failed for {charge_id}")
+        return False
+    log_sync("Receipt", charge_id, "success", f"Receipt scraped for {charge_id}")
+    remember("Charges", charge_id, payload["fields"])
+    return True
+
+
+def _ticket_job(payload: dict) -> bool:
+    """Job: render, upload and store the ticket of a charge."""
+    return _generate_and_store_ticket_from_charge(payload)
+
+
+register_handler(RECEIPT_JOB, _receipt_job, workers=JOB_RECEIPT_WORKERS)
+register_handler(TICKET_JOB, _ticket_job, workers=JOB_TICKET_WORKERS)
+
+
+def start_background_jobs():
+    """Start the receipt/ticket job workers (for processes that call sync_charge_to_airtable(background=True))."""
+    start_workers()
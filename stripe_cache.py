@@ -0,0 +1,216 @@
+"""
+Shared cache of Stripe objects (charges, customers, payment intents, ...).
+
+Bounded in-memory LRU (STRIPE_CACHE_MAX_ENTRIES) with a TTL per entry
+(STRIPE_CACHE_TTL seconds). Entries are also written to .purosuco_state/stripe_cache.db
+(STRIPE_CACHE_PERSIST=0 turns this off), so the dashboard, the webhook server and
+scripts run one after the other (regenerate, diagnose) reuse what another fetched.
+Objects are keyed by id: a charge primed with expand=["customer"] also serves a
+plain retrieve("Charge", id). Webhook handlers call update_from_event() so a cached
+object never outlives a change Stripe told us about (replayed events only invalidate).
+
+    charge = stripe_cache.retrieve("Charge", charge_id, expand=["customer"])
+    stripe_cache.prime("Charge", charges)   # objects already listed
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import stripe
+
+from local_state import connect
+
+STRIPE_CACHE_DB = "stripe_cache.db"
+DEFAULT_MAX_ENTRIES = int(os.getenv("STRIPE_CACHE_MAX_ENTRIES", "5000"))
+DEFAULT_TTL = int(os.getenv("STRIPE_CACHE_TTL", "600"))
+DEFAULT_PERSIST = os.getenv("STRIPE_CACHE_PERSIST", "1") == "1"
+
+# Stripe "object" value -> resource path under the stripe module
+OBJECT_RESOURCES = {
+    "charge": "Charge",
+    "customer": "Customer",
+    "payment_intent": "PaymentIntent",
+    "checkout.session": "checkout.Session",
+    "invoice": "Invoice",
+    "payout": "Payout",
+    "refund": "Refund",
+    "price": "Price",
+    "product": "Product",
+}
+
+
+def _key(resource: str, object_id: str) -> str:
+    return f"{resource}:{object_id}"
+
+
+class StripeObjectCache:
+    """
+    One entry per object (resource:id) with the expand it was fetched with; a lookup
+    is served by the entry when its expand covers the requested one.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: int = DEFAULT_TTL,
+                 persist: bool = DEFAULT_PERSIST):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist = persist
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+        if persist:
+            self._conn = connect(STRIPE_CACHE_DB)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stripe_objects (
+                    key TEXT PRIMARY KEY,
+                    object_id TEXT NOT NULL,
+                    payload_json TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    expand_json TEXT NOT NULL DEFAULT '[]'
+                )
+                """
+            )
+            # stripe_cache.db criados antes da coluna expand_json
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(stripe_objects)")}
+            if "expand_json" not in columns:
+                self._conn.execute("ALTER TABLE stripe_objects ADD COLUMN expand_json TEXT NOT NULL DEFAULT '[]'")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_stripe_objects_id ON stripe_objects (object_id)")
+
+    def get(self, key: str, expand: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Cached object if fresh and fetched with (at least) these expand fields."""
+        wanted = set(expand or [])
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] <= self.ttl and wanted <= entry[2]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry and now - entry[0] > self.ttl:
+                del self._entries[key]
+        if self._conn is not None:
+            with self._db_lock:
+                row = self._conn.execute(
+                    "SELECT payload_json, stored_at, expand_json FROM stripe_objects WHERE key = ?", (key,)
+                ).fetchone()
+            if row and now - row["stored_at"] <= self.ttl and wanted <= set(json.loads(row["expand_json"])):
+                obj = json.loads(row["payload_json"])
+                self._remember(key, obj, row["stored_at"], set(json.loads(row["expand_json"])))
+                with self._lock:
+                    self.hits += 1
+                return obj
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key: str, obj, stored_at: float, expand: set):
+        with self._lock:
+            self._entries[key] = (stored_at, obj, expand)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key: str, obj, expand: Optional[List[str]] = None):
+        """Store the latest copy of the object (replaces any older one, whatever its expand)."""
+        now = time.time()
+        self._remember(key, obj, now, set(expand or []))
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO stripe_objects (key, object_id, payload_json, stored_at, expand_json) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, obj.get("id") or "", json.dumps(obj, ensure_ascii=False, default=str), now,
+                     json.dumps(sorted(expand or [])))
+                )
+
+    def invalidate(self, object_id: str):
+        """Drop the cached copy of this object."""
+        with self._lock:
+            for key in [k for k in self._entries if k.split(":")[1] == object_id]:
+                del self._entries[key]
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute("DELETE FROM stripe_objects WHERE object_id = ?", (object_id,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute("DELETE FROM stripe_objects")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> StripeObjectCache:
+    """Process-wide cache (configured from the STRIPE_CACHE_* env vars)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = StripeObjectCache()
+        return _cache
+
+
+def retrieve(resource: str, object_id: str, expand: Optional[List[str]] = None):
+    """
+    stripe.<resource>.retrieve(object_id, expand=...) through the cache.
+
+    Args:
+        resource: Stripe class name, e.g. "Charge", "PaymentIntent", "checkout.Session"
+        object_id: Stripe id
+        expand: expand list; any cached copy fetched with these fields (or more) is served
+    """
+    key = _key(resource, object_id)
+    obj = get_cache().get(key, expand)
+    if obj is None:
+        params = {"expand": expand} if expand else {}
+        api_class = stripe
+        for name in resource.split("."):
+            api_class = getattr(api_class, name)
+        obj = api_class.retrieve(object_id, **params)
+        get_cache().put(key, obj, expand)
+    return obj
+
+
+def prime(resource: str, objects: Iterable, expand: Optional[List[str]] = None):
+    """Cache objects already fetched by a list call (expand as listed, without the data. prefix)."""
+    cache = get_cache()
+    for obj in objects:
+        if obj.get("id"):
+            cache.put(_key(resource, obj["id"]), obj, expand)
+
+
+def invalidate(object_id: str):
+    if object_id:
+        get_cache().invalidate(object_id)
+
+
+def update_from_event(event, replay: bool = False):
+    """
+    Webhook hook: drop stale copies of the event's object and cache the fresh one.
+    replay=True (catch-up of old events): only invalidate, the snapshot may be outdated.
+    """
+    data_obj = (event.get("data") or {}).get("object") or {}
+    object_id = data_obj.get("id")
+    if not object_id:
+        return
+    invalidate(object_id)
+    if replay:
+        return
+    resource = OBJECT_RESOURCES.get(data_obj.get("object"))
+    if resource:
+        # Objetos de eventos não vêm expandidos
+        get_cache().put(_key(resource, object_id), data_obj)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Catch-up sync a partir do log de eventos da Stripe (stripe.Event.list).
+
+Em vez de voltar a listar todos os objetos, lê os eventos desde o cursor guardado
+(último evento processado) e envia cada um pelo mesmo handler dos webhooks
+(webhook_api.handle_event), do mais antigo para o mais recente, em streaming. Eventos
+que já estão em Stripe_Events são saltados: handle_event só os regista lá depois de os
+handlers terem corrido sem erro. O custo é proporcional ao número de alterações, não
+ao tamanho do histórico.
+
+Uso:
+    python stripe_event_catchup.py [--days-back 3] [--dry-run]
+"""
+
+import os
+import sys
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+
+import stripe
+from dotenv import load_dotenv
+
+from airtable_client import list_records, _escape_formula_value
+from app_logger import log_action
+from local_state import connect
+from stripe_stream import stream_objects
+from sync_checkpoint import CHECKPOINT_DB, get_checkpoint, save_checkpoint
+
+load_dotenv()
+
+CURSOR_ENTITY = "events"
+LOOKUP_CHUNK_SIZE = 50
+CATCHUP_BATCH_SIZE = 100
+# A Stripe guarda eventos durante 30 dias
+MAX_DAYS_BACK = 30
+
+_conn = None
+_conn_lock = threading.Lock()
+
+
+def _db():
+    """Eventos cujo handler falhou durante o catch-up (ficam em Stripe_Events mas não podem ser saltados)."""
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = connect(CHECKPOINT_DB)
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS catchup_failed_events (
+                    event_id TEXT PRIMARY KEY,
+                    attempts INTEGER NOT NULL DEFAULT 1,
+                    last_error TEXT
+                )
+                """
+            )
+        return _conn
+
+
+def _failed_event_ids() -> set:
+    return {row["event_id"] for row in _db().execute("SELECT event_id FROM catchup_failed_events")}
+
+
+def _mark_failed(event_id: str, error: str):
+    _db().execute(
+        "INSERT INTO catchup_failed_events (event_id, last_error) VALUES (?, ?) "
+        "ON CONFLICT(event_id) DO UPDATE SET attempts = attempts + 1, last_error = excluded.last_error",
+        (event_id, error)
+    )
+
+
+def _existing_event_ids(event_ids: list) -> set:
+    """event_ids já presentes em Stripe_Events (um pedido OR() por cada 50 ids)."""
+    found = set()
+    for start in range(0, len(event_ids), LOOKUP_CHUNK_SIZE):
+        chunk = event_ids[start:start + LOOKUP_CHUNK_SIZE]
+        formula = "OR(" + ",".join(f"{{event_id}}='{_escape_formula_value(v)}'" for v in chunk) + ")"
+        for record in list_records("Stripe_Events", fields=["event_id"], formula=formula):
+            event_id = record.get("fields", {}).get("event_id")
+            if event_id:
+                found.add(event_id)
+    return found
+
+
+def cursor_entity(types: list = None) -> str:
+    """
+    Cursor do catch-up. Execuções com --type têm um cursor próprio por filtro: avançar o
+    cursor geral faria saltar para sempre os eventos dos tipos não pedidos.
+    """
+    if not types:
+        return CURSOR_ENTITY
+    return f"{CURSOR_ENTITY}:{','.join(sorted(set(types)))}"
+
+
+def _event_stream(days_back: int = 3, types: list = None):
+    """
+    Eventos posteriores ao cursor, do mais antigo para o mais recente, uma página de cada vez.
+    Com ending_before, auto_paging_iter percorre as páginas no sentido inverso (mais antigo
+    primeiro). Sem cursor, uma primeira passagem só guarda o evento mais antigo da janela.
+    """
+    now = datetime.now(tz=timezone.utc)
+    retention_start = int((now - timedelta(days=MAX_DAYS_BACK)).timestamp())
+    params = {"limit": 100}
+    if types:
+        params["types"] = types
+
+    cursor = get_checkpoint(cursor_entity(types))
+    if cursor and cursor.get("last_id") and cursor["last_created"] > retention_start:
+        yield from stream_objects(stripe.Event.list, {**params, "ending_before": cursor["last_id"]})
+        return
+
+    # Sem cursor (ou o evento do cursor já saiu da retenção da Stripe): janela de days_back dias
+    start_ts = int((now - timedelta(days=min(days_back, MAX_DAYS_BACK))).timestamp())
+    if cursor:
+        start_ts = max(start_ts, cursor["last_created"])
+    oldest = None
+    for event in stream_objects(stripe.Event.list, {**params, "created": {"gte": start_ts}}):
+        oldest = event
+    if oldest is None:
+        return
+    yield oldest
+    yield from stream_objects(stripe.Event.list, {**params, "ending_before": oldest["id"]})
+
+
+def pending_events(days_back: int = 3, types: list = None, batch_size: int = CATCHUP_BATCH_SIZE):
+    """
+    Lotes (listas de até batch_size) de eventos posteriores ao cursor que ainda não estão em
+    Stripe_Events, do mais antigo para o mais recente. Sem cursor, começa days_back dias
+    atrás (máx. 30). Os eventos são lidos da Stripe à medida que os lotes são pedidos.
+    """
+    retry_ids = _failed_event_ids()
+
+    def unprocessed(batch):
+        existing = _existing_event_ids([event["id"] for event in batch if event["id"] not in retry_ids])
+        return [event for event in batch if event["id"] not in existing]
+
+    batch = []
+    for event in _event_stream(days_back=days_back, types=types):
+        batch.append(event)
+        if len(batch) >= batch_size:
+            events = unprocessed(batch)
+            batch = []
+            if events:
+                yield events
+    if batch:
+        events = unprocessed(batch)
+        if events:
+            yield events
+
+
+def run_catchup(days_back: int = 3, types: list = None, dry_run: bool = False) -> dict:
+    """
+    Reprocessa os eventos em falta pelo handler dos webhooks.
+    O cursor avança lote a lote (CATCHUP_BATCH_SIZE eventos); à primeira falha o catch-up
+    pára (a ordem importa), e o evento fica marcado para ser tentado de novo na próxima execução.
+
+    Returns:
+        {"pending": int, "processed": int, "failed": str | None}
+    """
+    from webhook_api import handle_event, upsert_customers
+
+    result = {"pending": 0, "processed": 0, "failed": None}
+    # Em lotes: os clientes de cada lote são juntos e escritos uma vez (upsert_customers)
+    for events in pending_events(days_back=days_back, types=types):
+        result["pending"] += len(events)
+        if dry_run:
+            for event in events:
+                print(f"  - {event['id']} {event['type']} ({datetime.fromtimestamp(event['created']):%Y-%m-%d %H:%M:%S})")
+            continue
+
+        customers = []
+        handled = []
+        for event in events:
+            collected = len(customers)
+            try:
+                handle_event(event, customers, replay=True)
+            except Exception as exc:
+                del customers[collected:]
+                _mark_failed(event["id"], str(exc))
+                result["failed"] = event["id"]
+                print(f"  ✗ {event['id']} {event['type']}: {str(exc)}")
+                break
+            handled.append(event)
+
+        try:
+            # Mais recente primeiro: em caso de conflito ficam os dados mais novos
+            upsert_customers(customers[::-1])
+        except Exception as exc:
+            # Os eventos já estão em Stripe_Events: ficam marcados para não serem saltados
+            for event in handled:
+                _mark_failed(event["id"], f"Customers: {str(exc)}")
+            result["failed"] = result["failed"] or (handled[0]["id"] if handled else None)
+            print(f"  ✗ Customers do lote: {str(exc)}")
+            break
+
+        for event in handled:
+            _db().execute("DELETE FROM catchup_failed_events WHERE event_id = ?", (event["id"],))
+            print(f"  ✓ {event['id']} {event['type']}")
+        if handled:
+            save_checkpoint(cursor_entity(types), handled[-1].get("created") or 0, handled[-1]["id"])
+            result["processed"] += len(handled)
+        if result["failed"]:
+            break
+
+    print(f"[INFO] Catch-up: {result['pending']} evento(s) em falta, {result['processed']} processado(s)")
+    if dry_run:
+        return result
+    log_action("sync", "event_catchup", "success" if not result["failed"] else "partial",
+               message=f"Eventos: {result['pending']} pendentes, {result['processed']} processados"
+                       + (f", parou em {result['failed']}" if result["failed"] else ""))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catch-up de webhooks Stripe a partir de stripe.Event.list")
+    parser.add_argument("--days-back", type=int, default=3,
+                        help="Janela inicial quando ainda não há cursor (máx. 30 dias)")
+    parser.add_argument("--type", action="append", dest="types",
+                        help="Só estes tipos de evento (repetível), ex: --type charge.succeeded")
+    parser.add_argument("--dry-run", action="store_true", help="Só listar os eventos em falta")
+    args = parser.parse_args()
+
+    stripe.api_key = os.getenv("STRIPE_API_KEY")
+    if not stripe.api_key:
+        print("ERRO: STRIPE_API_KEY não encontrada em .env")
+        sys.exit(1)
+
+    outcome = run_catchup(days_back=args.days_back, types=args.types, dry_run=args.dry_run)
+    sys.exit(1 if outcome["failed"] else 0)
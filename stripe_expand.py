@@ -0,0 +1,68 @@
+"""
+Expanded Stripe listings, indexed by id.
+
+One paginated list call with expand (payment_intent.latest_charge, line_items,
+customer) replaces a retrieve per object: the sync and display code look objects up
+in the returned indexes instead of calling Session.list / PaymentIntent.retrieve in
+a loop. Expanded fields are objects instead of ids; object_id() reads either form.
+"""
+
+from typing import Any, Dict, Optional
+
+import stripe
+
+from stripe_stream import stream_objects
+
+CHECKOUT_SESSION_EXPAND = ["data.line_items", "data.customer", "data.payment_intent.latest_charge"]
+PAYMENT_INTENT_EXPAND = ["data.latest_charge", "data.customer"]
+
+
+def object_id(value) -> Optional[str]:
+    """Id of a Stripe reference that may or may not be expanded."""
+    if isinstance(value, dict):
+        return value.get("id")
+    return value
+
+
+def latest_charge(payment_intent) -> Optional[dict]:
+    """The PaymentIntent's charge, if expanded (latest_charge, or charges.data on older API versions)."""
+    if not isinstance(payment_intent, dict):
+        return None
+    charge = payment_intent.get("latest_charge")
+    if isinstance(charge, dict):
+        return charge
+    charges = (payment_intent.get("charges") or {}).get("data") or []
+    return charges[0] if charges else None
+
+
+def _created_params(created_from: int = None, created_to: int = None) -> Dict[str, Any]:
+    created = {}
+    if created_from is not None:
+        created["gte"] = created_from
+    if created_to is not None:
+        created["lte"] = created_to
+    return {"created": created} if created else {}
+
+
+def list_checkout_sessions(created_from: int = None, created_to: int = None) -> Dict[str, Dict[str, dict]]:
+    """
+    Checkout sessions of the period with line_items, customer and
+    payment_intent.latest_charge expanded, in one paginated listing.
+
+    Returns:
+        {"by_id": {session_id: session}, "by_payment_intent": {payment_intent_id: session}}
+    """
+    params = {"limit": 100, "expand": CHECKOUT_SESSION_EXPAND, **_created_params(created_from, created_to)}
+    by_id, by_payment_intent = {}, {}
+    for session in stream_objects(stripe.checkout.Session.list, params):
+        by_id[session["id"]] = session
+        payment_intent_id = object_id(session.get("payment_intent"))
+        if payment_intent_id:
+            by_payment_intent[payment_intent_id] = session
+    return {"by_id": by_id, "by_payment_intent": by_payment_intent}
+
+
+def list_payment_intents(created_from: int = None, created_to: int = None) -> Dict[str, dict]:
+    """PaymentIntents of the period with latest_charge and customer expanded, by id."""
+    params = {"limit": 100, "expand": PAYMENT_INTENT_EXPAND, **_created_params(created_from, created_to)}
+    return {pi["id"]: pi for pi in stream_objects(stripe.PaymentIntent.list, params)}
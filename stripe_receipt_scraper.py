@@ -4,42 +4,54 @@ Extracts receipt data (items, dates, amounts, custom messages) from Stripe recei
 and stores in Airtable Receipts table.
 """
 
-import re
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Optional, Dict, List, Any
 
 import requests
-from bs4 import BeautifulSoup
 from app_logger import log_action
-from airtable_client import upsert_record
+from record_fingerprints import upsert_record_if_changed, upsert_records_if_changed
+from receipt_cache import get_receipt_html, get_parsed_receipt, store_parsed_receipt
+# Patterns live in receipt_parser (shared with the dashboard); re-exported here
+from receipt_parser import (  # noqa: F401
+    parse_receipt,
+    RECEIPT_NUMBER_PATTERN,
+    SELLER_PATTERN,
+    AMOUNT_PATTERN,
+    DATE_PATTERN,
+    PRODUCT_PATTERN,
+    CUSTOM_MESSAGE_PATTERN
+)
 
-# =========================================================
-# REGEX PATTERNS
-# =========================================================
+DEFAULT_MAX_WORKERS = 8
+
+_thread_local = threading.local()
+
+
+def _get_session() -> requests.Session:
+    """One requests.Session per thread: keep-alive connections reused per host."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        _thread_local.session = session
+    return session
 
-RECEIPT_NUMBER_PATTERN = re.compile(r"Receipt\s*#([\d-]+)")
-SELLER_PATTERN = re.compile(r"Receipt from\s+([^<\n]+)")
-AMOUNT_PATTERN = re.compile(r"AMOUNT PAID[^€]*€([\d,\.]+)")
-DATE_PATTERN = re.compile(r"DATE PAID[^A-Z]*([A-Z][a-z]+\s+\d+,\s+\d{4}.*?[AP]M)")
-PRODUCT_PATTERN = re.compile(r"([^×<>\n]+?)\s*×\s*(\d+)[^€]*€([\d,\.]+)")
-CUSTOM_MESSAGE_PATTERN = re.compile(
-    r"A Bia vai adorar ler a tua mensagem\s+(.+?)(?=If you have|$)",
-    re.DOTALL | re.IGNORECASE
-)
 
 # =========================================================
 # CORE SCRAPER FUNCTIONS
 # =========================================================
 
 
-def scrape_stripe_receipt(receipt_url: str, charge_id: str) -> Optional[Dict[str, Any]]:
+def scrape_stripe_receipt(receipt_url: str, charge_id: str, log_success: bool = True) -> Optional[Dict[str, Any]]:
     """
     Scrape Stripe receipt HTML and extract structured data.
     
     Args:
         receipt_url: Full URL to Stripe receipt (e.g., https://pay.stripe.com/receipts/payment/[token])
         charge_id: Stripe charge ID (for linking in Airtable)
+        log_success: Write a Logs row on success (batch callers log once instead)
     
     Returns:
         Dict with extracted fields or None if scraping failed:
@@ -62,71 +74,49 @@ def scrape_stripe_receipt(receipt_url: str, charge_id: str) -> Optional[Dict[str
         return None
     
     try:
-        # Fetch receipt HTML
-        resp = requests.get(receipt_url, timeout=10)
-        if resp.status_code != 200:
+        # Receipts never change: serve the parsed result from the persistent cache
+        cached = get_parsed_receipt(receipt_url)
+        if cached:
+            cached["charge_id"] = charge_id
+            return cached
+        
+        # Fetch receipt HTML (at most once per receipt; raw HTML is cached too)
+        html = get_receipt_html(receipt_url, session=_get_session(), timeout=10)
+        if html is None:
             log_action("receipt_scraper", "fetch", "error", 
-                      error_details=f"HTTP {resp.status_code} for {receipt_url}")
+                      error_details=f"HTTP error for {receipt_url}")
             return None
         
-        html = resp.text
-        soup = BeautifulSoup(html, "lxml")
-        
         # Extract receipt ID from URL (token after last /)
         receipt_id = receipt_url.split("/")[-1] if receipt_url else charge_id
         
-        # Extract receipt number
-        receipt_number = None
-        match = RECEIPT_NUMBER_PATTERN.search(html)
-        if match:
-            receipt_number = match.group(1)
-        
-        # Extract seller name
-        seller_name = None
-        match = SELLER_PATTERN.search(html)
-        if match:
-            seller_name = match.group(1).strip()
-        
-        # Extract amount paid
-        amount_paid = None
-        match = AMOUNT_PATTERN.search(html)
-        if match:
-            amount_str = match.group(1).replace(",", ".")
-            try:
-                amount_paid = float(amount_str)
-            except ValueError:
-                pass
-        
-        # Extract currency (default EUR)
-        currency = "EUR"
-        if "USD" in html or "$" in html[:500]:
-            currency = "USD"
-        
-        # Extract product items
-        product_items = _extract_product_items(html)
+        # Single pass over the HTML: number, seller, amount, currency, items, message
+        parsed = parse_receipt(html)
+        seller_name = parsed["seller_name"]
+        product_items = parsed["product_items"]
         items_count = len(product_items)
         
-        # Extract custom message
-        custom_message = _extract_custom_message(html)
-        
         # Build result
         result = {
             "receipt_id": receipt_id,
             "charge_id": charge_id,
             "receipt_url": receipt_url,
-            "receipt_number": receipt_number,
+            "receipt_number": parsed["receipt_number"],
             "seller_name": seller_name,
-            "amount_paid": amount_paid,
-            "currency": currency,
+            "amount_paid": parsed["amount_paid"],
+            "currency": parsed["currency"],
             "product_items": product_items,  # Will be stringified in Airtable
-            "custom_message": custom_message,
+            "custom_message": parsed["custom_message"],
             "items_count": items_count,
             "scraped_at": datetime.now(tz=timezone.utc).isoformat(),
             "scrape_status": "success"
         }
         
-        log_action("receipt_scraper", "scrape", "success",
-                  message=f"Scraped receipt {receipt_id}: {items_count} items, {seller_name}")
+        store_parsed_receipt(receipt_url, result)
+        
+        if log_success:
+            log_action("receipt_scraper", "scrape", "success",
+                      message=f"Scraped receipt {receipt_id}: {items_count} items, {seller_name}")
         
         return result
         
@@ -142,55 +132,12 @@ def scrape_stripe_receipt(receipt_url: str, charge_id: str) -> Optional[Dict[str
 
 def _extract_product_items(html: str) -> List[Dict[str, Any]]:
     """Extract product items from receipt HTML."""
-    items = []
-    
-    try:
-        # Use regex to find all product lines (handles Stripe's HTML structure)
-        for match in PRODUCT_PATTERN.finditer(html):
-            description = match.group(1).strip()
-            quantity = int(match.group(2))
-            price_str = match.group(3).replace(",", ".")
-            
-            try:
-                price = float(price_str)
-            except ValueError:
-                price = 0.0
-            
-            # Filter out common non-product lines
-            desc_lower = description.lower()
-            if any(x in desc_lower for x in ["subtotal", "total", "tax", "fee", "discount"]):
-                continue
-            
-            items.append({
-                "description": description,
-                "quantity": quantity,
-                "price": price
-            })
-        
-    except Exception as e:
-        log_action("receipt_scraper", "extract_items", "error",
-                  error_details=f"Item extraction failed: {str(e)}")
-    
-    return items
+    return parse_receipt(html)["product_items"]
 
 
 def _extract_custom_message(html: str) -> Optional[str]:
     """Extract custom personalized message after the marker phrase."""
-    try:
-        match = CUSTOM_MESSAGE_PATTERN.search(html)
-        if match:
-            message = match.group(1).strip()
-            # Clean up HTML tags and extra whitespace
-            message = re.sub(r"<[^>]+>", "", message)
-            message = re.sub(r"\s+", " ", message).strip()
-            
-            if message and len(message) > 5:  # Only return if meaningful
-                return message
-    except Exception as e:
-        log_action("receipt_scraper", "extract_message", "error",
-                  error_details=f"Message extraction failed: {str(e)}")
-    
-    return None
+    return parse_receipt(html)["custom_message"]
 
 
 # =========================================================
@@ -223,15 +170,10 @@ def scrape_and_store_receipt(receipt_url: str, charge_id: str) -> bool:
         # Convert product items to JSON string for storage
         receipt_data["product_items"] = json.dumps(receipt_data["product_items"], ensure_ascii=False)
         
-        # Upsert to Receipts table
-        upsert_record(
-            "Receipts",
-            receipt_data,
-            merge_on="charge_id"
-        )
-        
-        log_action("receipt_scraper", "store", "success",
-                  message=f"Receipt {receipt_data['receipt_id']} stored for charge {charge_id}")
+        # Upsert to Receipts table (skipped when unchanged since the last write)
+        if upsert_record_if_changed("Receipts", receipt_data, merge_on="charge_id") is not None:
+            log_action("receipt_scraper", "store", "success",
+                      message=f"Receipt {receipt_data['receipt_id']} stored for charge {charge_id}")
         return True
         
     except Exception as e:
@@ -240,33 +182,63 @@ def scrape_and_store_receipt(receipt_url: str, charge_id: str) -> bool:
         return False
 
 
-def scrape_receipts_from_charges(charges: List[Dict[str, Any]]) -> Dict[str, int]:
+def scrape_receipts_from_charges(
+    charges: List[Dict[str, Any]],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    batch_size: int = 10
+) -> Dict[str, int]:
     """
     Batch process receipts from multiple charges.
     
+    Receipts are fetched concurrently by a bounded thread pool (one keep-alive session
+    per worker); the scraped rows are written to Receipts in batches of batch_size.
+    
     Args:
         charges: List of Stripe charge objects from API
+        max_workers: Concurrent receipt fetches
+        batch_size: Rows per Airtable write (Airtable max 10)
     
     Returns:
         Stats dict: {"processed": int, "successful": int, "failed": int, "skipped": int}
     """
     stats = {"processed": 0, "successful": 0, "failed": 0, "skipped": 0}
     
+    jobs = []
     for charge in charges:
         charge_id = charge.get("id")
         receipt_url = charge.get("receipt_url")
         
-        if not receipt_url:
+        if not receipt_url or not charge_id:
             stats["skipped"] += 1
             continue
-        
-        stats["processed"] += 1
-        if scrape_and_store_receipt(receipt_url, charge_id):
-            stats["successful"] += 1
-        else:
+        jobs.append((receipt_url, charge_id))
+    
+    stats["processed"] = len(jobs)
+    if not jobs:
+        return stats
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as pool:
+        results = list(pool.map(lambda job: scrape_stripe_receipt(job[0], job[1], log_success=False), jobs))
+    
+    rows = []
+    for receipt_data in results:
+        if not receipt_data:
             stats["failed"] += 1
+            continue
+        receipt_data["product_items"] = json.dumps(receipt_data["product_items"], ensure_ascii=False)
+        rows.append(receipt_data)
+    
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        try:
+            upsert_records_if_changed("Receipts", batch, merge_on="charge_id")
+            stats["successful"] += len(batch)
+        except Exception as e:
+            stats["failed"] += len(batch)
+            log_action("receipt_scraper", "store_batch", "error",
+                      error_details=f"Upsert failed: {str(e)}")
     
-    log_action("receipt_scraper", "batch", "success",
+    log_action("receipt_scraper", "batch", "success" if not stats["failed"] else "partial",
               message=f"Batch processed: {stats['processed']} charges, {stats['successful']} successful, {stats['failed']} failed")
     
     return stats
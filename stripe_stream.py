@@ -0,0 +1,30 @@
+"""
+Streaming access to Stripe list endpoints.
+
+stream_objects() follows every page with auto_paging_iter and yields objects one
+at a time, so only the current page (limit objects) is held in memory.
+"""
+
+from itertools import islice
+from typing import Callable, Iterator, Dict, Any
+
+DEFAULT_PAGE_SIZE = 100
+
+
+def stream_objects(list_callable: Callable, params: Dict[str, Any] = None, max_records: int = None) -> Iterator:
+    """
+    Yield all objects of a Stripe list call (e.g. stripe.Charge.list) lazily.
+
+    Args:
+        list_callable: Stripe list method
+        params: list parameters (created, expand, ...); limit defaults to 100 per page
+        max_records: stop after this many objects (None = all pages)
+    """
+    params = dict(params or {})
+    params.setdefault("limit", DEFAULT_PAGE_SIZE)
+    objects = list_callable(**params).auto_paging_iter()
+    if max_records:
+        objects = islice(objects, max_records)
+    for obj in objects:
+        yield obj
+
@@ -6,23 +6,29 @@ import stripe
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import re
-import requests
-import cv2
 from streamlit_webrtc import webrtc_streamer, VideoTransformerBase
 from dotenv import load_dotenv
 from datetime import datetime, date, timezone, timedelta
-from airtable_client import upsert_record
+from record_fingerprints import upsert_record_if_changed, upsert_records_if_changed
 from stripe_airtable_payloads import (
     build_charge_fields,
     build_customer_fields_from_charge,
     build_customer_fields_from_session,
     build_payment_intent_fields,
-    build_checkout_session_fields
+    build_checkout_session_fields,
+    merge_customer_fields
 )
 from create_airtable_schema import ensure_schema
 from stripe_airtable_sync import sync_charge_to_airtable
-from qrcode_manager import validate_qrcode, mark_ticket_as_validated, get_ticket_data, get_ticket_by_charge_id
+from qrcode_manager import admit, get_ticket_by_charge_id, get_tickets_by_charge_ids, ticket_index, get_ticket_statistics
+from validation_client import get_service_url, admit_remote, recent_remote, EventFeed
+from qr_detector import AdaptiveQRDetector
+from scan_queue import ScanQueue
+from receipt_cache import get_receipt_html, get_parsed_receipt
+from receipt_parser import parse_receipt
+from stripe_stream import stream_objects
+from stripe_expand import list_checkout_sessions, list_payment_intents, object_id, latest_charge
+import stripe_cache
 
 # ---------------------------------------------------------
 # CONFIG
@@ -64,12 +70,8 @@ def _to_unix_date(dt_value, end_of_day=False):
 
 
 def _fetch_all(list_callable, params, max_records=None):
-    data = []
-    for item in list_callable(**params).auto_paging_iter():
-        data.append(item)
-        if max_records and len(data) >= max_records:
-            break
-    return data
+    """Lista materializada (para o st.cache_data/DataFrames), lida do stream partilhado."""
+    return list(stream_objects(list_callable, params, max_records=max_records))
 
 
 @st.cache_data(ttl=300)
@@ -85,7 +87,9 @@ def get_charges(created_from=None, created_to=None, max_records=1000):
         created["lte"] = created_to
     if created:
         params["created"] = created
-    return _fetch_all(stripe.Charge.list, params, max_records=max_records)
+    charges = _fetch_all(stripe.Charge.list, params, max_records=max_records)
+    stripe_cache.prime("Charge", charges, expand=["customer"])
+    return charges
 
 @st.cache_data(ttl=300)
 def get_invoices(created_from=None, created_to=None, max_records=1000):
@@ -130,49 +134,27 @@ def get_prices(max_records=1000):
     return _fetch_all(stripe.Price.list, params, max_records=max_records)
 
 
-@st.cache_data(ttl=600)
+@st.cache_resource
+def get_validation_feed(service_url):
+    """Uma subscrição de /events por processo (partilhada entre sessões)."""
+    return EventFeed()
+
+
 def scrape_receipt_items(receipt_url):
-    """Extrai itens do HTML do recibo da Stripe via receipt_url."""
+    """Itens do recibo da Stripe via receipt_url (parser partilhado + cache persistente)."""
     if not receipt_url:
         return []
     try:
-        resp = requests.get(receipt_url, timeout=10)
-        if resp.status_code != 200:
-            return []
-        html = resp.text
-        items = []
-        for block in re.findall(r"Table-description[^<]*</td>.*?Table-amount[^<]*</td>", html, flags=re.S):
-            desc_match = re.search(r"Table-description[^>]*>([^<]+)", block)
-            amt_match = re.search(r"Table-amount[^>]*>([^<]+)", block)
-            desc_raw = desc_match.group(1).strip() if desc_match else ""
-            amount_raw = amt_match.group(1).strip() if amt_match else ""
-
-            qty = None
-            desc_clean = desc_raw
-            qty_match = re.search(r"[×x]\s*(\d+)", desc_raw)
-            if qty_match:
-                qty = int(qty_match.group(1))
-                desc_clean = re.sub(r"\s*[×x]\s*\d+", "", desc_raw).strip()
-
-            amount_value = None
-            amount_clean = re.sub(r"[^\d,.-]", "", amount_raw)
-            amount_clean = amount_clean.replace(",", ".")
-            if amount_clean:
-                try:
-                    amount_value = float(amount_clean)
-                except Exception:
-                    amount_value = None
-            if qty is None and desc_raw:
-                qty = 1
-
-            items.append({
-                "description": desc_clean or desc_raw,
-                "quantity": qty,
-                "amount": amount_value,
-                "amount_raw": amount_raw,
-            })
-        # remover subtotal/linhas sem produto
-        return [i for i in items if i.get("description") and not str(i.get("description")).lower().startswith("subtotal")]
+        parsed = get_parsed_receipt(receipt_url)
+        if parsed is None:
+            html = get_receipt_html(receipt_url, timeout=10)
+            if html is None:
+                return []
+            parsed = parse_receipt(html)
+        return [
+            {"description": item.get("description"), "quantity": item.get("quantity"), "amount": item.get("price")}
+            for item in parsed.get("product_items") or []
+        ]
     except Exception:
         return []
 
@@ -251,25 +233,137 @@ def resolve_product_details(product_id, price_id, product_lookup, price_lookup):
     return details
 
 
-CHECKOUT_SESSION_CACHE = {}
+# Sessões de checkout expiram no máximo 24h após a criação
+CHECKOUT_SESSION_WINDOW = 24 * 3600
 
 
-def fetch_checkout_session(payment_intent_id):
-    if not payment_intent_id:
-        return None
-    if payment_intent_id in CHECKOUT_SESSION_CACHE:
-        return CHECKOUT_SESSION_CACHE[payment_intent_id]
+@st.cache_data(ttl=300)
+def get_checkout_sessions(created_from, created_to):
+    """
+    Checkout sessions do período numa só listagem paginada, com line_items, customer e
+    payment_intent.latest_charge expandidos; indexadas por id e por payment_intent.
+    Partilhadas pela tabela de vendas, pelos botões de sincronização e pelos Detalhes.
+    """
+    return list_checkout_sessions(created_from, created_to)
+
+
+@st.cache_data(ttl=300)
+def get_payment_intents(created_from, created_to):
+    """PaymentIntents do período (latest_charge expandido) numa só listagem, por id."""
+    return list_payment_intents(created_from, created_to)
+
+
+def _created_window(objects, before=0, after=0):
+    created = [obj["created"] for obj in objects if obj.get("created")]
+    if not created:
+        return None, None
+    return min(created) - before, max(created) + after
+
+
+def _upsert_batch_customers(batch_customers):
+    """Clientes do lote (mais recente primeiro) juntos por customer_id/email e escritos uma vez cada."""
     try:
-        sessions = stripe.checkout.Session.list(
-            payment_intent=payment_intent_id,
-            limit=1,
-            expand=["data.line_items.data.price.product"]
-        )
-        session = sessions["data"][0] if sessions and sessions["data"] else None
-    except Exception:
-        session = None
-    CHECKOUT_SESSION_CACHE[payment_intent_id] = session
-    return session
+        return len(upsert_records_if_changed("Customers", merge_customer_fields(batch_customers), merge_on="customer_id"))
+    except Exception as e:
+        st.warning(f"Erro ao sincronizar clientes: {str(e)}")
+        return 0
+
+
+def get_checkout_line_items(created_from, created_to):
+    """line_items das checkout sessions do período, indexados por payment_intent."""
+    lookup = {}
+    for payment_intent, session in get_checkout_sessions(created_from, created_to)["by_payment_intent"].items():
+        line_items = (session.get("line_items") or {}).get("data") or []
+        if not line_items:
+            continue
+        lines = []
+        for li in line_items:
+            price = li.get("price") or {}
+            prod = price.get("product")
+            lines.append({
+                "product_id": prod.get("id") if isinstance(prod, dict) else prod,
+                "price_id": price.get("id"),
+                "quantity": li.get("quantity"),
+                "description": li.get("description"),
+            })
+        lookup[payment_intent] = lines
+    return lookup
+
+
+def _match_catalog(charge, product_lookup, price_lookup):
+    """
+    Produto pelo catálogo, só com preço exatamente igual ao valor do charge (quantidade 1):
+    nome igual à descrição do charge, ou único preço com esse valor. Caso contrário fica por
+    resolver (segue para o recibo).
+    """
+    amount = charge.get("amount") or 0
+    if not amount:
+        return None
+    currency = (charge.get("currency") or "").lower()
+    description = (charge.get("description") or "").strip().lower()
+    if description:
+        for product_id, prod in product_lookup.items():
+            if (prod.get("name") or "").strip().lower() == description:
+                price_id = prod.get("default_price")
+                price_id = price_id.get("id") if isinstance(price_id, dict) else price_id
+                if (price_lookup.get(price_id) or {}).get("unit_amount") == amount:
+                    return {"product_id": product_id, "price_id": price_id, "quantity": 1}
+
+    candidates = [
+        (price_id, price) for price_id, price in price_lookup.items()
+        if price.get("unit_amount") == amount and (price.get("currency") or "").lower() == currency
+    ]
+    if len(candidates) == 1:
+        price_id, price = candidates[0]
+        return {"product_id": price.get("product_id"), "price_id": price_id, "quantity": 1}
+    return None
+
+
+def resolve_charge_products(charges, product_lookup, price_lookup, invoice_line_lookup):
+    """
+    Produto/preço/quantidade de cada charge, pelas fontes estruturadas primeiro:
+    linhas da invoice → line_items da checkout session (listagem em lote) → catálogo.
+    Só os charges que continuam por resolver têm o recibo (HTML) lido.
+
+    Returns:
+        {charge_id: {"product_id", "price_id", "quantity", "source", "receipt_items"}}
+    """
+    resolved = {}
+    pending = []
+    for ch in charges:
+        lines = invoice_line_lookup.get(ch.get("invoice")) if ch.get("invoice") else None
+        if lines and lines[0].get("product_id"):
+            resolved[ch["id"]] = {**lines[0], "source": "invoice"}
+        else:
+            pending.append(ch)
+
+    with_intent = [ch for ch in pending if ch.get("payment_intent")]
+    if with_intent:
+        created = [ch["created"] for ch in with_intent]
+        session_lines = get_checkout_line_items(min(created) - CHECKOUT_SESSION_WINDOW, max(created))
+        still_pending = []
+        for ch in pending:
+            lines = session_lines.get(ch.get("payment_intent"))
+            if lines and lines[0].get("product_id"):
+                resolved[ch["id"]] = {**lines[0], "source": "checkout"}
+            else:
+                still_pending.append(ch)
+        pending = still_pending
+
+    for ch in pending:
+        match = _match_catalog(ch, product_lookup, price_lookup)
+        if match:
+            resolved[ch["id"]] = {**match, "source": "catalogo"}
+        else:
+            items = scrape_receipt_items(ch.get("receipt_url"))
+            resolved[ch["id"]] = {
+                "product_id": None,
+                "price_id": None,
+                "quantity": items[0].get("quantity") if items else None,
+                "source": "recibo" if items else None,
+                "receipt_items": items,
+            }
+    return resolved
 
 # =========================================================
 # DOMAIN — VENDAS
@@ -277,36 +371,20 @@ def fetch_checkout_session(payment_intent_id):
 def build_sales_dataframe(charges, invoices, product_lookup, price_lookup, invoice_line_lookup):
     rows = []
 
-    invoice_cache = {inv["id"]: inv for inv in invoices}
+    resolutions = resolve_charge_products(charges, product_lookup, price_lookup, invoice_line_lookup)
 
     for ch in charges:
-        invoice_id = ch.get("invoice")
-        product_id = None
-        price_id = None
-        quantidade = None
-        if invoice_id and invoice_id in invoice_line_lookup:
-            line = invoice_line_lookup[invoice_id][0] if invoice_line_lookup[invoice_id] else None
-            if line:
-                product_id = line.get("product_id")
-                price_id = line.get("price_id")
-                quantidade = line.get("quantity")
-        if not product_id:
-            session = fetch_checkout_session(ch.get("payment_intent"))
-            if session and session.get("line_items"):
-                li = session["line_items"]["data"][0]
-                price = li.get("price", {})
-                price_id = price.get("id")
-                prod = price.get("product")
-                product_id = prod.get("id") if isinstance(prod, dict) else prod
-                quantidade = li.get("quantity")
+        resolution = resolutions.get(ch["id"], {})
+        product_id = resolution.get("product_id")
+        price_id = resolution.get("price_id")
+        quantidade = resolution.get("quantity")
+        receipt_items = resolution.get("receipt_items") or []
 
         product_meta = resolve_product_details(product_id, price_id, product_lookup, price_lookup)
         email = ch.get("billing_details", {}).get("email")
         customer_id = ch.get("customer")
         flat_charge = pd.json_normalize([ch], sep="__").iloc[0].to_dict()
         charge_fields = {f"charge__{k}": v for k, v in flat_charge.items()}
-        receipt_url = ch.get("receipt_url") or flat_charge.get("receipt_url")
-        receipt_items = scrape_receipt_items(receipt_url) if receipt_url else []
         produto_nome = (
             product_meta.get("name")
             or flat_charge.get("calculated_statement_descriptor")
@@ -338,6 +416,7 @@ def build_sales_dataframe(charges, invoices, product_lookup, price_lookup, invoi
             "produto_moeda": product_meta.get("currency"),
             "produto_id": product_meta.get("product_id") or product_id,
             "preco_id": product_meta.get("price_id") or price_id,
+            "produto_fonte": resolution.get("source"),
             "endereco": ch.get("billing_details", {}).get("address"),
             **charge_fields
         })
@@ -568,24 +647,13 @@ if menu == "Dashboard":
                             
                             if not existing_ticket.get("success"):
                                 needs_pdf = True
-                            else:
-                                # Verificar se tem pdf_url
-                                from airtable_client import _headers, _table_url, get_airtable_config
-                                import requests
-                                api_key, base_id = get_airtable_config()
-                                ticket_id = existing_ticket.get("ticket_id")
-                                
-                                url = _table_url(base_id, "Tickets")
-                                params = {"filterByFormula": f"{{ticket_id}}='{ticket_id}'"}
-                                resp = requests.get(url, headers=_headers(api_key), params=params)
-                                records = resp.json().get("records", [])
-                                
-                                if records and not records[0].get("fields", {}).get("pdf_url"):
-                                    needs_pdf = True
+                            elif not existing_ticket.get("pdf_url"):
+                                # Lookup já inclui pdf_url (sem segundo pedido ao Airtable)
+                                needs_pdf = True
                             
                             if needs_pdf:
                                 from stripe_airtable_sync import _generate_and_store_ticket_from_charge
-                                if _generate_and_store_ticket_from_charge(ch):
+                                if _generate_and_store_ticket_from_charge(ch, previous_ticket=existing_ticket):
                                     ticket_count += 1
                     except Exception as e:
                         print(f"[SYNC ERROR] {ch.get('id')}: {str(e)}")
@@ -599,6 +667,8 @@ if menu == "Dashboard":
                 ticket_count = 0
                 errors = 0
                 progress_bar = st.progress(0)
+                # Bilhetes atuais de todos os charges num só lookup (versão dos regenerados)
+                previous_tickets = get_tickets_by_charge_ids([c.get("id") for c in charges[:50]])
                 
                 for idx, ch in enumerate(charges[:50]):
                     try:
@@ -608,7 +678,7 @@ if menu == "Dashboard":
                         
                         # SEMPRE gerar ticket com PDF (mesmo se já existir, atualiza)
                         from stripe_airtable_sync import _generate_and_store_ticket_from_charge
-                        if _generate_and_store_ticket_from_charge(ch):
+                        if _generate_and_store_ticket_from_charge(ch, previous_ticket=previous_tickets.get(ch.get("id"), {})):
                             ticket_count += 1
                         
                         progress_bar.progress((idx + 1) / min(50, len(charges)))
@@ -659,25 +729,30 @@ if menu == "Dashboard":
             synced = 0
             tickets_generated = 0
             errors = 0
+            batch_customers = []
             for ch in charges[:max_sync]:
                 try:
                     fields = build_charge_fields(ch)
-                    upsert_record("Charges", fields, merge_on="charge_id")
+                    upsert_record_if_changed("Charges", fields, merge_on="charge_id")
                     customer_fields = build_customer_fields_from_charge(ch)
                     if customer_fields.get("customer_id") or customer_fields.get("email"):
-                        upsert_record("Customers", customer_fields, merge_on="customer_id")
+                        batch_customers.append(customer_fields)
                     synced += 1
 
                     if ch.get("status") == "succeeded":
                         existing_ticket = get_ticket_by_charge_id(ch.get("id"))
                         if not existing_ticket.get("success"):
                             from stripe_airtable_sync import _generate_and_store_ticket_from_charge
-                            if _generate_and_store_ticket_from_charge(ch):
+                            if _generate_and_store_ticket_from_charge(ch, previous_ticket=existing_ticket):
                                 tickets_generated += 1
                 except Exception:
                     errors += 1
 
-            st.success(f"✅ Charges sincronizadas: {synced} | Bilhetes gerados: {tickets_generated} | Erros: {errors}")
+            customers_written = _upsert_batch_customers(batch_customers)
+            st.success(
+                f"✅ Charges sincronizadas: {synced} | Clientes: {customers_written} | "
+                f"Bilhetes gerados: {tickets_generated} | Erros: {errors}"
+            )
 
         st.subheader("Sincronizar Charges COM Geração de Bilhetes")
         if st.button("Enviar Charges + Gerar Bilhetes PDF"):
@@ -687,17 +762,19 @@ if menu == "Dashboard":
             progress_bar = st.progress(0)
             status_placeholder = st.empty()
 
+            batch_customers = []
+            previous_tickets = get_tickets_by_charge_ids([c.get("id") for c in charges[:max_sync]])
             for idx, ch in enumerate(charges[:max_sync]):
                 try:
                     fields = build_charge_fields(ch)
-                    upsert_record("Charges", fields, merge_on="charge_id")
+                    upsert_record_if_changed("Charges", fields, merge_on="charge_id")
                     customer_fields = build_customer_fields_from_charge(ch)
                     if customer_fields.get("customer_id") or customer_fields.get("email"):
-                        upsert_record("Customers", customer_fields, merge_on="customer_id")
+                        batch_customers.append(customer_fields)
                     synced += 1
 
                     from stripe_airtable_sync import _generate_and_store_ticket_from_charge
-                    if _generate_and_store_ticket_from_charge(ch):
+                    if _generate_and_store_ticket_from_charge(ch, previous_ticket=previous_tickets.get(ch.get("id"), {})):
                         tickets_generated += 1
 
                     progress_bar.progress((idx + 1) / min(max_sync, len(charges)))
@@ -707,26 +784,30 @@ if menu == "Dashboard":
                     status_placeholder.warning(f"Erro em {ch.get('id')}: {str(e)}")
 
             progress_bar.progress(1.0)
-            st.success(f"✅ Charges sincronizadas: {synced} | Bilhetes gerados: {tickets_generated} | Erros: {errors}")
+            customers_written = _upsert_batch_customers(batch_customers)
+            st.success(
+                f"✅ Charges sincronizadas: {synced} | Clientes: {customers_written} | "
+                f"Bilhetes gerados: {tickets_generated} | Erros: {errors}"
+            )
 
         st.subheader("Sincronizar Payment Intents")
         if st.button("Enviar Payment Intents para Airtable"):
             synced = 0
             errors = 0
+            # Uma listagem (latest_charge expandido) em vez de um retrieve por invoice
+            pi_from, pi_to = _created_window(invoices[:max_sync], after=CHECKOUT_SESSION_WINDOW)
+            payment_intents = get_payment_intents(pi_from, pi_to) if pi_from is not None else {}
             for inv in invoices[:max_sync]:
-                pi = inv.get("payment_intent")
+                pi = object_id(inv.get("payment_intent"))
                 if not pi:
                     continue
                 try:
-                    pi_obj = stripe.PaymentIntent.retrieve(pi, expand=["charges.data"])
-                    charge_id = None
-                    receipt_url = None
-                    charges_data = pi_obj.get("charges", {}).get("data", []) if isinstance(pi_obj, dict) else pi_obj.charges.data
-                    if charges_data:
-                        charge_id = charges_data[0].get("id")
-                        receipt_url = charges_data[0].get("receipt_url")
+                    pi_obj = payment_intents.get(pi) or stripe_cache.retrieve("PaymentIntent", pi, expand=["latest_charge"])
+                    charge = latest_charge(pi_obj) or {}
+                    charge_id = object_id(pi_obj.get("latest_charge")) or charge.get("id")
+                    receipt_url = charge.get("receipt_url")
                     fields = build_payment_intent_fields(pi_obj, charge_id=charge_id, receipt_url=receipt_url)
-                    upsert_record("Payment_Intents", fields, merge_on="payment_intent_id")
+                    upsert_record_if_changed("Payment_Intents", fields, merge_on="payment_intent_id")
                     synced += 1
                 except Exception:
                     errors += 1
@@ -736,32 +817,31 @@ if menu == "Dashboard":
         if st.button("Enviar Checkout Sessions para Airtable"):
             synced = 0
             errors = 0
+            # Sessões do período numa listagem (payment_intent.latest_charge expandido)
+            session_from, session_to = _created_window(invoices[:max_sync], before=CHECKOUT_SESSION_WINDOW)
+            sessions_by_pi = (
+                get_checkout_sessions(session_from, session_to)["by_payment_intent"]
+                if session_from is not None else {}
+            )
+            batch_customers = []
             for inv in invoices[:max_sync]:
                 try:
-                    if inv.get("payment_intent"):
-                        sessions = stripe.checkout.Session.list(payment_intent=inv.get("payment_intent"), limit=1)
-                        if not sessions.data:
-                            continue
-                        session = sessions.data[0]
-                    else:
+                    session = sessions_by_pi.get(object_id(inv.get("payment_intent")))
+                    if not session:
                         continue
 
-                    receipt_url = None
-                    if session.get("payment_intent"):
-                        pi_obj = stripe.PaymentIntent.retrieve(session.get("payment_intent"), expand=["charges.data"])
-                        charges_data = pi_obj.get("charges", {}).get("data", []) if isinstance(pi_obj, dict) else pi_obj.charges.data
-                        if charges_data:
-                            receipt_url = charges_data[0].get("receipt_url")
+                    receipt_url = (latest_charge(session.get("payment_intent")) or {}).get("receipt_url")
 
                     fields = build_checkout_session_fields(session, receipt_url=receipt_url)
-                    upsert_record("Checkout_Sessions", fields, merge_on="session_id")
+                    upsert_record_if_changed("Checkout_Sessions", fields, merge_on="session_id")
                     customer_fields = build_customer_fields_from_session(session)
                     if customer_fields.get("customer_id") or customer_fields.get("email"):
-                        upsert_record("Customers", customer_fields, merge_on="customer_id")
+                        batch_customers.append(customer_fields)
                     synced += 1
                 except Exception:
                     errors += 1
-            st.success(f"Checkout Sessions sincronizadas: {synced}. Erros: {errors}.")
+            customers_written = _upsert_batch_customers(batch_customers)
+            st.success(f"Checkout Sessions sincronizadas: {synced}. Clientes: {customers_written}. Erros: {errors}.")
 
 
 # =========================================================
@@ -862,10 +942,11 @@ elif menu == "Vendas":
             st.dataframe(resumo, use_container_width=True)
 
         st.subheader("Produtos extraídos do recibo (scraping receipt_url)")
+        st.caption("Só charges sem invoice, line_items de checkout ou correspondência no catálogo.")
         receipt_rows = []
         for _, linha in df.iterrows():
             receipt_url = linha.get("charge__receipt_url") or linha.get("receipt_url")
-            if not receipt_url:
+            if not receipt_url or linha.get("produto_fonte") != "recibo":
                 continue
             for item in scrape_receipt_items(receipt_url):
                 receipt_rows.append({
@@ -877,7 +958,7 @@ elif menu == "Vendas":
                 })
         df_receipt = pd.DataFrame(receipt_rows)
         if df_receipt.empty:
-            st.info("Nenhum dado de recibo captado ou receipt_url ausente.")
+            st.info("Nenhum charge precisou de scraping do recibo (ou receipt_url ausente).")
         else:
             if "Valor (recibo)" in df_receipt.columns:
                 df_receipt["Valor (recibo)"] = df_receipt["Valor (recibo)"].apply(
@@ -1068,6 +1149,16 @@ elif menu == "Detalhes":
                 })
 
     st.subheader("Charges")
+    # Checkout sessions de todos os charges numa listagem, em vez de Session.list por charge
+    session_from, session_to = _created_window(charges, before=CHECKOUT_SESSION_WINDOW)
+    try:
+        checkout_sessions = (
+            get_checkout_sessions(session_from, session_to)
+            if session_from is not None else {"by_id": {}, "by_payment_intent": {}}
+        )
+    except Exception as e:
+        st.warning(f"Não foi possível listar Checkout Sessions: {e}")
+        checkout_sessions = {"by_id": {}, "by_payment_intent": {}}
     for ch in charges:
         with st.expander(ch["id"]):
             st.write(f"Status: {ch['status']}")
@@ -1075,23 +1166,17 @@ elif menu == "Detalhes":
             st.write(pd.to_datetime(ch["created"], unit="s"))
             st.markdown("**Dados brutos do Charge:**")
             st.json(ch)
-            # Tentar buscar dados do Checkout Session associado (se houver)
+            # Checkout Session associado (se houver): pelo id nos metadados ou pelo payment_intent
             checkout_id = ch.get("checkout_session") or ch.get("metadata", {}).get("checkout_session")
-            if not checkout_id:
-                # Tentar buscar pelo campo payment_intent
-                pi = ch.get("payment_intent")
-                if pi:
-                    # Buscar sessions associadas ao payment_intent
-                    try:
-                        sessions = stripe.checkout.Session.list(payment_intent=pi, limit=1)
-                        if sessions and sessions.data:
-                            checkout_id = sessions.data[0]["id"]
-                    except Exception:
-                        pass
-            if checkout_id:
-                st.markdown(f"**Checkout Session:** {checkout_id}")
+            session = (
+                checkout_sessions["by_id"].get(checkout_id) if checkout_id
+                else checkout_sessions["by_payment_intent"].get(object_id(ch.get("payment_intent")))
+            )
+            if session or checkout_id:
+                st.markdown(f"**Checkout Session:** {checkout_id or session['id']}")
                 try:
-                    session = stripe.checkout.Session.retrieve(checkout_id)
+                    if session is None:
+                        session = stripe_cache.retrieve("checkout.Session", checkout_id)
                     st.json(session)
                 except Exception as e:
                     st.warning(f"Não foi possível obter dados do Checkout Session: {e}")
@@ -1149,34 +1234,45 @@ elif menu == "Picking":
     st.title("📱 Picking - Validação de Bilhetes")
     st.caption("Valide bilhetes lendo QR codes com a câmera do telefone. Não há opção manual.")
 
-    if "qr_last" not in st.session_state:
-        st.session_state["qr_last"] = ""
-    if "qr_last_ts" not in st.session_state:
-        st.session_state["qr_last_ts"] = None
-    if "qr_processed" not in st.session_state:
-        st.session_state["qr_processed"] = ""
+    # Com VALIDATION_SERVICE_URL, todas as entradas partilham o serviço de validação
+    validation_service_url = get_service_url()
+    if validation_service_url:
+        st.caption(f"Serviço de validação partilhado: {validation_service_url}")
+    else:
+        # Índice em memória dos Tickets (carga única + refresh incremental em background)
+        ticket_index.start_background_refresh()
+
+    if "scan_queue" not in st.session_state:
+        st.session_state["scan_queue"] = ScanQueue()
     if "validation_history" not in st.session_state:
         st.session_state["validation_history"] = []
     if "last_validation" not in st.session_state:
         st.session_state["last_validation"] = None
 
+    scan_queue = st.session_state["scan_queue"]
+
     class QRScanner(VideoTransformerBase):
         def __init__(self):
-            self.detector = cv2.QRCodeDetector()
+            # Deteção adaptativa (downscale + frame skipping + ROI) numa thread própria;
+            # leituras vão para a fila partilhada (com cooldown por QR code)
+            self.detector = AdaptiveQRDetector(on_result=scan_queue.put)
 
         def transform(self, frame):
-            img = frame.to_ndarray(format="bgr24")
-            data, _, _ = self.detector.detectAndDecode(img)
-            if data:
-                try:
-                    if data != st.session_state.get("qr_last"):
-                        st.session_state["qr_last"] = data
-                        st.session_state["qr_last_ts"] = datetime.now(tz=timezone.utc).isoformat()
-                except Exception:
-                    pass
+            self.detector.submit(frame.to_ndarray(format="bgr24"))
             return frame
 
+        def __del__(self):
+            self.detector.stop()
+
+    stats = get_ticket_statistics()
+    if stats.get("success"):
+        col_s1, col_s2, col_s3 = st.columns(3)
+        col_s1.metric("Bilhetes", stats["total_tickets"])
+        col_s2.metric("Entradas", stats["validated"])
+        col_s3.metric("Por entrar", stats["pending"])
+
     validator_name = st.text_input("Seu nome", placeholder="Porteiro/Segurança", key="validator")
+    gate_name = st.text_input("Entrada", value="principal", key="gate")
 
     webrtc_streamer(
         key="qr-scanner",
@@ -1185,28 +1281,45 @@ elif menu == "Picking":
         async_processing=True,
     )
 
-    qrcode_input = st.session_state.get("qr_last")
-    if qrcode_input and qrcode_input != st.session_state.get("qr_processed"):
-        result = validate_qrcode(qrcode_input, validated_by=validator_name or "system")
-        st.session_state["qr_processed"] = qrcode_input
+    # Processar todas as leituras pendentes, por ordem, uma única vez cada
+    for qrcode_input, scanned_at in scan_queue.drain():
+        # Valida e regista a entrada num só passo (escrita no Airtable em lote, em background)
+        if validation_service_url:
+            try:
+                result = admit_remote(qrcode_input, gate=gate_name or "principal", validated_by=validator_name or "system")
+            except Exception as exc:
+                # Sem o serviço não há deteção de duplicados entre entradas: não admitir localmente
+                result = {
+                    "success": False,
+                    "pending": True,
+                    "ticket_id": None,
+                    "error": f"Serviço de validação indisponível, volte a ler o QR code: {exc}"
+                }
+        else:
+            result = admit(qrcode_input, gate=gate_name or "principal", validated_by=validator_name or "system")
         st.session_state["last_validation"] = result
 
         status_label = "válido" if result.get("success") else "inválido"
         if result.get("already_validated"):
             status_label = "duplicado"
+        elif result.get("pending"):
+            status_label = "pendente"
+            # Resultado não final: a próxima leitura deste QR code não pode ser descartada
+            scan_queue.release(qrcode_input)
 
         st.session_state["validation_history"].insert(0, {
-            "hora": datetime.now(tz=timezone.utc).strftime("%H:%M:%S"),
+            "hora": scanned_at[11:19],
             "ticket_id": result.get("ticket_id") or "N/A",
             "status": status_label,
             "validador": validator_name or "system",
+            "entrada": gate_name or "principal",
             "detalhe": result.get("error") or "ok",
         })
 
     result = st.session_state.get("last_validation")
     if result:
         if result.get("success"):
-            st.success("✅ Bilhete válido!")
+            st.success("✅ Bilhete válido! Entrada registada.")
             col_t1, col_t2, col_t3 = st.columns(3)
             with col_t1:
                 st.metric("Ticket ID", result["ticket_id"][:12])
@@ -1214,19 +1327,28 @@ elif menu == "Picking":
                 st.metric("Validado por", validator_name or "system")
             with col_t3:
                 st.metric("Hora", result.get("validated_at", "").split("T")[1][:5] if result.get("validated_at") else "N/A")
-
-            if st.button("Confirmar Validação"):
-                mark_ticket_as_validated(result["ticket_id"], validator_name or "system")
-                st.success("Entrada registada!")
-                st.balloons()
         elif result.get("already_validated"):
             st.warning("⚠️ Bilhete já validado (duplicado)")
+        elif result.get("pending"):
+            st.info(f"⏳ Pendente: {result.get('error', 'tente novamente')}")
         else:
             st.error(f"❌ Erro: {result.get('error', 'Erro desconhecido')}")
 
     st.divider()
     st.subheader("Histórico de validações (tempo real)")
-    if st.session_state["validation_history"]:
+    shared_history = None
+    if validation_service_url:
+        # Eventos enviados pelo serviço (GET /events); /recent só enquanto ainda não chegou nenhum
+        shared_history = get_validation_feed(validation_service_url).recent(limit=50)
+        if not shared_history:
+            try:
+                shared_history = recent_remote(limit=50)
+            except Exception:
+                shared_history = None
+    if shared_history:
+        st.caption("Entradas registadas em todas as estações")
+        st.dataframe(shared_history, use_container_width=True)
+    elif st.session_state["validation_history"]:
         st.dataframe(st.session_state["validation_history"][:50], use_container_width=True)
     else:
         st.info("Nenhuma validação registada ainda.")
@@ -0,0 +1,123 @@
+"""
+Checkpoints for the incremental Stripe → Airtable bulk sync.
+
+For each entity (charges, customers, checkout_sessions, payouts) the newest
+`created` timestamp and object id already synced are stored in the local state
+dir. The next run lists only objects created since the checkpoint minus an
+overlap window (SYNC_OVERLAP_SECONDS), which catches late updates such as
+refunds or a checkout session completed after it was created.
+"""
+
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+
+from local_state import connect
+
+CHECKPOINT_DB = "sync_state.db"
+DEFAULT_OVERLAP_SECONDS = int(os.getenv("SYNC_OVERLAP_SECONDS", str(24 * 3600)))
+
+_conn = None
+_conn_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = connect(CHECKPOINT_DB)
+            _conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sync_checkpoints (
+                    entity TEXT PRIMARY KEY,
+                    last_created INTEGER NOT NULL,
+                    last_id TEXT,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+        return _conn
+
+
+def get_checkpoint(entity: str) -> Optional[Dict[str, Any]]:
+    """{"last_created": unix ts, "last_id": str, "updated_at": iso} or None if never synced."""
+    row = _db().execute(
+        "SELECT last_created, last_id, updated_at FROM sync_checkpoints WHERE entity = ?", (entity,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def save_checkpoint(entity: str, last_created: int, last_id: str = None):
+    """Store the checkpoint for entity (overwrites; callers pass the position to resume from)."""
+    with _write_lock:
+        _db().execute(
+            "INSERT INTO sync_checkpoints (entity, last_created, last_id, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(entity) DO UPDATE SET last_created = excluded.last_created, "
+            "last_id = excluded.last_id, updated_at = excluded.updated_at",
+            (entity, int(last_created), last_id, datetime.now(tz=timezone.utc).isoformat())
+        )
+
+
+def reset_checkpoint(entity: str = None):
+    """Forget one entity's checkpoint (or all), forcing a full window on the next run."""
+    with _write_lock:
+        if entity:
+            _db().execute("DELETE FROM sync_checkpoints WHERE entity = ?", (entity,))
+        else:
+            _db().execute("DELETE FROM sync_checkpoints")
+
+
+def sync_start(entity: str, default_start: int, overlap: int = None) -> int:
+    """
+    `created[gte]` for the next run: checkpoint minus the overlap window, never earlier
+    than default_start (the days_back window used when there is no checkpoint).
+    """
+    overlap = DEFAULT_OVERLAP_SECONDS if overlap is None else overlap
+    checkpoint = get_checkpoint(entity)
+    if not checkpoint:
+        return default_start
+    return max(default_start, checkpoint["last_created"] - overlap)
+
+
+class CheckpointTracker:
+    """
+    Follows one run and saves where the next one should resume.
+
+    Without errors the checkpoint moves to the newest object seen; if some objects
+    failed it stops at the oldest failure, so they are listed again next time.
+    """
+
+    def __init__(self, entity: str):
+        self.entity = entity
+        self.newest = None
+        self.oldest_failure = None
+        self._lock = threading.Lock()
+
+    def ok(self, obj):
+        key = (obj.get("created") or 0, obj.get("id"))
+        with self._lock:
+            if self.newest is None or key > self.newest:
+                self.newest = key
+
+    def failed(self, obj):
+        key = (obj.get("created") or 0, obj.get("id"))
+        with self._lock:
+            if self.oldest_failure is None or key < self.oldest_failure:
+                self.oldest_failure = key
+
+    def save(self, complete: bool = True):
+        """complete=False (listing truncated): keep the old checkpoint, nothing was skipped yet."""
+        if not complete:
+            return
+        position = self.oldest_failure or self.newest
+        if position is None:
+            return
+        if self.oldest_failure:
+            # Recomeçar imediatamente antes da falha mais antiga
+            position = (position[0] - 1, position[1])
+        previous = get_checkpoint(self.entity)
+        if previous and not self.oldest_failure and previous["last_created"] > position[0]:
+            return
+        save_checkpoint(self.entity, position[0], position[1])
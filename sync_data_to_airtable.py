@@ -6,6 +6,10 @@ Execute manualmente ou como job agendado.
 """
 import os
 import sys
+import json
+import time
+import argparse
+import threading
 from dotenv import load_dotenv
 import stripe
 from datetime import datetime, timedelta
@@ -17,12 +21,19 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 from stripe_airtable_sync import (
     set_stripe_key,
-    sync_charge_to_airtable,
-    sync_customer_to_airtable,
-    sync_checkout_session_to_airtable,
-    sync_payout_to_airtable
+    charge_sync_fields,
+    customer_sync_fields,
+    checkout_session_sync_fields,
+    payout_sync_fields,
+    _generate_and_store_ticket_from_charge
 )
+from stripe_receipt_scraper import scrape_stripe_receipt
 from app_logger import log_action
+from airtable_client import airtable_request_counts, upsert_records, AIRTABLE_BATCH_SIZE
+from sync_checkpoint import sync_start, CheckpointTracker, reset_checkpoint
+from record_fingerprints import is_unchanged, remember, upsert_records_if_changed, forget as forget_fingerprints
+from stripe_stream import stream_objects
+from sync_pipeline import Pipeline, Stage
 
 STRIPE_API_KEY = os.getenv("STRIPE_API_KEY")
 
@@ -33,114 +44,307 @@ if not STRIPE_API_KEY:
 set_stripe_key(STRIPE_API_KEY)
 stripe.api_key = STRIPE_API_KEY
 
+# Workers por etapa do pipeline (a Stripe é lida página a página pela fonte)
+SYNC_TRANSFORM_WORKERS = int(os.getenv("SYNC_TRANSFORM_WORKERS", "1"))
+SYNC_ENRICH_WORKERS = int(os.getenv("SYNC_ENRICH_WORKERS", "8"))
+SYNC_RENDER_WORKERS = int(os.getenv("SYNC_RENDER_WORKERS", "2"))
+SYNC_WRITE_WORKERS = int(os.getenv("SYNC_WRITE_WORKERS", "2"))
 
-def sync_all_charges(limit=100, days_back=30):
-    """Sincronizar todos os charges dos últimos N dias."""
+# Checkpoints das entidades (o cursor do catch-up de eventos é independente)
+SYNC_ENTITIES = ("charges", "customers", "checkout_sessions", "payouts")
+
+
+def _start_ts(entity, days_back, overlap=None):
+    """created[gte] da listagem: checkpoint da última execução (menos overlap) ou days_back."""
+    default_start = int((datetime.now() - timedelta(days=days_back)).timestamp())
+    start_ts = sync_start(entity, default_start, overlap)
+    if start_ts > default_start:
+        print(f"  (incremental desde {datetime.fromtimestamp(start_ts):%Y-%m-%d %H:%M})")
+    return start_ts
+
+
+def _write_stage(table, merge_on, label):
+    """Etapa de escrita: upsert de até 10 registos por pedido e memorização dos fingerprints."""
+    def write(jobs):
+        upsert_records(table, [job["fields"] for job in jobs], merge_on=merge_on)
+        for job in jobs:
+            remember(table, job["fields"].get(merge_on), job["fields"])
+        print(f"  ✓ {len(jobs)} {label}(s) escritos ({jobs[0]['obj']['id'][:12]}...)")
+        return jobs
+    return Stage("write", write, workers=SYNC_WRITE_WORKERS, batch_size=AIRTABLE_BATCH_SIZE)
+
+
+def _transform_stage(table, merge_on, build_fields, tracker, counters):
+    """Etapa de transformação: campos Airtable; registos sem alterações saem já aqui."""
+    def transform(obj):
+        fields = build_fields(obj)
+        if is_unchanged(table, fields.get(merge_on), fields):
+            tracker.ok(obj)
+            counters["unchanged"] += 1
+            return None
+        return {"obj": obj, "fields": fields}
+    return Stage("transform", transform, workers=SYNC_TRANSFORM_WORKERS)
+
+
+def _run_pipeline(entity, objects, stages, tracker, counters):
+    """
+    Corre o pipeline sobre o stream de objetos Stripe e guarda o checkpoint.
+    Devolve {"synced", "errors"}.
+    """
+    def on_error(job, stage, exc):
+        obj = job.get("obj", job) if isinstance(job, dict) else job
+        tracker.failed(obj)
+        print(f"  ✗ Erro ({stage}): {obj.get('id', '?')[:12]}... - {str(exc)}")
+
+    def on_complete(job):
+        if job.get("receipt_ok") is False:
+            # Charge escrito mas sem recibo: o checkpoint não pode passar dele
+            tracker.failed(job["obj"])
+            counters["incomplete"] = counters.get("incomplete", 0) + 1
+            print(f"  ✗ Recibo em falta: {job['obj'].get('id', '?')[:12]}...")
+            return
+        tracker.ok(job["obj"])
+        counters["written"] += 1
+
+    stats = Pipeline(entity, stages, on_error=on_error, on_complete=on_complete).run(objects)
+    errors = sum(stage["errors"] for stage in stats["stages"].values()) + counters.get("incomplete", 0)
+    if stats["source_error"]:
+        # Listagem interrompida: a Stripe lista do mais recente para o mais antigo, por isso
+        # o checkpoint não avança (os mais antigos ainda não lidos seriam saltados)
+        errors += 1
+        print(f"  ✗ Listagem de {entity} interrompida: {stats['source_error']}")
+    else:
+        tracker.save()
+
+    busy = ", ".join(f"{name} {s['busy_seconds']}s/{s['workers']}w" for name, s in stats["stages"].items())
+    print(f"  [{entity}] {stats['seconds']}s | escritos {counters['written']}, "
+          f"sem alterações {counters['unchanged']}, erros {errors} | {busy}")
+    return {"synced": counters["written"] + counters["unchanged"], "errors": errors}
+
+
+def _sync_entity(entity, label, objects, table, merge_on, build_fields):
+    tracker = CheckpointTracker(entity)
+    counters = {"written": 0, "unchanged": 0}
+    stages = [
+        _transform_stage(table, merge_on, build_fields, tracker, counters),
+        _write_stage(table, merge_on, label),
+    ]
+    return _run_pipeline(entity, objects, stages, tracker, counters)
+
+
+def _charge_pipeline_stages(tracker, counters, generate_tickets=False):
+    """transform → enrich (recibos) → render (bilhetes, opcional) → write (Charges + Receipts)."""
+    def enrich(job):
+        charge = job["obj"]
+        job["receipt"] = None
+        job["receipt_ok"] = True
+        if charge.get("receipt_url"):
+            receipt = scrape_stripe_receipt(charge["receipt_url"], charge["id"], log_success=False)
+            if receipt:
+                receipt["product_items"] = json.dumps(receipt["product_items"], ensure_ascii=False)
+            job["receipt"] = receipt
+            job["receipt_ok"] = receipt is not None
+        return job
+
+    def render(job):
+        charge = job["obj"]
+        if charge.get("status") == "succeeded":
+            from qrcode_manager import get_ticket_by_charge_id
+            existing = get_ticket_by_charge_id(charge["id"])
+            if not existing.get("success"):
+                _generate_and_store_ticket_from_charge(charge, previous_ticket=existing)
+        return job
+
+    def write(jobs):
+        upsert_records("Charges", [job["fields"] for job in jobs], merge_on="charge_id")
+        receipts = [job["receipt"] for job in jobs if job["receipt"]]
+        if receipts:
+            upsert_records_if_changed("Receipts", receipts, merge_on="charge_id")
+        for job in jobs:
+            if job["receipt_ok"]:
+                # Recibo em falta: não memorizar, para voltar a tentar na próxima execução
+                remember("Charges", job["fields"]["charge_id"], job["fields"])
+        print(f"  ✓ {len(jobs)} Charge(s) escritos, {len(receipts)} recibo(s) ({jobs[0]['obj']['id'][:12]}...)")
+        return jobs
+
+    stages = [
+        _transform_stage("Charges", "charge_id", charge_sync_fields, tracker, counters),
+        Stage("enrich", enrich, workers=SYNC_ENRICH_WORKERS),
+    ]
+    if generate_tickets:
+        stages.append(Stage("render", render, workers=SYNC_RENDER_WORKERS))
+    stages.append(Stage("write", write, workers=SYNC_WRITE_WORKERS, batch_size=AIRTABLE_BATCH_SIZE))
+    return stages
+
+
+def sync_all_charges(limit=100, days_back=30, overlap=None, generate_tickets=False):
+    """
+    Sincronizar os charges dos últimos N dias (ou desde o último checkpoint), todas as páginas,
+    pelo pipeline fetch → transform → enrich (recibo) → [render (bilhete)] → write.
+    """
     print(f"A sincronizar charges dos últimos {days_back} dias...")
     
-    start_ts = int((datetime.now() - timedelta(days=days_back)).timestamp())
-    charges = stripe.Charge.list(limit=limit, created={'gte': start_ts})
-    
-    synced = 0
-    errors = 0
-    
-    for charge in charges.data:
-        try:
-            sync_charge_to_airtable(charge, auto_generate_ticket=False)
-            synced += 1
-            print(f"  ✓ Charge {charge['id'][:12]}... sincronizado")
-        except Exception as e:
-            errors += 1
-            print(f"  ✗ Erro: {charge['id'][:12]}... - {str(e)}")
+    start_ts = _start_ts("charges", days_back, overlap)
+    charges = stream_objects(stripe.Charge.list, {"limit": limit, "created": {"gte": start_ts}})
+    tracker = CheckpointTracker("charges")
+    counters = {"written": 0, "unchanged": 0}
+    result = _run_pipeline("charges", charges, _charge_pipeline_stages(tracker, counters, generate_tickets),
+                           tracker, counters)
+    synced, errors = result["synced"], result["errors"]
     
     print(f"Resultado: {synced} sincronizados, {errors} erros")
     log_action("sync", "sync_all_charges", f"success" if errors == 0 else "partial", 
                f"Sincronizados: {synced}, Erros: {errors}")
+    return {"synced": synced, "errors": errors}
 
 
-def sync_all_customers(limit=100):
-    """Sincronizar todos os customers."""
+def sync_all_customers(limit=100, overlap=None):
+    """Sincronizar os customers (só os criados desde o último checkpoint, se existir)."""
     print("A sincronizar customers...")
     
-    customers = stripe.Customer.list(limit=limit)
-    synced = 0
-    errors = 0
-    
-    for customer in customers.data:
-        try:
-            sync_customer_to_airtable(
-                customer_id=customer.get('id'),
-                name=customer.get('name'),
-                email=customer.get('email'),
-                phone=customer.get('phone')
-            )
-            synced += 1
-            print(f"  ✓ Customer {customer['id'][:12]}... sincronizado")
-        except Exception as e:
-            errors += 1
-            print(f"  ✗ Erro: {customer['id'][:12]}... - {str(e)}")
+    params = {"limit": limit}
+    start_ts = sync_start("customers", 0, overlap)
+    if start_ts:
+        params["created"] = {"gte": start_ts}
+        print(f"  (incremental desde {datetime.fromtimestamp(start_ts):%Y-%m-%d %H:%M})")
+    customers = stream_objects(stripe.Customer.list, params)
+    result = _sync_entity(
+        "customers", "Customer", customers, "Customers", "customer_id",
+        lambda customer: customer_sync_fields(
+            customer.get('id'), customer.get('name'), customer.get('email'), customer.get('phone')
+        )
+    )
+    synced, errors = result["synced"], result["errors"]
     
     print(f"Resultado: {synced} sincronizados, {errors} erros")
+    return {"synced": synced, "errors": errors}
 
 
-def sync_all_checkout_sessions(limit=100, days_back=30):
-    """Sincronizar todos os checkout sessions."""
+def sync_all_checkout_sessions(limit=100, days_back=30, overlap=None):
+    """Sincronizar os checkout sessions dos últimos N dias (ou desde o último checkpoint)."""
     print(f"A sincronizar checkout sessions dos últimos {days_back} dias...")
     
-    start_ts = int((datetime.now() - timedelta(days=days_back)).timestamp())
-    sessions = stripe.checkout.Session.list(limit=limit, created={'gte': start_ts})
-    
-    synced = 0
-    errors = 0
-    
-    for session in sessions.data:
-        try:
-            sync_checkout_session_to_airtable(session)
-            synced += 1
-            print(f"  ✓ Session {session['id'][:12]}... sincronizado")
-        except Exception as e:
-            errors += 1
-            print(f"  ✗ Erro: {session['id'][:12]}... - {str(e)}")
+    start_ts = _start_ts("checkout_sessions", days_back, overlap)
+    sessions = stream_objects(stripe.checkout.Session.list, {"limit": limit, "created": {"gte": start_ts}})
+    result = _sync_entity("checkout_sessions", "Session", sessions, "Checkout_Sessions", "session_id",
+                          checkout_session_sync_fields)
+    synced, errors = result["synced"], result["errors"]
     
     print(f"Resultado: {synced} sincronizados, {errors} erros")
+    return {"synced": synced, "errors": errors}
 
 
-def sync_all_payouts(limit=100, days_back=365):
-    """Sincronizar todos os payouts dos últimos N dias."""
+def sync_all_payouts(limit=100, days_back=365, overlap=None):
+    """Sincronizar os payouts dos últimos N dias (ou desde o último checkpoint)."""
     print(f"A sincronizar payouts dos últimos {days_back} dias...")
     
-    start_ts = int((datetime.now() - timedelta(days=days_back)).timestamp())
-    payouts = stripe.Payout.list(limit=limit, created={'gte': start_ts})
+    start_ts = _start_ts("payouts", days_back, overlap)
+    payouts = stream_objects(stripe.Payout.list, {"limit": limit, "created": {"gte": start_ts}})
+    result = _sync_entity("payouts", "Payout", payouts, "Payouts", "payout_id", payout_sync_fields)
+    synced, errors = result["synced"], result["errors"]
+    
+    print(f"Resultado: {synced} sincronizados, {errors} erros")
+    log_action("sync", "sync_all_payouts", f"success" if errors == 0 else "partial", 
+               f"Sincronizados: {synced}, Erros: {errors}")
+    return {"synced": synced, "errors": errors}
+
+
+def sync_all_parallel(days_back=90, overlap=None, limit=100):
+    """
+    Corre as sincronizações das entidades ao mesmo tempo (uma thread por entidade).
+    Todas partilham o orçamento de pedidos do airtable_client (AIRTABLE_RATE_LIMIT/s),
+    que distribui os pedidos pela ordem de chegada: as escritas intercalam-se e o
+    tempo total fica perto do da entidade maior.
     
-    synced = 0
-    errors = 0
+    Returns:
+        {entity: {"synced", "errors", "seconds", "per_second", "airtable_requests"}}
+    """
+    jobs = {
+        "charges": lambda: sync_all_charges(limit=limit, days_back=days_back, overlap=overlap),
+        "customers": lambda: sync_all_customers(limit=limit, overlap=overlap),
+        "checkout_sessions": lambda: sync_all_checkout_sessions(limit=limit, days_back=days_back, overlap=overlap),
+        "payouts": lambda: sync_all_payouts(limit=limit, days_back=days_back, overlap=overlap),
+    }
+    report = {}
+    requests_before = airtable_request_counts()
     
-    for payout in payouts.data:
+    def run(entity, job):
+        start = time.monotonic()
         try:
-            sync_payout_to_airtable(payout)
-            synced += 1
-            print(f"  ✓ Payout {payout['id'][:12]}... sincronizado")
+            result = job()
         except Exception as e:
-            errors += 1
-            print(f"  ✗ Erro: {payout['id'][:12]}... - {str(e)}")
+            print(f"  ✗ Sync de {entity} falhou: {str(e)}")
+            result = {"synced": 0, "errors": 1}
+        seconds = time.monotonic() - start
+        report[entity] = {
+            **result,
+            "seconds": round(seconds, 1),
+            "per_second": round(result["synced"] / seconds, 2) if seconds else 0.0,
+        }
     
-    print(f"Resultado: {synced} sincronizados, {errors} erros")
-    log_action("sync", "sync_all_payouts", f"success" if errors == 0 else "partial", 
-               f"Sincronizados: {synced}, Erros: {errors}")
+    threads = [
+        threading.Thread(target=run, args=(entity, job), name=f"sync-{entity}")
+        for entity, job in jobs.items()
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    requests_after = airtable_request_counts()
+    for entity in report:
+        # Pedidos feitos pela thread da entidade e pelos workers do seu pipeline
+        prefix = f"sync-{entity}"
+        report[entity]["airtable_requests"] = sum(
+            count - requests_before.get(name, 0)
+            for name, count in requests_after.items() if name.startswith(prefix)
+        )
+    
+    print()
+    print(f"{'Entidade':<20}{'Sync':>8}{'Erros':>8}{'Tempo (s)':>11}{'Obj/s':>8}{'Pedidos':>9}")
+    for entity, stats in report.items():
+        print(f"{entity:<20}{stats['synced']:>8}{stats['errors']:>8}{stats['seconds']:>11}"
+              f"{stats['per_second']:>8}{stats['airtable_requests']:>9}")
+    log_action("sync", "sync_all_parallel",
+               "success" if not any(s["errors"] for s in report.values()) else "partial",
+               "; ".join(f"{e}: {s['synced']} em {s['seconds']}s ({s['per_second']}/s)" for e, s in report.items()))
+    return report
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sincronização Stripe → Airtable")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignorar checkpoints e fingerprints: reenviar a janela completa (days_back)")
+    parser.add_argument("--overlap", type=int, default=None,
+                        help="Segundos re-lidos antes do checkpoint (default: SYNC_OVERLAP_SECONDS ou 86400)")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Uma entidade de cada vez (por omissão correm em paralelo)")
+    parser.add_argument("--catch-up", action="store_true",
+                        help="Só reprocessar eventos Stripe em falta desde o último cursor (stripe_event_catchup)")
+    args = parser.parse_args()
+
     print("=" * 60)
     print("SINCRONIZAÇÃO STRIPE → AIRTABLE")
     print("=" * 60)
     
-    sync_all_charges(limit=100, days_back=90)
-    print()
-    sync_all_customers(limit=100)
-    print()
-    sync_all_checkout_sessions(limit=100, days_back=90)
-    print()
-    sync_all_payouts(limit=100, days_back=90)
+    if args.full:
+        for entity in SYNC_ENTITIES:
+            reset_checkpoint(entity)
+        forget_fingerprints()
+    
+    if args.catch_up:
+        from stripe_event_catchup import run_catchup
+        run_catchup()
+    elif args.sequential:
+        sync_all_charges(limit=100, days_back=90, overlap=args.overlap)
+        print()
+        sync_all_customers(limit=100, overlap=args.overlap)
+        print()
+        sync_all_checkout_sessions(limit=100, days_back=90, overlap=args.overlap)
+        print()
+        sync_all_payouts(limit=100, days_back=90, overlap=args.overlap)
+    else:
+        sync_all_parallel(days_back=90, overlap=args.overlap)
     
     print()
     print("=" * 60)
@@ -0,0 +1,210 @@
+"""
+Staged pipeline for bulk syncs: source → transform → enrich → render → write.
+
+Each stage runs its own worker threads and is connected to the next one by a
+bounded queue, so a slow stage (e.g. the Airtable writer) blocks the stages before
+it instead of letting work pile up in memory (backpressure), while the other stages
+keep the network and CPU busy. The end of the stream travels through the queues as
+a sentinel, one per downstream worker.
+
+    pipeline = Pipeline("charges", [
+        Stage("transform", build, workers=1),
+        Stage("enrich", scrape, workers=8),
+        Stage("write", write_batch, batch_size=10),
+    ], on_error=..., on_complete=...)
+    stats = pipeline.run(stream_objects(stripe.Charge.list, params))
+
+A stage function takes one item (or a list, for batch stages) and returns the
+item(s) for the next stage; returning None drops the item.
+"""
+
+import os
+import time
+import queue
+import threading
+from typing import Callable, Iterable, Dict, Any
+
+DEFAULT_QUEUE_SIZE = int(os.getenv("SYNC_QUEUE_SIZE", "100"))
+
+_STOP = object()
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable, workers: int = 1, batch_size: int = None):
+        """
+        Args:
+            name: stage name (stats, error reports)
+            func: callable(item) -> item | None, or callable(list) -> list | None with batch_size
+            workers: worker threads for this stage
+            batch_size: group items into lists of up to batch_size before calling func
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+
+
+class Pipeline:
+    def __init__(self, name: str, stages, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 on_error: Callable = None, on_complete: Callable = None):
+        """
+        Args:
+            name: pipeline name (thread names)
+            stages: list of Stage, in order
+            queue_size: capacity of each queue between stages
+            on_error: callable(item, stage_name, exc) for items that failed in a stage
+            on_complete: callable(item) for items that left the last stage
+        """
+        self.name = name
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.on_error = on_error
+        self.on_complete = on_complete
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._finished = {}
+
+    def _count(self, stage: str, key: str, value=1):
+        with self._lock:
+            self._stats[stage][key] += value
+
+    def _callback(self, callback: Callable, *args):
+        """Run on_error/on_complete; an exception there must not kill the worker (run() would hang)."""
+        try:
+            callback(*args)
+        except Exception as exc:
+            print(f"[ERROR] Pipeline {self.name}: {getattr(callback, '__name__', 'callback')} falhou: {str(exc)}")
+
+    def _fail(self, stage: str, items, exc: Exception):
+        self._count(stage, "errors", len(items))
+        if self.on_error:
+            for item in items:
+                self._callback(self.on_error, item, stage, exc)
+
+    def _emit(self, index: int, outputs, queues):
+        """Send a stage's outputs to the next queue (blocks when it is full)."""
+        for item in outputs:
+            if item is None:
+                continue
+            self._count(self.stages[index].name, "out")
+            if index + 1 < len(self.stages):
+                queues[index + 1].put(item)
+            elif self.on_complete:
+                self._callback(self.on_complete, item)
+
+    def _process(self, index: int, items, queues):
+        stage = self.stages[index]
+        start = time.monotonic()
+        try:
+            if stage.batch_size:
+                outputs = stage.func(items) or []
+            else:
+                outputs = [stage.func(items[0])]
+        except Exception as exc:
+            self._fail(stage.name, items, exc)
+            return
+        finally:
+            self._count(stage.name, "busy_seconds", time.monotonic() - start)
+        try:
+            self._emit(index, outputs, queues)
+        except Exception as exc:
+            print(f"[ERROR] Pipeline {self.name}: falha ao passar itens de {stage.name}: {str(exc)}")
+
+    def _worker(self, index: int, queues):
+        stage = self.stages[index]
+        inbox = queues[index]
+        batch = []
+        current = []
+        stopped = False
+        failure = None
+        try:
+            while True:
+                item = inbox.get()
+                if item is _STOP:
+                    stopped = True
+                    break
+                current = [item]
+                self._count(stage.name, "in")
+                if stage.batch_size:
+                    batch.append(item)
+                    current = []
+                    if len(batch) >= stage.batch_size:
+                        self._process(index, batch, queues)
+                        batch = []
+                else:
+                    self._process(index, [item], queues)
+                    current = []
+            if batch:
+                self._process(index, batch, queues)
+                batch = []
+        except Exception as exc:
+            failure = exc
+            print(f"[ERROR] Pipeline {self.name}: worker {stage.name} parou: {str(exc)}")
+        finally:
+            # Esvaziar a fila até ao sentinel para não bloquear a etapa anterior; os itens que
+            # ficam por processar vão para on_error, para o checkpoint não passar deles
+            unprocessed = batch + current
+            while not stopped:
+                item = inbox.get()
+                if item is _STOP:
+                    stopped = True
+                else:
+                    unprocessed.append(item)
+            if unprocessed:
+                self._fail(stage.name, unprocessed,
+                           failure or RuntimeError(f"worker {stage.name} parou antes de processar o item"))
+            with self._lock:
+                self._finished[index] += 1
+                last_worker = self._finished[index] == stage.workers
+            # O fim do stream segue sempre para a etapa seguinte, senão run() nunca termina
+            if last_worker and index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1].workers):
+                    queues[index + 1].put(_STOP)
+
+    def run(self, source: Iterable) -> Dict[str, Any]:
+        """
+        Feed source through the stages and wait until everything is processed.
+
+        Returns:
+            {"seconds": float, "source_error": str | None,
+             "stages": {name: {"in", "out", "errors", "busy_seconds", "workers"}}}
+        """
+        self._stats = {
+            stage.name: {"in": 0, "out": 0, "errors": 0, "busy_seconds": 0.0, "workers": stage.workers}
+            for stage in self.stages
+        }
+        self._finished = {index: 0 for index in range(len(self.stages))}
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        start = time.monotonic()
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker, args=(index, queues),
+                    name=f"{threading.current_thread().name}-{self.name}-{stage.name}-{n}", daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        source_error = None
+        try:
+            for item in source:
+                queues[0].put(item)
+        except Exception as exc:
+            # Fonte interrompida: o que já entrou é processado até ao fim
+            source_error = str(exc)
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_STOP)
+
+        for thread in threads:
+            thread.join()
+
+        for stats in self._stats.values():
+            stats["busy_seconds"] = round(stats["busy_seconds"], 2)
+        return {
+            "seconds": round(time.monotonic() - start, 2),
+            "source_error": source_error,
+            "stages": self._stats
+        }
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Nenhum teste escreve no .purosuco_state do projeto
+os.environ["PUROSUCO_STATE_DIR"] = tempfile.mkdtemp(prefix="purosuco_tests_")
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    """Diretório de estado próprio do teste (SQLite novos)."""
+    monkeypatch.setenv("PUROSUCO_STATE_DIR", str(tmp_path))
+    return tmp_path
@@ -0,0 +1,97 @@
+import pytest
+
+import admission_store
+from admission_store import AdmissionStore, AdmissionWriter
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class _HTTPError(Exception):
+    """Como requests.HTTPError: traz a resposta."""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = _Response(status_code)
+
+
+@pytest.fixture
+def store(state_dir, monkeypatch):
+    monkeypatch.setattr(admission_store, "log_action", lambda *args, **kwargs: None)
+    monkeypatch.setattr(admission_store, "ADMISSION_MAX_ATTEMPTS", 2)
+    return AdmissionStore()
+
+
+def _airtable(monkeypatch, fail):
+    """upsert_records falso: fail(ticket_ids) devolve a exceção a lançar ou None."""
+    calls = []
+
+    def upsert_records(table, records, merge_on=None):
+        ticket_ids = [record["ticket_id"] for record in records]
+        calls.append(ticket_ids)
+        exc = fail(ticket_ids)
+        if exc:
+            raise exc
+
+    monkeypatch.setattr(admission_store, "upsert_records", upsert_records)
+    return calls
+
+
+def test_try_admit_admite_uma_so_vez(store):
+    admitted, _ = store.try_admit("t1", gate="A")
+    again, admission = store.try_admit("t1", gate="B")
+    assert admitted and not again
+    assert admission["gate"] == "A"
+
+
+def test_lote_recusado_e_repetido_linha_a_linha(store, monkeypatch):
+    calls = _airtable(monkeypatch, lambda ids: _HTTPError(422) if "bad" in ids else None)
+    for ticket_id in ("bad", "t1", "t2"):
+        store.try_admit(ticket_id)
+
+    assert AdmissionWriter(store).flush_once() == 2
+    assert calls == [["bad", "t1", "t2"], ["bad"], ["t1"], ["t2"]]
+    assert store.get("t1")["synced"] == 1
+    assert store.get("bad")["attempts"] == 1
+
+
+def test_linha_recusada_fica_parada_apos_max_tentativas(store, monkeypatch):
+    _airtable(monkeypatch, lambda ids: _HTTPError(422))
+    store.try_admit("bad")
+    writer = AdmissionWriter(store)
+    for _ in range(2):
+        with pytest.raises(_HTTPError):
+            writer.flush_once()
+
+    assert store.pending_count() == 0
+    assert store.parked_count() == 1
+    assert writer.flush_once() == 0
+
+
+def test_falha_de_rede_nao_gasta_tentativas(store, monkeypatch):
+    down = [True]
+    _airtable(monkeypatch, lambda ids: ConnectionError("sem rede") if down[0] else None)
+    store.try_admit("t1")
+    writer = AdmissionWriter(store)
+    for _ in range(5):
+        with pytest.raises(ConnectionError):
+            writer.flush_once()
+
+    row = store.get("t1")
+    assert row["attempts"] == 0
+    assert row["last_error"] == "sem rede"
+    assert store.parked_count() == 0
+
+    down[0] = False
+    assert writer.flush_once() == 1
+    assert store.pending_count() == 0
+
+
+def test_erro_5xx_e_transitorio(store, monkeypatch):
+    _airtable(monkeypatch, lambda ids: _HTTPError(503))
+    store.try_admit("t1")
+    with pytest.raises(_HTTPError):
+        AdmissionWriter(store).flush_once()
+    assert store.get("t1")["attempts"] == 0
@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+import job_queue
+
+
+@pytest.fixture
+def queue(state_dir, monkeypatch):
+    monkeypatch.setattr(job_queue, "_conn", None)
+    monkeypatch.setattr(job_queue, "_handlers", {})
+    monkeypatch.setattr(job_queue, "_wakeup", {})
+    monkeypatch.setattr(job_queue, "_workers", [])
+    return job_queue
+
+
+def _row(queue, key):
+    return dict(queue._db().execute("SELECT * FROM jobs WHERE job_key = ?", (key,)).fetchone())
+
+
+def test_job_corre_e_fica_done(queue):
+    seen = []
+    queue.register_handler("k", lambda payload: seen.append(payload["v"]))
+    queue.enqueue("k", "a", {"v": 1})
+    assert queue.run_pending("k") == 1
+    assert seen == [1]
+    assert _row(queue, "a")["status"] == "done"
+
+
+def test_enqueue_durante_execucao_volta_a_correr_com_payload_novo(queue):
+    seen = []
+
+    def handler(payload):
+        seen.append(payload["v"])
+        if payload["v"] == 1:
+            # Reentrega do webhook enquanto o job corre
+            queue.enqueue("k", "a", {"v": 2})
+        return True
+
+    queue.register_handler("k", handler)
+    queue.enqueue("k", "a", {"v": 1})
+    assert queue.run_pending("k") == 2
+    assert seen == [1, 2]
+    assert _row(queue, "a")["status"] == "done"
+
+
+def test_enqueue_sem_rerun_done_nao_repete(queue):
+    seen = []
+    queue.register_handler("k", lambda payload: seen.append(payload["v"]))
+    queue.enqueue("k", "a", {"v": 1}, rerun_done=False)
+    queue.run_pending("k")
+    assert not queue.enqueue("k", "a", {"v": 2}, rerun_done=False)
+    assert queue.run_pending("k") == 0
+    assert seen == [1]
+
+
+def test_falha_volta_a_fila_com_backoff(queue):
+    queue.register_handler("k", lambda payload: False)
+    queue.enqueue("k", "a", {})
+    assert queue.run_pending("k") == 1
+    row = _row(queue, "a")
+    assert row["status"] == "pending"
+    assert row["attempts"] == 1
+    assert row["next_run_at"] > time.time()
+
+
+def test_lease_expirado_e_reclamado(queue):
+    queue.register_handler("k", lambda payload: True)
+    queue.enqueue("k", "a", {})
+    queue._db().execute(
+        "UPDATE jobs SET status = 'running', owner = 'outro:1', lease_until = ? WHERE job_key = 'a'",
+        (time.time() - 1,)
+    )
+    job = queue._claim("k")
+    assert job["key"] == "a"
+    assert _row(queue, "a")["owner"] == queue.WORKER_ID
+
+
+def test_lease_valido_de_outro_processo_nao_e_reclamado(queue):
+    queue.register_handler("k", lambda payload: True)
+    queue.enqueue("k", "a", {})
+    queue._db().execute(
+        "UPDATE jobs SET status = 'running', owner = 'outro:1', lease_until = ? WHERE job_key = 'a'",
+        (time.time() + 100,)
+    )
+    assert queue._claim("k") is None
+
+
+def test_start_workers_so_repoe_jobs_deste_worker_ou_expirados(queue):
+    for key in ("vivo", "expirado", "meu"):
+        queue.enqueue("k", key, {})
+    queue._db().execute(
+        "UPDATE jobs SET status = 'running', owner = 'outro:1', lease_until = ? WHERE job_key = 'vivo'",
+        (time.time() + 100,)
+    )
+    queue._db().execute(
+        "UPDATE jobs SET status = 'running', owner = 'outro:1', lease_until = ? WHERE job_key = 'expirado'",
+        (time.time() - 1,)
+    )
+    queue._db().execute(
+        "UPDATE jobs SET status = 'running', owner = ?, lease_until = ? WHERE job_key = 'meu'",
+        (queue.WORKER_ID, time.time() + 100)
+    )
+    # Sem handlers registados: só a reposição, nenhuma thread
+    queue.start_workers()
+    assert _row(queue, "vivo")["status"] == "running"
+    assert _row(queue, "expirado")["status"] == "pending"
+    assert _row(queue, "meu")["status"] == "pending"
+
+
+def test_finish_de_job_reclamado_por_outro_nao_escreve(queue):
+    queue.register_handler("k", lambda payload: True)
+    queue.enqueue("k", "a", {})
+    job = queue._claim("k")
+    queue._db().execute("UPDATE jobs SET owner = 'outro:1' WHERE job_key = 'a'")
+    queue._finish("k", job)
+    assert _row(queue, "a")["status"] == "running"
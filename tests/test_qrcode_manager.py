@@ -0,0 +1,107 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import qrcode_manager
+from admission_store import AdmissionStore, AdmissionWriter
+from ticket_signing import sign_ticket_payload
+
+
+@pytest.fixture
+def index(state_dir, monkeypatch):
+    """Índice vazio e fresco, sem Airtable nem thread de escrita."""
+    monkeypatch.setenv("QR_SIGNING_SECRET", "segredo-de-teste")
+    monkeypatch.setattr(qrcode_manager, "log_action", lambda *args, **kwargs: None)
+    monkeypatch.setattr(qrcode_manager, "log_ticket_validation", lambda *args, **kwargs: None)
+    monkeypatch.setattr(qrcode_manager.ticket_stats, "record_ticket_validated", lambda *args, **kwargs: None)
+    monkeypatch.setattr(qrcode_manager, "_validated_locally", {})
+
+    def no_lookup(field, values):
+        raise AssertionError("bilhetes assinados não devem ir ao Airtable")
+
+    monkeypatch.setattr(qrcode_manager, "_find_ticket_records", no_lookup)
+
+    store = AdmissionStore()
+    writer = AdmissionWriter(store)
+    monkeypatch.setattr(writer, "start", lambda: None)
+    monkeypatch.setattr(qrcode_manager, "_admission_store", store)
+    monkeypatch.setattr(qrcode_manager, "_admission_writer", writer)
+
+    index = qrcode_manager.TicketIndex()
+    index._watermark = datetime.now(tz=timezone.utc)
+    monkeypatch.setattr(qrcode_manager, "ticket_index", index)
+    return index
+
+
+def _ticket(ticket_id, charge_id, issue_version=1, status="pending"):
+    return {"ticket_id": ticket_id, "charge_id": charge_id, "issue_version": issue_version, "status": status}
+
+
+def test_bilhete_indexado_e_aceite(index):
+    index.put(_ticket("t1", "ch_1"))
+    assert qrcode_manager._offline_ticket("t1", 1)["ticket_data"]["ticket_id"] == "t1"
+
+
+def test_indice_desatualizado_fica_pendente(index):
+    index.put(_ticket("t1", "ch_1"))
+    index._watermark = None
+    assert qrcode_manager._offline_ticket("t1", 1)["pending"]
+
+
+def test_bilhete_fora_do_indice_fica_pendente(index):
+    assert qrcode_manager._offline_ticket("t1", 1)["pending"]
+
+
+def test_bilhete_substituido_e_revogado(index):
+    index.put(_ticket("t1", "ch_1"))
+    index.put(_ticket("t2", "ch_1", issue_version=2))
+    assert qrcode_manager._offline_ticket("t1", 1)["revoked"]
+    assert "ticket_data" in qrcode_manager._offline_ticket("t2", 2)
+
+
+def test_versao_antiga_do_qr_e_revogada(index):
+    index.put(_ticket("t1", "ch_1", issue_version=2))
+    assert qrcode_manager._offline_ticket("t1", 1)["revoked"]
+
+
+def test_validate_many_admite_so_bilhetes_confirmados_pelo_indice(index):
+    index.put(_ticket("t1", "ch_1"))
+    index.put(_ticket("old", "ch_2"))
+    index.put(_ticket("new", "ch_2", issue_version=2))
+    payloads = [
+        sign_ticket_payload("t1", 1),
+        sign_ticket_payload("t1", 1),
+        sign_ticket_payload("ghost", 1),
+        sign_ticket_payload("old", 1),
+    ]
+
+    outcomes = qrcode_manager.validate_many(payloads, admit_gate="A")
+
+    assert outcomes[0]["success"] and outcomes[0]["admitted"]
+    assert outcomes[1]["duplicate_in_batch"]
+    assert not outcomes[2]["success"] and outcomes[2]["pending"]
+    assert not outcomes[3]["success"] and not outcomes[3]["pending"]
+    store = qrcode_manager._admission_store
+    assert store.get("t1") is not None
+    assert store.get("ghost") is None
+    assert store.get("old") is None
+
+
+def test_validate_many_com_indice_frio_nao_admite(index):
+    index.put(_ticket("t1", "ch_1"))
+    index._watermark = None
+
+    outcomes = qrcode_manager.validate_many([sign_ticket_payload("t1", 1)], admit_gate="A")
+
+    assert outcomes[0]["pending"] and not outcomes[0]["success"]
+    assert qrcode_manager._admission_store.get("t1") is None
+
+
+def test_validate_many_recusa_assinatura_invalida(index):
+    index.put(_ticket("t1", "ch_1"))
+    forged = sign_ticket_payload("t1", 1)[:-2] + "xx"
+
+    outcomes = qrcode_manager.validate_many([forged], admit_gate="A")
+
+    assert not outcomes[0]["success"]
+    assert qrcode_manager._admission_store.get("t1") is None
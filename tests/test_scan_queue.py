@@ -0,0 +1,47 @@
+import scan_queue
+from scan_queue import ScanQueue
+
+
+def _clock(monkeypatch, start=1000.0):
+    now = [start]
+    monkeypatch.setattr(scan_queue.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_leitura_repetida_dentro_do_cooldown_e_descartada(monkeypatch):
+    now = _clock(monkeypatch)
+    queue = ScanQueue(cooldown=10)
+    assert queue.put("TICKET:a:1:sig")
+    now[0] += 5
+    assert not queue.put("TICKET:a:1:sig")
+    assert len(queue) == 1
+
+
+def test_cooldown_nao_e_prolongado_por_leituras_repetidas(monkeypatch):
+    now = _clock(monkeypatch)
+    queue = ScanQueue(cooldown=10)
+    assert queue.put("TICKET:a:1:sig")
+    # Código continua à frente da câmara
+    for _ in range(9):
+        now[0] += 1
+        assert not queue.put("TICKET:a:1:sig")
+    now[0] += 1.5
+    assert queue.put("TICKET:a:1:sig")
+
+
+def test_release_permite_nova_leitura_depois_de_pendente(monkeypatch):
+    now = _clock(monkeypatch)
+    queue = ScanQueue(cooldown=10)
+    assert queue.put("TICKET:a:1:sig")
+    queue.drain()
+    now[0] += 1
+    queue.release("TICKET:a:1:sig")
+    assert queue.put("TICKET:a:1:sig")
+
+
+def test_drain_devolve_por_ordem_e_esvazia():
+    queue = ScanQueue(cooldown=10)
+    queue.put("a")
+    queue.put("b")
+    assert [data for data, _ in queue.drain()] == ["a", "b"]
+    assert len(queue) == 0
@@ -0,0 +1,86 @@
+import types
+
+import pytest
+
+import stripe_cache
+from stripe_cache import StripeObjectCache
+
+
+@pytest.fixture
+def fake_stripe(monkeypatch):
+    """Módulo stripe falso que regista cada retrieve."""
+    calls = []
+
+    def resource(name):
+        def retrieve(object_id, **params):
+            calls.append((name, object_id, params))
+            return {"id": object_id, "object": name.lower()}
+        return types.SimpleNamespace(retrieve=retrieve)
+
+    fake = types.SimpleNamespace(
+        Charge=resource("Charge"),
+        PaymentIntent=resource("PaymentIntent"),
+        checkout=types.SimpleNamespace(Session=resource("Session")),
+    )
+    monkeypatch.setattr(stripe_cache, "stripe", fake)
+    return calls
+
+
+@pytest.fixture
+def cache(state_dir, monkeypatch):
+    cache = StripeObjectCache(ttl=600, persist=False)
+    monkeypatch.setattr(stripe_cache, "_cache", cache)
+    return cache
+
+
+def test_objeto_com_expand_serve_pedido_sem_expand(cache, fake_stripe):
+    stripe_cache.prime("Charge", [{"id": "ch_1"}], expand=["customer"])
+    assert stripe_cache.retrieve("Charge", "ch_1") == {"id": "ch_1"}
+    assert stripe_cache.retrieve("Charge", "ch_1", expand=["customer"]) == {"id": "ch_1"}
+    assert fake_stripe == []
+
+
+def test_expand_em_falta_vai_a_stripe(cache, fake_stripe):
+    stripe_cache.prime("Charge", [{"id": "ch_1"}])
+    stripe_cache.retrieve("Charge", "ch_1", expand=["customer"])
+    assert fake_stripe == [("Charge", "ch_1", {"expand": ["customer"]})]
+    # A cópia nova (com customer) passa a servir os dois pedidos
+    stripe_cache.retrieve("Charge", "ch_1")
+    assert len(fake_stripe) == 1
+
+
+def test_recurso_com_ponto(cache, fake_stripe):
+    stripe_cache.retrieve("checkout.Session", "cs_1")
+    stripe_cache.retrieve("checkout.Session", "cs_1")
+    assert fake_stripe == [("Session", "cs_1", {})]
+
+
+def test_update_from_event_guarda_checkout_session(cache, fake_stripe):
+    session = {"id": "cs_1", "object": "checkout.session", "status": "complete"}
+    stripe_cache.update_from_event({"data": {"object": session}})
+    assert stripe_cache.retrieve("checkout.Session", "cs_1") == session
+    assert fake_stripe == []
+
+
+def test_update_from_event_substitui_copia_antiga(cache, fake_stripe):
+    stripe_cache.prime("PaymentIntent", [{"id": "pi_1", "status": "processing"}], expand=["latest_charge"])
+    fresh = {"id": "pi_1", "object": "payment_intent", "status": "succeeded"}
+    stripe_cache.update_from_event({"data": {"object": fresh}})
+    assert stripe_cache.retrieve("PaymentIntent", "pi_1") == fresh
+
+
+def test_evento_repetido_so_invalida(cache, fake_stripe):
+    stripe_cache.prime("Charge", [{"id": "ch_1", "amount": 1}])
+    old = {"id": "ch_1", "object": "charge", "amount": 0}
+    stripe_cache.update_from_event({"data": {"object": old}}, replay=True)
+    assert stripe_cache.retrieve("Charge", "ch_1") == {"id": "ch_1", "object": "charge"}
+    assert len(fake_stripe) == 1
+
+
+def test_cache_persistente_entre_processos(state_dir, fake_stripe, monkeypatch):
+    monkeypatch.setattr(stripe_cache, "_cache", StripeObjectCache(persist=True))
+    stripe_cache.prime("Charge", [{"id": "ch_1"}], expand=["customer"])
+    # Outro processo: memória vazia, mesma base de dados
+    monkeypatch.setattr(stripe_cache, "_cache", StripeObjectCache(persist=True))
+    assert stripe_cache.retrieve("Charge", "ch_1") == {"id": "ch_1"}
+    assert fake_stripe == []
@@ -0,0 +1,75 @@
+"""
+In-memory pre-filters for QR validation: a Bloom filter of issued ticket ids and a
+short-TTL negative cache for unknown ids / payloads. Both let bogus or foreign QR
+codes be rejected without Airtable requests or Logs writes.
+"""
+
+import math
+import time
+import hashlib
+import threading
+
+
+class BloomFilter:
+    """Compact probabilistic set: no false negatives, ~error_rate false positives."""
+
+    def __init__(self, capacity: int = 1000, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.sha256(item.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    @property
+    def saturated(self) -> bool:
+        """True once more items were added than the filter was sized for."""
+        return self.count > self.capacity
+
+
+class NegativeCache:
+    """Remembers misses (unknown ticket ids, invalid payloads) for ttl seconds."""
+
+    def __init__(self, ttl: float = 60, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: str, reason: str = None):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (time.monotonic() + self.ttl, reason)
+
+    def get(self, key: str):
+        """Cached reason for a recent miss, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1] or "not found"
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
@@ -0,0 +1,91 @@
+"""
+Signed QR payloads for tickets.
+
+Format: TICKET:<ticket_id>:<issue_version>:<signature>
+The signature is a truncated HMAC-SHA256 (base64url) over "<ticket_id>:<issue_version>",
+so scanners can check authenticity locally without querying Airtable.
+Legacy payloads (TICKET:<ticket_id>:<email>) are still parsed.
+"""
+
+import os
+import hmac
+import base64
+import hashlib
+from typing import Optional, Dict, Any
+
+QR_PREFIX = "TICKET"
+DEFAULT_ISSUE_VERSION = 1
+SIGNATURE_BYTES = 16
+
+
+def _get_secret() -> Optional[bytes]:
+    secret = os.getenv("QR_SIGNING_SECRET")
+    return secret.encode("utf-8") if secret else None
+
+
+def signing_enabled() -> bool:
+    """True if QR_SIGNING_SECRET is configured."""
+    return _get_secret() is not None
+
+
+def unsigned_allowed() -> bool:
+    """Legacy unsigned payloads are accepted unless QR_ALLOW_UNSIGNED is false."""
+    return os.getenv("QR_ALLOW_UNSIGNED", "true").strip().lower() not in ("0", "false", "no")
+
+
+def _signature(secret: bytes, ticket_id: str, issue_version: int) -> str:
+    message = f"{ticket_id}:{issue_version}".encode("utf-8")
+    digest = hmac.new(secret, message, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+
+def sign_ticket_payload(ticket_id: str, issue_version: int = DEFAULT_ISSUE_VERSION) -> Optional[str]:
+    """Build a signed QR payload, or None if no signing secret is configured."""
+    secret = _get_secret()
+    if not secret:
+        return None
+    return f"{QR_PREFIX}:{ticket_id}:{issue_version}:{_signature(secret, ticket_id, issue_version)}"
+
+
+def parse_ticket_payload(qrcode_data: str) -> Dict[str, Any]:
+    """
+    Parse and verify a QR payload locally.
+
+    Returns:
+        {"valid_format": bool, "ticket_id": str, "signed": bool,
+         "verified": bool, "issue_version": int, "error": str}
+        verified is True only for signed payloads whose HMAC matches.
+    """
+    result = {
+        "valid_format": False,
+        "ticket_id": None,
+        "signed": False,
+        "verified": False,
+        "issue_version": None,
+        "error": None
+    }
+    if not qrcode_data or not qrcode_data.startswith(f"{QR_PREFIX}:"):
+        result["error"] = "QR code format inválido"
+        return result
+
+    parts = qrcode_data.split(":")
+    if len(parts) < 2 or not parts[1]:
+        result["error"] = "QR code format inválido"
+        return result
+
+    result["valid_format"] = True
+    result["ticket_id"] = parts[1]
+
+    if len(parts) == 4 and parts[2].isdigit():
+        result["signed"] = True
+        result["issue_version"] = int(parts[2])
+        secret = _get_secret()
+        if not secret:
+            # Sem segredo local não é possível verificar; quem chama decide (ex: consulta Airtable)
+            return result
+        expected = _signature(secret, result["ticket_id"], result["issue_version"])
+        if hmac.compare_digest(expected, parts[3]):
+            result["verified"] = True
+        else:
+            result["error"] = "Assinatura do QR code inválida"
+    return result
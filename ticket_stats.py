@@ -0,0 +1,248 @@
+"""
+Incrementally maintained ticket statistics.
+
+Counters (total, validated, pending, per ticket_type, per gate, per 5-minute bucket)
+are updated in a local SQLite store whenever a ticket is created or validated, so
+reading them is O(1). reconcile() rebuilds them now and then from a projected scan
+of the Airtable Tickets table to correct any drift; tickets recorded (by any process)
+while the scan runs keep their local row, marked by stats_tickets.touched_at.
+"""
+
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+
+from airtable_client import list_records
+from local_state import connect
+
+STATS_DB = "ticket_stats.db"
+BUCKET_MINUTES = 5
+STATS_FIELDS = ["ticket_id", "charge_id", "ticket_type", "status", "validated_at", "validated_by"]
+
+_conn = None
+_conn_lock = threading.Lock()
+_write_lock = threading.Lock()
+_reconcile_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = connect(STATS_DB)
+            _conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS stats_tickets (
+                    ticket_id TEXT PRIMARY KEY,
+                    charge_id TEXT,
+                    ticket_type TEXT,
+                    validated INTEGER NOT NULL DEFAULT 0,
+                    gate TEXT,
+                    bucket TEXT,
+                    touched_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_stats_tickets_charge ON stats_tickets (charge_id);
+                CREATE TABLE IF NOT EXISTS stats_counters (
+                    name TEXT NOT NULL,
+                    key TEXT NOT NULL DEFAULT '',
+                    value INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (name, key)
+                );
+                CREATE TABLE IF NOT EXISTS stats_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                """
+            )
+            # ticket_stats.db criados antes da coluna touched_at
+            columns = {row["name"] for row in _conn.execute("PRAGMA table_info(stats_tickets)")}
+            if "touched_at" not in columns:
+                _conn.execute("ALTER TABLE stats_tickets ADD COLUMN touched_at REAL")
+        return _conn
+
+
+def _bucket(ts_iso: Optional[str]) -> Optional[str]:
+    """5-minute bucket label (UTC) for an ISO timestamp, e.g. '2026-02-01T21:35'."""
+    if not ts_iso:
+        return None
+    try:
+        dt = datetime.fromisoformat(ts_iso.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    dt = dt.replace(minute=dt.minute - dt.minute % BUCKET_MINUTES, second=0, microsecond=0)
+    return dt.strftime("%Y-%m-%dT%H:%M")
+
+
+def _incr(conn, name: str, key: str = "", delta: int = 1):
+    conn.execute(
+        "INSERT INTO stats_counters (name, key, value) VALUES (?, ?, ?) "
+        "ON CONFLICT(name, key) DO UPDATE SET value = value + excluded.value",
+        (name, key or "", delta)
+    )
+
+
+def _apply_row(conn, row: dict, sign: int):
+    """Add (sign=1) or remove (sign=-1) one ticket row's contribution to the counters."""
+    _incr(conn, "total", delta=sign)
+    _incr(conn, "ticket_type", row.get("ticket_type") or "", sign)
+    if row.get("validated"):
+        _incr(conn, "validated", delta=sign)
+        _incr(conn, "gate", row.get("gate") or "", sign)
+        if row.get("bucket"):
+            _incr(conn, "bucket", row["bucket"], sign)
+    else:
+        _incr(conn, "pending", delta=sign)
+
+
+def record_ticket_created(ticket_id: str, charge_id: str = None, ticket_type: str = None):
+    """Count a newly generated ticket (a regenerated ticket replaces the previous one for the charge)."""
+    conn = _db()
+    with _write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM stats_tickets WHERE ticket_id = ?", (ticket_id,)).fetchone():
+                conn.execute("COMMIT")
+                return
+            if charge_id:
+                for old in conn.execute("SELECT * FROM stats_tickets WHERE charge_id = ?", (charge_id,)).fetchall():
+                    _apply_row(conn, dict(old), -1)
+                    conn.execute("DELETE FROM stats_tickets WHERE ticket_id = ?", (old["ticket_id"],))
+            row = {"ticket_id": ticket_id, "charge_id": charge_id, "ticket_type": ticket_type, "validated": 0}
+            conn.execute(
+                "INSERT INTO stats_tickets (ticket_id, charge_id, ticket_type, validated, touched_at) "
+                "VALUES (?, ?, ?, 0, ?)",
+                (ticket_id, charge_id, ticket_type, time.time())
+            )
+            _apply_row(conn, row, 1)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def record_ticket_validated(ticket_id: str, gate: str = None, validated_at: str = None):
+    """Count a ticket validation (idempotent per ticket)."""
+    conn = _db()
+    validated_at = validated_at or datetime.now(tz=timezone.utc).isoformat()
+    with _write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = conn.execute("SELECT * FROM stats_tickets WHERE ticket_id = ?", (ticket_id,)).fetchone()
+            if existing and existing["validated"]:
+                conn.execute("COMMIT")
+                return
+            if existing:
+                _apply_row(conn, dict(existing), -1)
+            row = dict(existing) if existing else {"ticket_id": ticket_id, "charge_id": None, "ticket_type": None}
+            row.update(validated=1, gate=gate, bucket=_bucket(validated_at))
+            conn.execute(
+                "INSERT OR REPLACE INTO stats_tickets "
+                "(ticket_id, charge_id, ticket_type, validated, gate, bucket, touched_at) VALUES (?, ?, ?, 1, ?, ?, ?)",
+                (ticket_id, row.get("charge_id"), row.get("ticket_type"), row["gate"], row["bucket"], time.time())
+            )
+            _apply_row(conn, row, 1)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def reconcile() -> int:
+    """
+    Rebuild the counters from a projected scan of the Tickets table.
+    Validations recorded locally but not yet written to Airtable are kept, and so are
+    tickets recorded (touched_at) after the scan started, by this or another process:
+    the scan runs outside any lock.
+    Returns the number of tickets counted.
+    """
+    with _reconcile_lock:
+        scan_started = time.time()
+        return _rebuild(list(list_records("Tickets", fields=STATS_FIELDS)), scan_started)
+
+
+def _rebuild(records: list, scan_started: float) -> int:
+    conn = _db()
+    with _write_lock:
+        # BEGIN IMMEDIATE: nenhum outro processo escreve entre a leitura das linhas locais e a reconstrução
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            local_validated = {
+                row["ticket_id"]: dict(row)
+                for row in conn.execute("SELECT * FROM stats_tickets WHERE validated = 1").fetchall()
+            }
+            rows = {}
+            for record in records:
+                fields = record.get("fields", {})
+                ticket_id = fields.get("ticket_id")
+                if not ticket_id:
+                    continue
+                row = {
+                    "ticket_id": ticket_id,
+                    "charge_id": fields.get("charge_id"),
+                    "ticket_type": fields.get("ticket_type"),
+                    "validated": 0,
+                    "gate": None,
+                    "bucket": None,
+                    "touched_at": None
+                }
+                if (fields.get("status") or "").lower() == "validated":
+                    row.update(validated=1, gate=fields.get("validated_by"), bucket=_bucket(fields.get("validated_at")))
+                elif ticket_id in local_validated:
+                    local = local_validated[ticket_id]
+                    row.update(validated=1, gate=local.get("gate"), bucket=local.get("bucket"),
+                               touched_at=local.get("touched_at"))
+                rows[ticket_id] = row
+
+            # Escritas feitas durante o scan: a linha local é mais recente que o Airtable lido
+            touched = conn.execute(
+                "SELECT * FROM stats_tickets WHERE touched_at >= ? ORDER BY touched_at", (scan_started,)
+            ).fetchall()
+            for local in touched:
+                local = dict(local)
+                if local.get("charge_id"):
+                    # Bilhete regenerado: o anterior do mesmo charge deixa de contar
+                    for other in [t for t, r in rows.items()
+                                  if r["charge_id"] == local["charge_id"] and t != local["ticket_id"]]:
+                        del rows[other]
+                rows[local["ticket_id"]] = local
+
+            conn.execute("DELETE FROM stats_tickets")
+            conn.execute("DELETE FROM stats_counters")
+            for row in rows.values():
+                conn.execute(
+                    "INSERT INTO stats_tickets (ticket_id, charge_id, ticket_type, validated, gate, bucket, touched_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (row["ticket_id"], row["charge_id"], row["ticket_type"], row["validated"], row["gate"],
+                     row["bucket"], row.get("touched_at"))
+                )
+                _apply_row(conn, row, 1)
+            conn.execute(
+                "INSERT OR REPLACE INTO stats_meta (key, value) VALUES ('reconciled_at', ?)",
+                (datetime.now(tz=timezone.utc).isoformat(),)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return len(rows)
+
+
+def reconciled_at() -> Optional[datetime]:
+    row = _db().execute("SELECT value FROM stats_meta WHERE key = 'reconciled_at'").fetchone()
+    return datetime.fromisoformat(row["value"]) if row else None
+
+
+def get_counters() -> Dict[str, Any]:
+    """Current counters: total, validated, pending, by_ticket_type, by_gate, by_bucket."""
+    counters = {"total": 0, "validated": 0, "pending": 0, "by_ticket_type": {}, "by_gate": {}, "by_bucket": {}}
+    grouped = {"ticket_type": "by_ticket_type", "gate": "by_gate", "bucket": "by_bucket"}
+    for row in _db().execute("SELECT name, key, value FROM stats_counters").fetchall():
+        if row["name"] in grouped:
+            if row["value"]:
+                counters[grouped[row["name"]]][row["key"] or "N/A"] = row["value"]
+        else:
+            counters[row["name"]] = row["value"]
+    return counters
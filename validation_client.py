@@ -0,0 +1,90 @@
+"""
+Cliente HTTP do serviço de validação partilhado (validation_service.py).
+Ativo quando VALIDATION_SERVICE_URL está definido (ex: http://192.168.1.10:8600).
+Os pedidos levam VALIDATION_SERVICE_TOKEN no cabeçalho X-Validation-Token.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+
+import requests
+
+_session = requests.Session()
+
+
+def get_service_url():
+    url = os.getenv("VALIDATION_SERVICE_URL")
+    return url.rstrip("/") if url else None
+
+
+def _headers() -> dict:
+    token = os.getenv("VALIDATION_SERVICE_TOKEN")
+    return {"X-Validation-Token": token} if token else {}
+
+
+def admit_remote(qrcode_data: str, gate: str = None, validated_by: str = None, timeout: float = 3) -> dict:
+    """POST /admit no serviço partilhado. Devolve o mesmo dict que qrcode_manager.admit."""
+    resp = _session.post(
+        f"{get_service_url()}/admit",
+        json={"qrcode_data": qrcode_data, "gate": gate, "validated_by": validated_by},
+        headers=_headers(),
+        timeout=timeout
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+def check_remote(ticket_id: str, timeout: float = 3) -> dict:
+    resp = _session.get(f"{get_service_url()}/check/{ticket_id}", headers=_headers(), timeout=timeout)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def recent_remote(limit: int = 50, timeout: float = 3) -> list:
+    resp = _session.get(f"{get_service_url()}/recent", params={"limit": limit}, headers=_headers(), timeout=timeout)
+    resp.raise_for_status()
+    return resp.json().get("admissions", [])
+
+
+def iter_events(read_timeout: float = 30):
+    """
+    GET /events: gera cada evento (dict) enviado pelo serviço, até a ligação cair.
+    O serviço manda um keep-alive a cada 15s, por isso read_timeout > 15.
+    """
+    with requests.get(f"{get_service_url()}/events", headers=_headers(), stream=True,
+                      timeout=(3, read_timeout)) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines(decode_unicode=True):
+            if line and line.startswith("data: "):
+                yield json.loads(line[len("data: "):])
+
+
+class EventFeed:
+    """
+    Subscrição de /events numa thread própria: guarda os últimos eventos (mais recente
+    primeiro) e volta a ligar-se se a ligação cair.
+    """
+
+    def __init__(self, max_events: int = 200, retry_seconds: float = 5):
+        self.retry_seconds = retry_seconds
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="validation-events", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                for event in iter_events():
+                    with self._lock:
+                        self._events.appendleft(event)
+            except Exception as exc:
+                print(f"[WARN] Ligação a /events perdida: {str(exc)}")
+            time.sleep(self.retry_seconds)
+
+    def recent(self, limit: int = 50) -> list:
+        with self._lock:
+            return list(self._events)[:limit]
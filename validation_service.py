@@ -0,0 +1,158 @@
+"""
+Serviço local de validação partilhado por todas as entradas (gates).
+
+Todas as estações de leitura falam com este serviço, que guarda as entradas num
+único SQLite (WAL) e deteta duplicados entre entradas na hora. As novas entradas
+são enviadas às outras estações por Server-Sent Events (GET /events).
+
+Todos os endpoints (exceto /health) exigem o cabeçalho X-Validation-Token igual a
+VALIDATION_SERVICE_TOKEN, definido no .env do serviço e de cada estação.
+
+Execução:
+    uvicorn validation_service:app --host 0.0.0.0 --port 8600
+"""
+
+import os
+import hmac
+import json
+import asyncio
+import logging
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+from qrcode_manager import admit, validate_many, get_admission_store, ticket_index
+
+load_dotenv()
+
+VALIDATION_SERVICE_TOKEN = os.getenv("VALIDATION_SERVICE_TOKEN")
+
+
+def require_token(x_validation_token: str = Header(None)):
+    """Token partilhado entre o serviço e as estações (o serviço escuta em 0.0.0.0)."""
+    if not VALIDATION_SERVICE_TOKEN:
+        raise HTTPException(status_code=500, detail="VALIDATION_SERVICE_TOKEN ausente.")
+    if not x_validation_token or not hmac.compare_digest(x_validation_token, VALIDATION_SERVICE_TOKEN):
+        raise HTTPException(status_code=401, detail="Token de validação inválido.")
+
+
+app = FastAPI(title="PuroSuco Validation Service")
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("validation_service")
+
+# Uma fila por estação ligada a /events
+_subscribers = set()
+
+
+class AdmitRequest(BaseModel):
+    qrcode_data: str
+    gate: str = None
+    validated_by: str = None
+
+
+def _publish(event: dict):
+    for queue in list(_subscribers):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Estação lenta: descarta em vez de bloquear as restantes
+            logger.warning("Fila de eventos cheia; evento descartado para um subscritor")
+
+
+@app.on_event("startup")
+async def startup():
+    get_admission_store()
+    ticket_index.start_background_refresh()
+
+
+@app.post("/admit", dependencies=[Depends(require_token)])
+async def admit_ticket(body: AdmitRequest):
+    result = await run_in_threadpool(admit, body.qrcode_data, body.gate, body.validated_by)
+    _publish({
+        "type": "admitted" if result.get("admitted") else (
+            "duplicate" if result.get("already_validated") else ("pending" if result.get("pending") else "rejected")
+        ),
+        "ticket_id": result.get("ticket_id"),
+        "gate": body.gate,
+        "validated_by": body.validated_by,
+        "validated_at": result.get("validated_at"),
+        "error": result.get("error")
+    })
+    return result
+
+
+class BatchRequest(BaseModel):
+    payloads: list
+    gate: str = None
+    validated_by: str = None
+    admit: bool = False
+
+
+@app.post("/validate_many", dependencies=[Depends(require_token)])
+async def validate_batch(body: BatchRequest):
+    """Replay buffered scans in one request; with admit=true the valid ones are admitted."""
+    outcomes = await run_in_threadpool(
+        validate_many, body.payloads, (body.gate or "principal") if body.admit else None, body.validated_by
+    )
+    for outcome in outcomes:
+        if outcome.get("admitted"):
+            _publish({
+                "type": "admitted",
+                "ticket_id": outcome.get("ticket_id"),
+                "gate": body.gate,
+                "validated_by": body.validated_by,
+                "validated_at": outcome.get("validated_at"),
+                "error": None
+            })
+    return {"results": outcomes}
+
+
+@app.get("/check/{ticket_id}", dependencies=[Depends(require_token)])
+async def check_ticket(ticket_id: str):
+    admission = get_admission_store().get(ticket_id)
+    ticket = ticket_index.get(ticket_id)
+    return {
+        "ticket_id": ticket_id,
+        "admitted": admission is not None,
+        "admission": admission,
+        "ticket_data": ticket
+    }
+
+
+@app.get("/recent", dependencies=[Depends(require_token)])
+async def recent_admissions(limit: int = 50):
+    store = get_admission_store()
+    return {
+        "admissions": store.recent(limit=min(limit, 500)),
+        "pending_writes": store.pending_count(),
+        "parked_writes": store.parked_count()
+    }
+
+
+@app.get("/events", dependencies=[Depends(require_token)])
+async def events(request: Request):
+    queue = asyncio.Queue(maxsize=1000)
+    _subscribers.add(queue)
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                    yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+                except asyncio.TimeoutError:
+                    # Keep-alive para proxies não fecharem a ligação
+                    yield ": ping\n\n"
+        finally:
+            _subscribers.discard(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "healthy", "service": "validation", "tickets_indexed": len(ticket_index)}
@@ -5,15 +5,18 @@ import stripe
 from fastapi import FastAPI, Request, HTTPException
 from dotenv import load_dotenv
 
-from airtable_client import upsert_record
+from record_fingerprints import upsert_record_if_changed, upsert_records_if_changed
 from stripe_airtable_payloads import (
     build_event_fields,
     build_customer_fields_from_charge,
     build_customer_fields_from_session,
     build_charge_fields,
     build_payment_intent_fields,
-    build_checkout_session_fields
+    build_checkout_session_fields,
+    merge_customer_fields
 )
+from stripe_expand import object_id, latest_charge
+import stripe_cache
 
 load_dotenv()
 
@@ -31,72 +34,90 @@ logger = logging.getLogger("stripe_webhook")
 
 def store_event(event):
     fields = build_event_fields(event)
-    upsert_record("Stripe_Events", fields, merge_on="event_id")
+    upsert_record_if_changed("Stripe_Events", fields, merge_on="event_id")
 
 
-def upsert_customer_from_charge(charge):
-    fields = build_customer_fields_from_charge(charge)
+def _upsert_customer(fields, customers=None):
     if not fields.get("customer_id") and not fields.get("email"):
         return
-    upsert_record("Customers", fields, merge_on="customer_id")
+    if customers is not None:
+        # Lote: o cliente é escrito uma vez no fim (upsert_customers)
+        customers.append(fields)
+        return
+    upsert_record_if_changed("Customers", fields, merge_on="customer_id")
 
 
-def upsert_customer_from_session(session):
-    fields = build_customer_fields_from_session(session)
-    if not fields.get("customer_id") and not fields.get("email"):
-        return
-    upsert_record("Customers", fields, merge_on="customer_id")
+def upsert_customer_from_charge(charge, customers=None):
+    _upsert_customer(build_customer_fields_from_charge(charge), customers)
+
+
+def upsert_customer_from_session(session, customers=None):
+    _upsert_customer(build_customer_fields_from_session(session), customers)
+
 
+def upsert_customers(customers):
+    """
+    Escreve os clientes acumulados num lote, um registo por cliente (merge_customer_fields).
+    customers deve vir do mais recente para o mais antigo.
+    """
+    return upsert_records_if_changed("Customers", merge_customer_fields(customers), merge_on="customer_id")
 
-def handle_charge_succeeded(charge):
+
+def handle_charge_succeeded(charge, customers=None):
     fields = build_charge_fields(charge)
-    upsert_record("Charges", fields, merge_on="charge_id")
-    upsert_customer_from_charge(charge)
+    upsert_record_if_changed("Charges", fields, merge_on="charge_id")
+    upsert_customer_from_charge(charge, customers)
 
 
 def handle_payment_intent_succeeded(pi):
-    charge_id = None
-    receipt_url = None
-    charges = pi.get("charges", {}).get("data", [])
-    if charges:
-        charge_id = charges[0].get("id")
-        receipt_url = charges[0].get("receipt_url")
+    charge = latest_charge(pi)
+    charge_id = object_id(pi.get("latest_charge")) or (charge or {}).get("id")
+    receipt_url = (charge or {}).get("receipt_url")
 
     fields = build_payment_intent_fields(pi, charge_id=charge_id, receipt_url=receipt_url)
-    upsert_record("Payment_Intents", fields, merge_on="payment_intent_id")
+    upsert_record_if_changed("Payment_Intents", fields, merge_on="payment_intent_id")
 
 
-def _resolve_receipt_url_from_payment_intent(payment_intent_id):
-    if not payment_intent_id:
+def _resolve_receipt_url_from_payment_intent(payment_intent):
+    """receipt_url do charge do PaymentIntent; só chama a Stripe se não vier expandido."""
+    if not payment_intent:
         return None
+    charge = latest_charge(payment_intent)
+    if charge:
+        return charge.get("receipt_url")
     try:
-        pi = stripe.PaymentIntent.retrieve(payment_intent_id, expand=["charges.data"])
-        charges = pi.get("charges", {}).get("data", []) if isinstance(pi, dict) else pi.charges.data
-        if charges:
-            return charges[0].get("receipt_url")
+        pi = stripe_cache.retrieve("PaymentIntent", object_id(payment_intent), expand=["latest_charge"])
+        return (latest_charge(pi) or {}).get("receipt_url")
     except Exception:
         return None
-    return None
 
 
-def handle_checkout_session_completed(session):
+def handle_checkout_session_completed(session, customers=None):
     receipt_url = _resolve_receipt_url_from_payment_intent(session.get("payment_intent"))
     fields = build_checkout_session_fields(session, receipt_url=receipt_url)
-    upsert_record("Checkout_Sessions", fields, merge_on="session_id")
-    upsert_customer_from_session(session)
-
-
-def handle_event(event):
-    store_event(event)
+    upsert_record_if_changed("Checkout_Sessions", fields, merge_on="session_id")
+    upsert_customer_from_session(session, customers)
+
+
+def handle_event(event, customers=None, replay=False):
+    """
+    Processa um evento Stripe. Com customers (lista), os clientes são acumulados em vez
+    de escritos, para o chamador os escrever de uma vez com upsert_customers.
+    replay=True (catch-up): o objeto do evento pode estar desatualizado e não entra na cache.
+    O evento só é registado em Stripe_Events depois dos handlers terem corrido sem erro:
+    o catch-up salta os eventos que lá estão.
+    """
+    stripe_cache.update_from_event(event, replay=replay)
     event_type = event.get("type")
     data_obj = event.get("data", {}).get("object", {})
 
     if event_type == "charge.succeeded":
-        handle_charge_succeeded(data_obj)
+        handle_charge_succeeded(data_obj, customers)
     elif event_type == "payment_intent.succeeded":
         handle_payment_intent_succeeded(data_obj)
     elif event_type == "checkout.session.completed":
-        handle_checkout_session_completed(data_obj)
+        handle_checkout_session_completed(data_obj, customers)
+    store_event(event)
 
 
 @app.post("/webhook")
@@ -18,12 +18,15 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 from stripe_airtable_sync import (
     set_stripe_key,
+    start_background_jobs,
     sync_charge_to_airtable,
     sync_customer_to_airtable,
     sync_checkout_session_to_airtable,
     sync_payout_to_airtable
 )
 from app_logger import log_action
+from job_queue import job_counts
+import stripe_cache
 
 STRIPE_API_KEY = os.getenv("STRIPE_API_KEY")
 WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
@@ -35,6 +38,9 @@ if not STRIPE_API_KEY or not WEBHOOK_SECRET:
 set_stripe_key(STRIPE_API_KEY)
 stripe.api_key = STRIPE_API_KEY
 
+# Recibos e tickets correm em workers de fundo: o webhook responde após escrever o charge
+start_background_jobs()
+
 app = Flask(__name__)
 
 
@@ -64,6 +70,7 @@ def stripe_webhook():
     # Processar evento
     event_type = event['type']
     data_object = event['data']['object']
+    stripe_cache.update_from_event(event)
 
     print(f"📥 Webhook recebido: {event_type}")
     log_action("webhook", f"receive_{event_type}", "success", 
@@ -73,17 +80,17 @@ def stripe_webhook():
     try:
         if event_type == 'charge.succeeded':
             charge = data_object
-            sync_charge_to_airtable(charge, auto_generate_ticket=True)
-            print(f"✅ Charge {charge['id']} sincronizado com ticket gerado")
+            sync_charge_to_airtable(charge, auto_generate_ticket=True, background=True)
+            print(f"✅ Charge {charge['id']} sincronizado; recibo e ticket em fila")
 
         elif event_type == 'charge.failed':
             charge = data_object
-            sync_charge_to_airtable(charge, auto_generate_ticket=False)
+            sync_charge_to_airtable(charge, auto_generate_ticket=False, background=True)
             print(f"⚠️  Charge {charge['id']} falhou - sincronizado sem ticket")
 
         elif event_type == 'charge.updated':
             charge = data_object
-            sync_charge_to_airtable(charge, auto_generate_ticket=False)
+            sync_charge_to_airtable(charge, auto_generate_ticket=False, background=True)
             print(f"🔄 Charge {charge['id']} atualizado")
 
         elif event_type == 'checkout.session.completed':
@@ -125,7 +132,7 @@ def stripe_webhook():
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
-    return jsonify({'status': 'healthy', 'service': 'stripe-webhook'}), 200
+    return jsonify({'status': 'healthy', 'service': 'stripe-webhook', 'jobs': job_counts()}), 200
 
 
 @app.route('/', methods=['GET'])